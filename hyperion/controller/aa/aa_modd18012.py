@@ -14,6 +14,7 @@ import serial
 from time import sleep
 from hyperion import logging
 from hyperion.controller.base_controller import BaseController
+from hyperion.tools.port_tools import FramedReader, holds_port, port_lock, port_manager
 
 
 class AaModd18012(BaseController):
@@ -41,6 +42,11 @@ class AaModd18012(BaseController):
 
     MODES = {'internal': 0, 'external': 1}  # for individual commands
 
+    # number of lines the driver replies to a command, by the first letter of the command:
+    # L (line settings, also the compound ones like L1F100D22O1I1), S (state of all lines), E (store).
+    # It can be changed with the setting 'reply_lines'. If fewer lines arrive, the read waits for the read timeout.
+    REPLY_LINES = {'L': 1, 'S': 9, 'E': 1}
+
     BLANKING = 0  # channel for blanking
 
     # limits
@@ -66,6 +72,11 @@ class AaModd18012(BaseController):
         self._port = settings['port']
         self.dummy = settings['dummy']
         self.rsc = None
+        self._reader = None
+        self._port_lock = port_lock(None if self.dummy else self._port)
+        self.reply_lines = dict(self.REPLY_LINES)
+        if 'reply_lines' in settings:
+            self.reply_lines.update(settings['reply_lines'])
         self.logger.info('Class Aa_modd18012 init. Created object.')
 
     def initialize(self):
@@ -75,11 +86,14 @@ class AaModd18012(BaseController):
         if self.dummy:
             self.logger.info('Dummy device initialized')
         else:
-            self.rsc = serial.Serial(port=self._port,
-                                     baudrate=self.DEFAULTS['baudrate'],
-                                     timeout=self.DEFAULTS['read_timeout'],
-                                     write_timeout=self.DEFAULTS['write_timeout']
-                                     )
+            self.rsc = port_manager.open_serial(self._port,
+                                                baudrate=self.DEFAULTS['baudrate'],
+                                                timeout=self.DEFAULTS['read_timeout'],
+                                                write_timeout=self.DEFAULTS['write_timeout']
+                                                )
+            self._reader = FramedReader(self.rsc,
+                                        terminator=self.DEFAULTS['read_termination'].encode(self.DEFAULTS['encoding']),
+                                        timeout=self.DEFAULTS['read_timeout'])
 
             self.logger.info('Initialized device AOTF at port {}.'.format(self._port))
         self._is_initialized = True
@@ -89,13 +103,15 @@ class AaModd18012(BaseController):
 
          """
         if self.rsc is not None:
-            self.rsc.close()
-            sleep(0.5)
+            port_manager.release(self.rsc)
+            if not self.rsc.is_open:
+                sleep(0.5)
             self.logger.info('The connection to aa_modd18012 is closed.')
             self._is_initialized = False
 
         self.logger.info('Finalized the AOTF controller class')
 
+    @holds_port
     def write(self, message):
         """ Sends the message to the device.
 
@@ -116,11 +132,15 @@ class AaModd18012(BaseController):
         self.logger.debug('Ans: {}'.format(ans))
         return ans
 
-    def read(self):
+    @holds_port
+    def read(self, lines=None):
         """ Reads message from the device. It reads until the buffer is clean.
+        If the number of lines is given, it returns as soon as they have arrived.
 
+        :param lines: number of lines to read; None (default) reads until the read timeout expires
+        :type lines: int
         :return: The messages in the buffer of the device. It removes the end of line characters.
-        :rtype: string
+        :rtype: list of strings
 
         """
         if self.rsc is None:
@@ -132,43 +152,77 @@ class AaModd18012(BaseController):
             self.logger.debug('reading from dummy device')
             response = self.rsc.read()
         else:
-            reading = True
-            msgs = []
-            while reading:
-                msg = str(self.rsc.readline(), encoding=self.DEFAULTS['encoding'])
-                if msg == '':
-                    reading = False
-                # self.logger.debug('Received message: {}'.format(msg))
-                msg = msg.replace("\n", "")  # remove the end of line
-                # self.logger.debug('Removed \\n: {}'.format(msg))
-                msg = msg.replace("\r", "")  # remove the end of line
-                # self.logger.debug('Removed \\r: {}'.format(msg))
-                msgs.append(msg)
-                self.logger.debug('Received message: {}'.format(msg))
-                response = [x for x in msgs if x != '']
+            if lines is None:
+                raw = []
+                frame = self._reader.read_until()
+                while frame:
+                    raw.append(frame)
+                    frame = self._reader.read_until()
+            else:
+                raw = self._reader.read_frames(lines)
+            msgs = [str(msg, encoding=self.DEFAULTS['encoding']) for msg in raw]
+            msgs = [msg.replace("\n", "").replace("\r", "") for msg in msgs]  # remove the end of line
+            self.logger.debug('Received messages: {}'.format(msgs))
+            response = [x for x in msgs if x != '']
         return response
 
-    def query(self, message):
+    def expected_lines(self, message):
+        """ Number of reply lines the driver sends for the command message (see REPLY_LINES).
+
+        :param message: command
+        :type message: string
+        :return: number of lines, or None if not known
+        :rtype: int
+        """
+        if not message:
+            return None
+        return self.reply_lines.get(message[0].upper())
+
+    @holds_port
+    def query(self, message, lines=None):
         """ Writes and Reads the answer from the device.
-            Basically this method is a write followed by a read with a 10ms wait in the middle.
+            Basically this method is a write followed by a read. The read returns as soon as the expected
+            reply of the command has arrived (see expected_lines), or after the read timeout if it is not known.
 
             :param message: Message to be passed to the serial port.
             :type message: string
+            :param lines: number of reply lines, None (default) uses expected_lines(message)
+            :type lines: int
             :returns: The reply from the device.
-            :rtype: string
+            :rtype: list of strings
 
             """
         if self.rsc is None:
             raise Warning('Trying to query from device before initializing.')
 
+        if lines is None:
+            lines = self.expected_lines(message)
+        if self._reader is not None:
+            self._reader.reset()
         ans = self.write(message)
         self.logger.debug('Sent message: {}.'.format(message))
         self.logger.debug('Received message: {}'.format(ans))
-        sleep(0.01)
-        ans = self.read()
+        ans = self.read(lines)
+        if lines is not None and len(ans) < lines:
+            self.logger.warning('Expected {} reply lines to {}, received {}'.format(lines, message, len(ans)))
         self.logger.debug('Received message: {}.'.format(ans))
         return ans
 
+    @holds_port
+    def query_batch(self, messages):
+        """ Sends several commands in one write and reads all the replies.
+            It returns as soon as the expected replies of all commands have arrived.
+
+            :param messages: commands to send
+            :type messages: list of strings
+            :returns: The replies from the device.
+            :rtype: list of strings
+
+            """
+        expected = [self.expected_lines(msg) for msg in messages]
+        lines = None if None in expected else sum(expected)
+        return self.query(self.DEFAULTS['write_termination'].join(messages), lines=lines)
+
     def set_frequency(self, channel, freq):
         """This function sets RF frequency for a given channel.
         The device has 8 channels.
@@ -327,6 +381,7 @@ class AaModd18012(BaseController):
 
     def set_all(self, channel, freq, power, state, mode):
         """ Sets Frequency, power, and state of channel.
+        It is sent as one compound command (e.g. L1F100D22O1I1), in one write.
 
         :param channel: channel to use (can be from 1 to 8 inclusive)
         :type channel: int
@@ -341,6 +396,13 @@ class AaModd18012(BaseController):
 
 
         """
+        msg = self._set_all_message(channel, freq, power, state, mode)
+        self.logger.debug('Message to send: {}'.format(msg))
+        ans = self.query(msg)
+        return ans
+
+    def _set_all_message(self, channel, freq, power, state, mode):
+        """ Checks the values and builds the compound command of set_all. """
         if mode == 'internal':
             mode_value = 1
         elif mode == 'external':
@@ -352,13 +414,19 @@ class AaModd18012(BaseController):
         channel, new_freq = self.check_freq(channel, freq)
         self.check_power(power)
 
-        if state:
-            msg = "L{}F{}D{}O1I{}".format(channel, new_freq, power, mode_value)
-        else:
-            msg = "L{}F{}D{}O0I{}".format(channel, new_freq, power, mode_value)
-        self.logger.debug('Message to send: {}'.format(msg))
-        ans = self.query(msg)
-        return ans
+        return "L{}F{}D{}O{}I{}".format(channel, new_freq, power, int(bool(state)), mode_value)
+
+    def set_all_channels(self, values):
+        """ Sets Frequency, power, state and mode of several channels in one write (see set_all).
+
+        :param values: for each channel a tuple (channel, freq, power, state, mode)
+        :type values: list of tuples
+        :return: the replies of the device
+        :rtype: list of strings
+        """
+        messages = [self._set_all_message(*v) for v in values]
+        self.logger.debug('Messages to send: {}'.format(messages))
+        return self.query_batch(messages)
 
     def get_states(self):
         """ Gets the status of all the channels
@@ -7,13 +7,40 @@ Agilent 33522A controller
 This is the controller class for the Agilent 33522A function generator.
 Based on pyvisa to send commands to the USB.
 
+Configuring the device with one command per message (and sleeps in between) is slow. Commands can be
+collected in a batch: they are sent as one message, separated by ';', followed by ``*OPC?`` so the
+controller waits exactly until the device has executed them. The error queue (``SYST:ERR?``) is checked
+once per batch.
+
+:Example:
+
+    with gen.batch() as errors:
+        gen.set_waveform(1, 'SIN')
+        gen.set_frequency(1, 1000)
+        gen.enable_output(1, True)
+    # here the commands are executed, errors is the list of errors reported by the device
+
+Arbitrary waveforms are sent as binary blocks (``DATA:ARB:DAC`` with int16 or ``DATA:ARB`` with float32),
+so a pattern that would otherwise be stepped from Python runs on the device with its own sample clock:
+
+    gen.upload_arb(1, np.sin(np.linspace(0, 2 * np.pi, 1000)), sample_rate=1e6, name='SINE')
+    gen.upload_arb(1, np.linspace(-1, 1, 1000), sample_rate=1e6, name='RAMP', clear=False)
+    gen.upload_sequence(1, 'PATTERN', [('SINE', 10), ('RAMP', 1)], sample_rate=1e6)
+
 :copyright: 2020by Hyperion Authors, see AUTHORS for more details.
 :license: BSD, see LICENSE for more details.
 """
-import visa
+import os
+import re
 import time
-from hyperion import logging
+from contextlib import contextmanager
+import yaml
+import numpy as np
+from pyvisa import constants, VisaIOError
+from hyperion import logging, package_path
 from hyperion.controller.base_controller import BaseController
+from hyperion.tools.port_tools import holds_port, port_lock, port_manager
+from hyperion.tools.array_tools import array_to_ieee_block, ieee_block_to_array
 
 
 class Agilent33522A(BaseController):
@@ -32,13 +59,21 @@ class Agilent33522A(BaseController):
 
     CHANNELS = [1,2]
     FUNCTIONS = ['SIN', 'SQU', 'TRI', 'RAMP', 'PULS', 'PRBS', 'NOIS', 'ARB', 'DC']
+    MAX_BATCH_LENGTH = 1000     # maximum number of characters sent in one message by write_batch
+    MIN_ARB_POINTS = 8
+    MAX_ARB_POINTS = 1000000    # points in one arbitrary waveform (standard memory); longer ones become a sequence
+    MAX_SEQUENCE_STEPS = 512
+    WRITE_CHUNK = 2 ** 20       # bytes per write when sending a binary block
 
     def __init__(self, settings):
         super().__init__()
         self.logger = logging.getLogger(__name__)
         self.rsc = None
+        self._port_lock = port_lock(None)
         self.instrument_id = settings['instrument_id']
         self.dummy = settings['dummy']
+        self._batch = None          # list of commands waiting to be sent, while in a batch
+        self._batch_errors = None
         self.logger.info('Created controller class for Agilent33522A with id: {}'.format(self.instrument_id))
         self.logger.info('Dummy mode: {}'.format(self.dummy))
 
@@ -47,13 +82,14 @@ class Agilent33522A(BaseController):
 
         """
         self.resource_name = 'USB0::2391::' + str(self.instrument_id) + '::MY50003703::INSTR'
+        self._port_lock = port_lock(self.resource_name)
         self.logger.info('Initializing device: {}'.format(self.resource_name))
         if self.dummy:
             self.logger.info('Dummy device initialized')
         else:
-            rm = visa.ResourceManager()
-            self.rsc = rm.open_resource(self.resource_name)
-            time.sleep(0.5)
+            self.rsc = port_manager.open_visa(self.resource_name)
+            if port_manager.users(self.rsc) == 1:
+                time.sleep(0.5)
 
         self._is_initialized = True
 
@@ -68,17 +104,23 @@ class Agilent33522A(BaseController):
 
                 else:
                     self.logger.debug('Close real connection')
-                    self.rsc.close()
+                    port_manager.release(self.rsc)
             self.logger.info('Connection closed.')
 
+    @holds_port
     def write(self, msg):
         """ Write in the device buffer
         :param msg: message to write to the device
         :type msg: string
         """
+        if self._batch is not None:
+            self.logger.debug('Adding to batch: {}'.format(msg))
+            self._batch.append(msg)
+            return
         self.logger.debug('Writing to device: {}'.format(msg))
         self.rsc.write(msg)
 
+    @holds_port
     def read(self):
         """ Read buffer
 
@@ -88,16 +130,131 @@ class Agilent33522A(BaseController):
         self.logger.debug('Response: {}'.format(ans))
         return ans
 
+    @holds_port
     def query(self, msg):
         """ Sequential read and write
         :param msg: message to write to the device
         :type msg: string
         """
+        self._flush_batch()     # the commands in the batch have to be executed before the query
         self.logger.debug('Query: {}'.format(msg))
         ans = self.rsc.query(msg)
         self.logger.debug('Answer from device: {}'.format(ans))
         return ans
 
+    def _flush_batch(self):
+        """ Sends the commands collected in the batch so far (if in a batch)."""
+        if self._batch:
+            commands, self._batch = self._batch, []
+            self._batch_errors.extend(self.write_batch(commands))
+
+    @holds_port
+    def write_binary(self, header, data):
+        """ Sends a command that ends with an IEEE-488.2 binary block. Large blocks are written in
+        pieces of WRITE_CHUNK bytes, with the end of message only after the last one.
+
+        :param header: command before the block, e.g. 'SOUR1:DATA:ARB:DAC MYARB,'
+        :type header: string
+        :param data: the values, with the data type and byte order expected by the device
+        :type data: numpy.ndarray
+        """
+        self._flush_batch()
+        message = header.encode('ascii') + array_to_ieee_block(data) + b'\n'
+        self.logger.debug('Writing {} bytes to device: {}'.format(len(message), header))
+        try:
+            for start in range(0, len(message), self.WRITE_CHUNK):
+                self.rsc.send_end = start + self.WRITE_CHUNK >= len(message)
+                self.rsc.write_raw(message[start:start + self.WRITE_CHUNK])
+        finally:
+            self.rsc.send_end = True
+
+    def _batch_message(self, commands):
+        """ Joins commands in one message. Every command gets a leading ':' so it is interpreted
+        from the root of the command tree, and not relative to the previous command.
+
+        :param commands: list of commands
+        :type commands: list
+        :return: message
+        :rtype: string
+        """
+        return ';'.join(cmd if cmd.startswith(('*', ':')) else ':' + cmd for cmd in commands)
+
+    @holds_port
+    def read_errors(self):
+        """ Reads the error queue of the device until it is empty.
+
+        :return: list of errors (empty if there are none)
+        :rtype: list
+        """
+        errors = []
+        for k in range(20):     # the error queue of the device holds at most 20 errors
+            ans = self.rsc.query('SYST:ERR?').strip()
+            if ans.startswith(('+0,', '0,')):
+                break
+            errors.append(ans)
+        return errors
+
+    @holds_port
+    def write_batch(self, commands, check_errors=True):
+        """ Sends the commands separated by ';' in as few messages as possible (of at most MAX_BATCH_LENGTH
+        characters) and waits with ``*OPC?`` until the device has executed them. Then the error queue is read once.
+
+        :param commands: list of commands, e.g. ['SOUR1:FUNC SIN', 'OUTPUT1 ON']
+        :type commands: list
+        :param check_errors: read the error queue of the device afterwards
+        :type check_errors: logical
+        :return: list of errors reported by the device
+        :rtype: list
+        """
+        chunk = []
+        for cmd in list(commands) + [None]:
+            if chunk and (cmd is None or len(self._batch_message(chunk + [cmd, '*OPC?'])) > self.MAX_BATCH_LENGTH):
+                msg = self._batch_message(chunk + ['*OPC?'])
+                self.logger.debug('Writing batch to device: {}'.format(msg))
+                self.rsc.query(msg)
+                chunk = []
+            if cmd is not None:
+                chunk.append(cmd)
+        if not check_errors:
+            return []
+        errors = self.read_errors()
+        for error in errors:
+            self.logger.warning('Agilent33522A reported error: {}'.format(error))
+        return errors
+
+    @contextmanager
+    def batch(self):
+        """ Context manager that collects all the commands written inside it (also by the set methods)
+        and sends them with write_batch when it ends (or before a query).
+        It holds the port lock until it ends, so other threads wait with their commands instead of adding them to
+        the batch (or sending it half-built with a query).
+        If the code inside it raises an exception, the commands that were not sent yet are discarded.
+
+        :return: list that gets the errors reported by the device for the batch
+        :rtype: list
+        """
+        with self._port_lock.hold():
+            if self._batch is not None:
+                # nested batch: the outer one sends the commands
+                yield self._batch_errors
+                return
+            self._batch = []
+            self._batch_errors = errors = []
+            try:
+                yield errors
+            except BaseException:
+                if self._batch:
+                    self.logger.warning('Discarding {} commands of the batch because of an exception'.format(
+                        len(self._batch)))
+                raise
+            else:
+                commands = self._batch
+                self._batch = None
+                errors.extend(self.write_batch(commands))
+            finally:
+                self._batch = None
+                self._batch_errors = None
+
     def idn(self):
         """Ask the device for its identification
 
@@ -105,9 +262,7 @@ class Agilent33522A(BaseController):
         :rtype: string
 
         """
-        ans = self.query('*IDN?')
-        time.sleep(0.1)
-        return ans
+        return self.query('*IDN?')
 
     def get_enable_output(self, channel):
         """ Get the status of the output. 0 is off, 1 is on.
@@ -120,13 +275,12 @@ class Agilent33522A(BaseController):
         self.check_channel(channel)
         ans = self.query('OUTPUT{}?'.format(channel))
 
-        if not self.dummy:
-            if int(ans) == 0:
-                self.logger.debug('Channel {} output is OFF'.format(channel))
-                ans = False
-            elif int(ans) == 1:
-                self.logger.debug('Channel {} output is ON'.format(channel))
-                ans = True
+        if int(ans) == 0:
+            self.logger.debug('Channel {} output is OFF'.format(channel))
+            ans = False
+        elif int(ans) == 1:
+            self.logger.debug('Channel {} output is ON'.format(channel))
+            ans = True
 
         return ans
 
@@ -418,6 +572,280 @@ class Agilent33522A(BaseController):
         self.logger.info('Frequency for channel {} is {} Hz. '.format(channel, ans[:-1]))
         return ans[:-1]
 
+    # ## ARBITRARY WAVEFORMS
+
+    def check_arb_name(self, name):
+        """ Checks the name of an arbitrary waveform or sequence: at most 12 letters, digits or _,
+        starting with a letter.
+
+        :param name: name of the waveform
+        :type name: string
+        :return: the name
+        :rtype: string
+        """
+        if re.match(r'^[A-Za-z]\w{0,11}$', name) is None:
+            raise NameError('Invalid name for an arbitrary waveform: "{}". Use at most 12 letters, digits or _, '
+                            'starting with a letter.'.format(name))
+        return name
+
+    def _send_arb(self, channel, name, samples, dtype):
+        """ Sends one arbitrary waveform as binary block (the byte order must be set to SWAP)."""
+        if len(samples) < self.MIN_ARB_POINTS:
+            raise Warning('An arbitrary waveform needs at least {} points.'.format(self.MIN_ARB_POINTS))
+        if dtype == 'int16':
+            data = np.round(samples * 32767).astype('<i2')
+            self.write_binary('SOUR{}:DATA:ARB:DAC {},'.format(channel, name), data)
+        elif dtype == 'float32':
+            data = samples.astype('<f4')
+            self.write_binary('SOUR{}:DATA:ARB {},'.format(channel, name), data)
+        else:
+            raise Warning('Data type {} not supported, use int16 or float32.'.format(dtype))
+        self.logger.debug('Sent arbitrary waveform {} with {} points to channel {}'.format(name, len(samples), channel))
+
+    def upload_arb(self, channel, samples, sample_rate, name='HYP_ARB', dtype='int16', clear=True):
+        """ Uploads an arbitrary waveform to the volatile memory of the channel, as binary block, and plays it
+        with the given sample rate. It does not change the output state.
+
+        A waveform longer than MAX_ARB_POINTS is split in segments (named name000, name001, ...) that are
+        played one after the other as a sequence with this name.
+
+        :param channel: number of channel. it can be 1 or 2 for this model
+        :type channel: int
+        :param samples: values between -1 and 1, they are scaled by the amplitude and offset of the channel
+        :type samples: numpy.ndarray
+        :param sample_rate: sample rate in Sa/s
+        :type sample_rate: float
+        :param name: name of the waveform on the device
+        :type name: string
+        :param dtype: 'int16' sends the DAC values (DATA:ARB:DAC, 2 bytes per point),
+                      'float32' sends the values (DATA:ARB, 4 bytes per point)
+        :type dtype: string
+        :param clear: clear the volatile memory of the channel first
+        :type clear: logical
+        :return: list of errors reported by the device
+        :rtype: list
+        """
+        self.check_channel(channel)
+        self.check_arb_name(name)
+        samples = np.asarray(samples, dtype=float).ravel()
+        if len(samples) and np.abs(samples).max() > 1:
+            raise Warning('The samples of an arbitrary waveform have to be between -1 and 1.')
+        segments = int(np.ceil(len(samples) / self.MAX_ARB_POINTS))
+        with self.batch() as errors:
+            if clear:
+                self.write('SOUR{}:DATA:VOL:CLE'.format(channel))
+            self.write('FORM:BORD SWAP')    # little-endian, like numpy on a PC
+            if segments <= 1:
+                self._send_arb(channel, name, samples, dtype)
+            else:
+                names = ['{}{:03d}'.format(name[:9], k) for k in range(segments)]
+                for seg_name, seg in zip(names, np.array_split(samples, segments)):
+                    self._send_arb(channel, seg_name, seg, dtype)
+                self.write(self._sequence_command(channel, name, [(seg_name, 1) for seg_name in names]))
+            self.play_arb(channel, name, sample_rate)
+        return errors
+
+    def _sequence_command(self, channel, name, steps):
+        """ Command that defines a sequence of arbitrary waveforms (see upload_sequence)."""
+        if not 0 < len(steps) <= self.MAX_SEQUENCE_STEPS:
+            raise Warning('A sequence has between 1 and {} steps.'.format(self.MAX_SEQUENCE_STEPS))
+        description = '"{}"'.format(self.check_arb_name(name))
+        for arb, repeat in steps:
+            if repeat < 1:
+                raise Warning('The repeat count of a step of a sequence is at least 1.')
+            description += ',"{}",{},{},maintain,4'.format(arb, int(repeat), 'repeat' if repeat > 1 else 'once')
+        length = str(len(description))
+        return 'SOUR{}:DATA:SEQ #{}{}{}'.format(channel, len(length), length, description)
+
+    def upload_sequence(self, channel, name, steps, sample_rate):
+        """ Defines a sequence of arbitrary waveforms that are already uploaded to the channel
+        (with upload_arb(..., clear=False)) and plays it. The whole sequence runs on the device.
+
+        :param channel: number of channel. it can be 1 or 2 for this model
+        :type channel: int
+        :param name: name of the sequence
+        :type name: string
+        :param steps: list of (name of a waveform, number of times it is repeated)
+        :type steps: list
+        :param sample_rate: sample rate in Sa/s
+        :type sample_rate: float
+        :return: list of errors reported by the device
+        :rtype: list
+        """
+        self.check_channel(channel)
+        with self.batch() as errors:
+            self.write(self._sequence_command(channel, name, steps))
+            self.play_arb(channel, name, sample_rate)
+        return errors
+
+    def play_arb(self, channel, name, sample_rate):
+        """ Plays an arbitrary waveform or sequence that is in the volatile memory of the channel.
+
+        :param channel: number of channel. it can be 1 or 2 for this model
+        :type channel: int
+        :param name: name of the waveform or sequence
+        :type name: string
+        :param sample_rate: sample rate in Sa/s
+        :type sample_rate: float
+        :return: list of errors reported by the device
+        :rtype: list
+        """
+        self.check_channel(channel)
+        with self.batch() as errors:
+            self.write('SOUR{}:FUNC:ARB {}'.format(channel, self.check_arb_name(name)))
+            self.write('SOUR{}:FUNC:ARB:SRAT {:+e}'.format(channel, sample_rate))
+            self.write('SOUR{}:FUNC ARB'.format(channel))
+        return errors
+
+    def get_sample_rate(self, channel):
+        """ Gets the sample rate of the arbitrary waveform of the channel.
+
+        :param channel: number of channel. it can be 1 or 2 for this model
+        :type channel: int
+        :return: sample rate in Sa/s
+        :rtype: string
+        """
+        self.check_channel(channel)
+        return self.query('SOUR{}:FUNC:ARB:SRAT?'.format(channel))[:-1]
+
+
+class _SimulatedResource:
+    """ Simulated VISA resource of the Agilent 33522A. It executes messages of commands separated by ';'
+    (following the SCPI rules for the command tree and short forms), keeps the settings and has an error queue.
+    Arbitrary waveforms sent as binary block (write_raw) and sequences are kept in arbs, per channel,
+    as arrays of values between -1 and 1.
+
+    Every message takes latency seconds and every command command_time seconds, so the timing of the
+    communication can be checked without the device. The number of messages is counted in messages.
+
+    :param properties: dictionary of settings (in short form, e.g. 'SOUR1:FREQ') with their values
+    :type properties: dict
+    :param latency: time for a message, in seconds
+    :type latency: float
+    :param command_time: time to execute a command, in seconds
+    :type command_time: float
+    """
+    IDN = 'Agilent Technologies,33522A,MY50003703,2.03-1.19-2.00-52-00'
+
+    def __init__(self, resource_name, properties, latency=0.0, command_time=0.0):
+        self.resource_name = resource_name
+        self.properties = properties
+        self.latency = latency
+        self.command_time = command_time
+        self.timeout = 2000
+        self.send_end = True
+        self.messages = 0
+        self.errors = []
+        self.arbs = {1: {}, 2: {}}
+        self._replies = []
+        self._raw = b''
+
+    @staticmethod
+    def short_form(node):
+        """ SCPI short form of a node, e.g. 'VOLTage' -> 'VOLT', 'OUTPUT1' -> 'OUTP1', 'LIMit' -> 'LIM'."""
+        node = node.upper()
+        name = node.rstrip('0123456789')
+        suffix = node[len(name):]
+        if len(name) > 4:
+            name = name[:3] if name[3] in 'AEIOU' else name[:4]
+        return name + suffix
+
+    def _execute(self, command, path):
+        """ Executes one command. path is the command tree position after the previous command in the message.
+        Returns the reply or None."""
+        header, _, value = command.strip().partition(' ')
+        value = value.strip()
+        if header.startswith('*'):
+            if header == '*OPC?':
+                return '1'
+            if header == '*IDN?':
+                return self.IDN
+            if header in ('*CLS', '*RST', '*OPC', '*WAI'):
+                if header == '*CLS':
+                    self.errors = []
+                return None
+        else:
+            ask = header.endswith('?')
+            nodes = [self.short_form(n) for n in header.rstrip('?').lstrip(':').split(':')]
+            if not header.startswith(':'):
+                nodes = path + nodes
+            path[:] = nodes[:-1]
+            key = ':'.join(nodes)
+            if key == 'SYST:ERR' and ask:
+                return self.errors.pop(0) if self.errors else '+0,"No error"'
+            channel = int(nodes[0][-1]) if nodes[0] in ('SOUR1', 'SOUR2') else None
+            if key.endswith(':DATA:VOL:CLE') and channel:
+                self.arbs[channel] = {}
+                return None
+            if key.endswith(':DATA:SEQ') and channel and value.startswith('#'):
+                return self._define_sequence(channel, value[2 + int(value[1]):])
+            if key.endswith(':FUNC:ARB') and channel and not ask and value not in self.arbs[channel]:
+                self.errors.append('-221,"Settings conflict; arb {} not in memory"'.format(value))
+                return None
+            if key in self.properties:
+                if ask:
+                    return self.properties[key]
+                if value.upper() in ('ON', 'OFF'):
+                    value = '1' if value.upper() == 'ON' else '0'
+                self.properties[key] = value
+                return None
+        self.errors.append('-113,"Undefined header; {}"'.format(command.strip()))
+        return None
+
+    def _define_sequence(self, channel, description):
+        """ Stores a sequence as the concatenation of its steps."""
+        fields = [field.strip('"') for field in description.split(',')]
+        steps = []
+        for k in range(1, len(fields), 5):
+            arb, repeat = fields[k], int(fields[k + 1])
+            if arb not in self.arbs[channel]:
+                self.errors.append('-221,"Settings conflict; arb {} not in memory"'.format(arb))
+                return None
+            steps += [self.arbs[channel][arb]] * repeat
+        self.arbs[channel][fields[0]] = np.concatenate(steps)
+        return None
+
+    def write_raw(self, data):
+        """ Receives a command with a binary block, possibly in several pieces (with send_end False)."""
+        self._raw += data
+        if not self.send_end:
+            return
+        data, self._raw = self._raw, b''
+        self.messages += 1
+        time.sleep(self.latency + self.command_time)
+        header = data[:data.index(b'#')].decode('ascii')
+        nodes = [self.short_form(n) for n in header.split(' ')[0].lstrip(':').split(':')]
+        name = header.split(' ')[1].strip(',')
+        if ':'.join(nodes[1:]) == 'DATA:ARB:DAC':
+            self.arbs[int(nodes[0][-1])][name] = ieee_block_to_array(data, '<i2') / 32767
+        elif ':'.join(nodes[1:]) == 'DATA:ARB':
+            self.arbs[int(nodes[0][-1])][name] = ieee_block_to_array(data, '<f4').astype(float)
+        else:
+            self.errors.append('-113,"Undefined header; {}"'.format(header))
+
+    def write(self, msg):
+        self.messages += 1
+        commands = msg.split(';')
+        time.sleep(self.latency + self.command_time * len(commands))
+        path = []
+        replies = [self._execute(command, path) for command in commands]
+        replies = [reply for reply in replies if reply is not None]
+        if replies:
+            self._replies.append(';'.join(replies) + '\n')
+
+    def read(self):
+        if not self._replies:
+            raise VisaIOError(constants.StatusCode.error_timeout)
+        return self._replies.pop(0)
+
+    def query(self, msg):
+        self.write(msg)
+        return self.read()
+
+    def close(self):
+        pass
+
+
 class Agilent33522ADummy(Agilent33522A):
     """
     ===================
@@ -429,108 +857,55 @@ class Agilent33522ADummy(Agilent33522A):
     The idea is to load this class instead of the real one
     to do testing of higher level functions without the need of the real device to be connected or working.
 
-    The logic is that this dummy device will respond as the real device would, with the correct type
-    and size of information is expected.
-
-    This class inherits from the real device and the idea is to re-write only the init, the write
-    and the read, so all the other functions remain the same and functioning.
-
-    The specific way to achieve this will be different for every device, so it has to be done separately.
+    This class inherits from the real device and only replaces the VISA resource by a simulated one
+    (_SimulatedResource), so all the other functions remain the same and functioning. The default values of
+    the settings of the simulated device are loaded from the yaml file controller/dummy/agilent33522A.yml.
 
-    To do so, we use a yaml file that tells the dummy class what are the properties of the device. For example,
-    one property for the LCC25 is voltage1, which is the voltage for channel 1. Then from this you can build 2
-    commands: voltage1? to ask what is the value and voltage1=1 to set it to the value 1. So we build a command
-    list using the CHAR ? and = for each of this properties.
+    The settings can have the keys 'latency' (time per message, in seconds) and 'command_time' (time per
+    command, in seconds), to simulate the timing of the device.
 
     """
-    ask = '?'
-    write = ' '
-
     def __init__(self, settings):
         """ init for the dummy Agilent33522A
-        :param port: fake port name
-        :type port: str
-        :param dummy: indicates the dummy mode. keept for compatibility
-        :type dummy: logical
+
+        :param settings: as for Agilent33522A, plus the optional 'latency' and 'command_time'
+        :type settings: dict
         """
         super().__init__(settings)
         self.logger = logging.getLogger(__name__)
         self.name = 'Dummy Agilent33522A'
-        self._buffer = []
-        self._response = []
+        self.latency = settings.get('latency', 0.0)
+        self.command_time = settings.get('command_time', 0.0)
         self._properties = {}
-        self._all = {}
-        self._commands = []
         self.load_properties()
 
     def load_properties(self):
-        """ This method loads a yaml file with a dictionary with the available properties for the
-        LCC25 and some defaults values. This dictionary is saved in properties and will be modified
-        when a variable is writen, so the dummy device will respond with the previously set value.
+        """ This method loads a yaml file with the settings of the device and their default values.
+        The simulated device starts with these values and keeps the values that are written to it.
 
         """
-        filename = os.path.join(root_dir,'controller', 'dummy', 'agilent33522A.yml')
+        filename = os.path.join(package_path, 'controller', 'dummy', 'agilent33522A.yml')
         self.logger.debug('Loading Agilent33522A defaults file: {}'.format(filename))
 
         with open(filename, 'r') as f:
             d = yaml.safe_load(f)
 
-        self._properties = d
+        self._properties = {key: str(d[key]['default']) for key in d}
         self.logger.debug('_properties dict: {}'.format(self._properties))
 
-        for key in d:
-            self.logger.debug('Adding key: {}'.format(key))
-            self._all[key] = d[key]['default']
-            for command_key in self.CHAR:
-                new_command = key + self.CHAR[command_key]
-                self.logger.debug('Adding to the command list: {}'.format(new_command))
-                self._commands. append(new_command)
-
-        self.logger.debug('_all dict: {}'.format(self._all))
-        self._properties['dummy_yaml_file'] = filename  # add to the class the name of the Config file used.
-        self.logger.debug('Commands list: {}'.format(self._commands))
-
-
-    def write(self, msg):
-        """Dummy write. It will compare the msg with the COMMANDS
-
-        :param msg: Message to write
-        :type msg: str
-
-        """
-        self.logger.debug('Writing to dummy LCC25: {}'.format(msg))
-
-        # next is to check that the command exists in the device and to give the proper response
-        if '=' in msg:
-            prop = msg.split('=')[0]
-            value = msg.split('=')[1]
-            command = prop + '='
-        elif msg[-1] == '?':
-            prop = msg[:-1]
-            value = None
-            command = msg
-
-        self.logger.debug('prop: {}, value: {}'.format(prop, value))
-        if command in self._commands:
-            if value is None:
-                self.logger.debug('Reading the property: {}'.format(prop))
-                response = self._all[prop]
-            else:
-                response = 'Setting property: {} to {}'.format(prop, value)
-                self.logger.debug(response)
-                self._buffer.append(msg)
-                self._all[prop] = value
-        else:
-            self.logger.error('The command "{}" is not listed as a valid command for LCC25'.format(msg))
-
-        self.logger.debug('The response is: {}'.format(response))
-        self._response.append(response)
-
+    def initialize(self):
+        """ Opens the connection to the simulated device."""
+        self.resource_name = 'USB0::2391::' + str(self.instrument_id) + '::MY50003703::INSTR'
+        self._port_lock = port_lock(self.resource_name)
+        self.rsc = _SimulatedResource(self.resource_name, dict(self._properties), self.latency, self.command_time)
+        self.logger.info('Dummy device initialized')
+        self._is_initialized = True
 
-    def read(self):
-        """ Dummy read. Reads the response buffer"""
-        self.logger.debug('Reading from the dummy device')
-        return self._response[-1]
+    def finalize(self):
+        """ Closes the connection to the simulated device."""
+        self.rsc = None
+        self._is_initialized = False
+        self.logger.info('Connection closed.')
 
 
 if __name__ == "__main__":
@@ -16,18 +16,22 @@ specific functionality in a dedicated instrument.
 This also means Dummy mode needs to be implemented mostly at Instrument level.
 
 Development note:
-I've added the experimental decorator _wait_while_busy_and_after.
-If it turns out not to work desirably it can be removed:
-remove the application of the decorator on methods initialize, write and read_serial_buffer_in
-remove the decorator function itself
-remove self._busy and self._additional_timeout from the __init__
+The decorator _wait_while_busy_and_after makes initialize, write and read_serial_buffer_in wait for each other.
+It uses the PortLock of the port (see hyperion.tools.port_tools), so waiting threads sleep instead of
+spinning, and controllers in other threads that use the same port wait as well.
+query holds the lock over its write and read, so no other thread can write in between.
+The port is opened through the port_manager, so controllers using the same port share it and it is only closed
+when the last one finalizes. The Arduino restarts when the port is opened, so the port is blocked for 1.5 s
+after it is really opened (not when an already open port is reused).
 """
 
 import serial
 import serial.tools.list_ports
 import time
+import functools
 from hyperion import logging
 from hyperion.controller.base_controller import BaseController
+from hyperion.tools.port_tools import port_lock, port_manager, FramedReader
 
 class GenericSerialController(BaseController):
     """ Generic Serial Controller
@@ -100,39 +104,38 @@ class GenericSerialController(BaseController):
         else:
             self.name = 'Serial Device'
 
-        # "global" variables for decorator function _wait_while_busy_and_after
-        self._busy = False
-        self._additional_timeout = time.time()
+        # lock used by the decorator function _wait_while_busy_and_after (shared by all users of this port)
+        self._port_lock = port_lock(self._port)
+        self._reader = None
 
     # define a decorator function to
     def _wait_while_busy_and_after(additional_timeout=0):
         """
         This decorator prevents any method that it is applied to from running simultaneously.
-        Applying this decorator to a method, sets the _busy flag of the object and makes any method
-        that has this decorator wait until the _busy flag is set to false after the previous method
-        has finished. This blocking functionality of a method can be extended by setting the
-        additional_timeout argument > 0. This is useful for the initialize method e.g..
+        Applying this decorator to a method makes it acquire the PortLock of the port, so any method
+        (in any thread) that has this decorator waits until the previous one has finished. The waiting
+        thread sleeps until the lock is released. This blocking functionality of a method can be extended
+        by setting the additional_timeout argument > 0. This is useful for the initialize method e.g..
         """
         def decorator(fn):
-            def wrapper(*args, **kwargs):
-                while args[0]._busy or time.time() < args[0]._additional_timeout:
-                    pass
-                args[0]._busy = True            # set self._busy True
-                result = fn(*args, **kwargs)    # run the function
-                args[0]._additional_timeout = time.time() + additional_timeout
-                args[0]._busy = False           # set self._busy False
-                return result
+            @functools.wraps(fn)
+            def wrapper(self, *args, **kwargs):
+                with self._port_lock.hold(guard=additional_timeout):
+                    return fn(self, *args, **kwargs)
             return wrapper
         return decorator
 
-    @_wait_while_busy_and_after(additional_timeout=1.5)
+    startup_time = 1.5      # seconds the device needs after opening the port
+
+    @_wait_while_busy_and_after(additional_timeout=0)
     def initialize(self):
         """ Starts the connection to the device using the specified port."""
 
-        self.rsc = serial.Serial(port=self._port,
-                                     baudrate=self._baud,
-                                     timeout=self._read_timeout,
-                                     write_timeout=self._write_timeout)
+        self.rsc = port_manager.open_serial(self._port,
+                                            startup_time=self.startup_time,
+                                            baudrate=self._baud,
+                                            timeout=self._read_timeout,
+                                            write_timeout=self._write_timeout)
         self.logger.debug('Initialized Serial connection to {} on port {}.'.format(self.name, self._port))
         self._is_initialized = True     # THIS IS MANDATORY!!
                                         # this is to prevent you to close the device connection if you
@@ -147,7 +150,7 @@ class GenericSerialController(BaseController):
         
         if self._is_initialized:
             if self.rsc is not None:
-                self.rsc.close()
+                port_manager.release(self.rsc)
                 self.logger.debug('The Serial connection to {} is closed.'.format(self.name))
         else:
             self.logger.warning('Finalizing before initializing connection to {}'.format(self.name))
@@ -179,12 +182,20 @@ class GenericSerialController(BaseController):
         self.logger.debug('Sending to device: {}'.format(message))
         self.rsc.write( message.encode(self._encoding) )
 
+    @property
+    def reader(self):
+        """ FramedReader on the serial connection. Replies may end in a newline or a carriage return. """
+        if self._reader is None or self._reader.rsc is not self.rsc:
+            self._reader = FramedReader(self.rsc, terminator=(b'\n', b'\r'), timeout=self._read_timeout)
+        return self._reader
+
     @_wait_while_busy_and_after(additional_timeout=0)
     def read_serial_buffer_in(self, wait_for_termination_char = True):
         """
         Reads everything the device has sent. By default it waits until a line
         is terminated by a termination character (\n or \r), but that check can
-        be disabled using the input parameter.
+        be disabled using the input parameter. It returns as soon as the line is
+        complete (or after the read timeout).
 
         :param wait_for_termination_char: defaults to True
         :type wait_for_termination_char: bool
@@ -193,31 +204,10 @@ class GenericSerialController(BaseController):
         """
         if not self._is_initialized:
             raise Warning('Trying to read from {} before initializing'.format(self.name))
-        
-        # At least for Arduino, it appears the buffer is filled in chuncks of max 32 bytes
-        byte_time = 1/self.rsc.baudrate * (self.rsc.bytesize + self.rsc.stopbits + (self.rsc.parity != 'N'))
-        raw = b''
-        in_buffer = 0
-        new_in_buffer = 0
-        term_chars = '\n\r'.encode(self._encoding)
-        ends_at_term_char = False
-        #start_time = time.time() + 0.0001
-        # Keep checking 
-        expire_time = time.time() +  self._read_timeout + .0000000001
-        while (not ends_at_term_char) and (time.time() < expire_time):
-            time.sleep(byte_time*20)
-            new_in_buffer = self.rsc.in_waiting
-            if new_in_buffer > in_buffer:
-                # if the buffer has grown make sure the expire_time is at least long enough to read in another 32 bytes
-                expire_time = max(expire_time, time.time()+byte_time*32)
-                in_buffer = new_in_buffer
-            
-            raw += self.rsc.read( self.rsc.in_waiting )
-            if not wait_for_termination_char or (len(raw) and (raw[-1] in term_chars)):
-                ends_at_term_char = True
-            
-        # self.logger.debug('{} bytes received'.format(len(raw)))  # removed this because it's being called very frequently
-        return raw
+
+        if wait_for_termination_char:
+            return self.reader.read_until(timeout=self._read_timeout, greedy=True)
+        return self.reader.read_available()
 
     def read_lines(self, remove_leading_trailing_empty_line=True):
         """
@@ -255,11 +245,12 @@ class GenericSerialController(BaseController):
         if not self._is_initialized:
             raise Warning('Trying to query {} before initializing.'.format(self.name))
 
-        self.rsc.reset_output_buffer()
-        self.rsc.reset_input_buffer()
-        self.write(message)
-        self.logger.debug('Sent message: {}.'.format(message))
-        ans = self.read_lines()
+        with self._port_lock.hold():
+            self.rsc.reset_output_buffer()
+            self.reader.reset()
+            self.write(message)
+            self.logger.debug('Sent message: {}.'.format(message))
+            ans = self.read_lines()
         self.logger.debug('Received message: {}.'.format(ans))
         return ans
     
@@ -12,9 +12,12 @@ This is the controller for the optical spectrum analyzer (OSA), from Ando, model
 :license: BSD, see LICENSE for more details.
 """
 from hyperion import logging
-import visa
 import time
+import numpy as np
+from pyvisa import constants, VisaIOError
 from hyperion.controller.base_controller import BaseController
+from hyperion.tools.port_tools import holds_port, port_lock, port_manager
+from hyperion.tools.visa_discovery import find_visa_resource
 
 class OsaController(BaseController):
     """ Class for OSA controller.
@@ -29,9 +32,8 @@ class OsaController(BaseController):
         self.logger.info('Class Osa created.')
         self.name = 'OSA Controller'
 
-        self._rm = visa.ResourceManager()
-        self._resource_list = self._rm.list_resources()
         self._osa = None
+        self._port_lock = port_lock(None)      # the lock of the port of the OSA, once it is opened
         #these are @properties variables
         self._start_wav = None
         self._end_wav = None
@@ -46,25 +48,20 @@ class OsaController(BaseController):
         self._sensitivities = ['high1', 'high2', 'high3', 'norm_hold', 'norm_auto', 'mid']
         self._time_constants = [0.02, 0.12, 1.125, 0.001, 0.001, 0.002]
         self._sens_commands = ['SH1', 'SH2', 'SH3', 'SNHD', 'SNAT', 'SMID']
+        self._srq = False               # True if the end of a sweep is signalled with a VISA service request event
+        self._wavelengths = None        # cached (settings, wavelength array)
+        self.poll_interval = (0.01, 0.1)    # (first, maximum) interval in s for polling the status byte
 
     def initialize(self):
         """ Starts the connection to the device with given port """
         self.logger.info('Opening connection to OSA')
-
-        if self._port == 'AUTO':
-            for dev in self._resource_list:
-                if dev[:4] == 'GPIB':
-                    self._osa = self._rm.open_resource(dev)
-                    if self._osa.query("*IDN?")[:11] == 'ANDO,AQ6317':
-                        break
-                    self._osa.close()
-                    logging.error('OSA not found')
-        else:
-            self._osa = self._rm.open_resource(self._port)
-
+        self._osa = self._open_resource()
+        self._port_lock = port_lock(self._osa.resource_name)
         self._osa.read_termination = '\r\n'
 
-        self._osa.write('SRQ1')     # This seems to be necessary in order to poll whether device is done with self._osa.read_stb())
+        with self._port_lock.hold():
+            self._osa.write('SRQ1')     # This seems to be necessary in order to poll whether device is done with self._osa.read_stb())
+        self._enable_srq()
         self._is_initialized = True  # THIS IS MANDATORY!!
         # this is to prevent you to close the device connection if you
         # have not initialized it inside a with statement
@@ -72,27 +69,77 @@ class OsaController(BaseController):
         # make sure self._start_wav/end_wav/sample_points/optical_resolution is the same as on the osa machine.
         # This is mandatory
 
+    def _open_resource(self):
+        """ Opens the VISA resource of the OSA given by the port setting.
+
+        :return: the opened resource
+        """
+        if self._port == 'AUTO':
+            # uses the cached resource of the OSA, and only searches all GPIB resources if that fails
+            osa = find_visa_resource('ANDO,AQ6317', prefix='GPIB')
+            if osa is None:
+                raise Warning('OSA not found')
+            return osa
+        return port_manager.open_visa(self._port)
+
+    def _enable_srq(self):
+        """ Tries to receive the service requests of the OSA (with SRQ1 it requests service at the end of a sweep)
+        as VISA events. If the interface does not support it, wait_for_osa polls the status byte instead.
+        """
+        try:
+            self._osa.enable_event(constants.EventType.service_request, constants.EventMechanism.queue)
+            self._srq = True
+        except (VisaIOError, AttributeError, NotImplementedError) as e:
+            self.logger.info('Service request events not available ({}), polling the status byte instead'.format(e))
+            self._srq = False
+
     def wait_for_osa(self, timeout=None):
         """
         Method to let the program do nothing for a while
         in order to create enough time to let the osa machine take a spectrum.
+        It returns as soon as the OSA signals the end of the sweep: with a service request event if
+        available, otherwise by polling the status byte (first every 10 ms, slowing down to every 100 ms).
 
         :param timeout: time in seconds how long the program must wait before it resumes
         if no timeout is specified a timeout will be calculated using self._time_constants
         :type timeout: float
-
+        :return: True if the sweep finished, False if the timeout expired
+        :rtype: bool
         """
         if timeout==None:
             timeout = 4.0 + 1.05 * self._sample_points * self._time_constants[self._sensitivity-1]
         start_time = time.time()
-        while (time.time() - start_time) < timeout:
-            if ((self._osa.read_stb()) % 2) == 1:
-                return
-            time.sleep(.1)
+        if self._srq:
+            while True:
+                remaining = timeout - (time.time() - start_time)
+                if remaining <= 0:
+                    break
+                try:
+                    self._osa.wait_on_event(constants.EventType.service_request, int(remaining * 1000))
+                except VisaIOError as e:
+                    if e.error_code == constants.StatusCode.error_timeout:
+                        break
+                    self.logger.warning('Waiting for service request failed ({}), polling instead'.format(e))
+                    self._srq = False
+                    return self.wait_for_osa(max(0, remaining))
+                with self._port_lock.hold():
+                    stb = self._osa.read_stb()          # reading the status byte also clears the request
+                if stb % 2 == 1:
+                    return True
+        else:
+            interval = self.poll_interval[0]
+            while (time.time() - start_time) < timeout:
+                with self._port_lock.hold():
+                    stb = self._osa.read_stb()
+                if stb % 2 == 1:
+                    return True
+                time.sleep(interval)
+                interval = min(2 * interval, self.poll_interval[1])
         self.logger.info('Timout expired')
-
+        return False
 
     @property
+    @holds_port
     def start_wav(self):
         """"
         The start_wav is the start wavelength of the osa.
@@ -103,6 +150,7 @@ class OsaController(BaseController):
         return self._start_wav
 
     @start_wav.setter
+    @holds_port
     def start_wav(self, start_wav):
         start_wav = round(start_wav, 2)
         if start_wav < 600 or start_wav > 1750:
@@ -115,6 +163,7 @@ class OsaController(BaseController):
                 self.logger.warning('Start_wav value not set in OSA')
 
     @property
+    @holds_port
     def end_wav(self):
         """"
         The end_wav is the end wavelength of the osa.
@@ -125,6 +174,7 @@ class OsaController(BaseController):
         return self._end_wav
 
     @end_wav.setter
+    @holds_port
     def end_wav(self, end_wav):
         end_wav = round(end_wav, 2)
         if end_wav <600 or end_wav > 1750:
@@ -137,6 +187,7 @@ class OsaController(BaseController):
                 self.logger.warning("End_wav value not set in OSA")
 
     @property
+    @holds_port
     def optical_resolution(self):
         """"
         The optical resolution is the resolution of the spectrum you can take
@@ -147,6 +198,7 @@ class OsaController(BaseController):
         return self._optical_resolution
 
     @optical_resolution.setter
+    @holds_port
     def optical_resolution(self, optical_resolution):
         optical_resolution = round(optical_resolution, 2)
         if not optical_resolution in [0.01,0.02,0.05,0.1,0.2,0.5,1.0,2.0,5.0]:
@@ -160,6 +212,7 @@ class OsaController(BaseController):
 
 
     @property
+    @holds_port
     def sample_points(self):
         """"
         The amount of sample_points the osa machine must use in order to take a spectrum
@@ -170,6 +223,7 @@ class OsaController(BaseController):
         return self._sample_points
 
     @sample_points.setter
+    @holds_port
     def sample_points(self, sample_points):
         if sample_points != self._sample_points:
             self._sample_points = sample_points
@@ -179,6 +233,7 @@ class OsaController(BaseController):
                 self.logger.warning("The sample points value did not set in OSA")
 
     @property
+    @holds_port
     def sensitivity(self):
         """"
         The sensitivity of the osa machine
@@ -189,6 +244,7 @@ class OsaController(BaseController):
         return self._sensitivities[self._sensitivity - 1]
 
     @sensitivity.setter
+    @holds_port
     def sensitivity(self, sensitivity_string):
         if sensitivity_string in self._sensitivities:
             sensitivity_number = self._sensitivities.index(sensitivity_string)
@@ -201,22 +257,58 @@ class OsaController(BaseController):
             if sensitivity_number != self._sensitivity:
                 self.logger.warning('Value not set in OSA')
 
+    @holds_port
     def perform_single_sweep(self):
         """
         Gives a command to the osa machine to perform a single sweep.
         """
+        if self._srq:
+            # forget service requests of earlier sweeps
+            self._osa.discard_events(constants.EventType.service_request, constants.EventMechanism.queue)
+            self._osa.read_stb()
         self._osa.write('SGL')
 
-    def get_data(self):
+    @holds_port
+    def _query_array(self, command):
+        """ Queries a comma separated list of values and returns it as numpy array, without the first value
+        (the number of points).
+
+        :param command: e.g. 'LDATA'
+        :type command: str
+        :rtype: numpy.ndarray
+        """
+        self._osa.write(command)
+        raw = self._osa.read_raw()
+        return np.fromstring(raw.decode('ascii'), sep=',')[1:]
+
+    def get_wavelengths(self, refresh=False):
+        """
+        The wavelengths of the spectrum points. They only change with start_wav, end_wav and sample_points,
+        so they are only transferred again when one of those changed (through this controller) or if refresh is True.
+
+        :param refresh: transfer them from the OSA anyway
+        :type refresh: bool
+        :return: wavelengths in nm
+        :rtype: numpy.ndarray
+        """
+        key = (self._start_wav, self._end_wav, self._sample_points)
+        if refresh or self._wavelengths is None or self._wavelengths[0] != key:
+            self._wavelengths = (key, self._query_array('WDATA'))
+        return self._wavelengths[1]
+
+    def get_data(self, refresh_wavelengths=False):
         """
         Calculates the data created with the single sweep.
         Wait for OSA to finish before grabbing data
 
-        :return wav: an list of the wavelengths, spec an list with spectrum data.
-        :rtype wav: a list of floats and a list of floats
+        :param refresh_wavelengths: transfer the wavelengths again (see get_wavelengths), e.g. if the settings
+                                    were changed on the OSA itself
+        :type refresh_wavelengths: bool
+        :return wav: an array of the wavelengths, spec an array with spectrum data.
+        :rtype wav: numpy.ndarray, numpy.ndarray
         """
-        wav = self._osa.query_ascii_values('WDATA')[1:]
-        spec = self._osa.query_ascii_values('LDATA')[1:]
+        wav = self.get_wavelengths(refresh_wavelengths)
+        spec = self._query_array('LDATA')
 
         return wav, spec
 
@@ -227,9 +319,20 @@ class OsaController(BaseController):
         osa machine.
         """
         self.logger.info('Closing connection to device.')
-        self._osa.close()
+        if self._osa is None:
+            self._is_initialized = False
+            return
+        if self._srq:
+            try:
+                self._osa.disable_event(constants.EventType.service_request, constants.EventMechanism.queue)
+            except VisaIOError:
+                pass
+            self._srq = False
+        port_manager.release(self._osa)
+        self._osa = None
         self._is_initialized = False
 
+    @holds_port
     def query(self, msg):
         """ writes into the device message
 
@@ -259,13 +362,111 @@ class OsaController(BaseController):
         self.sample_points = 601.00
 
 
+class _SimulatedResource:
+    """ Simulated VISA resource of the AQ6317B: the settings, a single sweep that takes sweep_time seconds,
+    the status byte (bit 0 is set at the end of the sweep), service request events and the WDATA/LDATA replies.
+    If srq is False, enable_event raises as on an interface without events; if event_error is True,
+    wait_on_event raises another error than a timeout.
+    transfers counts the WDATA and LDATA replies."""
+    COMMANDS = ['STAWL', 'STPWL', 'RESLN', 'SMPL']
+    SENSITIVITIES = ['SH1', 'SH2', 'SH3', 'SNHD', 'SNAT', 'SMID']
+
+    def __init__(self, resource_name, sweep_time=0.05, srq=True):
+        self.resource_name = resource_name
+        self.read_termination = '\n'
+        self.timeout = 2000
+        self.sweep_time = sweep_time
+        self.srq = srq
+        self.event_error = False
+        self.state = {'STAWL': 900.0, 'STPWL': 1200.0, 'RESLN': 1.0, 'SMPL': 601.0, 'SENS': 4}
+        self.transfers = {'WDATA': 0, 'LDATA': 0}
+        self.stb_reads = 0
+        self._events = False
+        self._sweep_end = None
+        self._reply = b''
+
+    def _done(self):
+        return self._sweep_end is not None and time.time() >= self._sweep_end
+
+    def _wavelengths(self):
+        return np.linspace(self.state['STAWL'], self.state['STPWL'], int(self.state['SMPL']))
+
+    def _array(self, values):
+        return (str(len(values)) + ',' + ','.join('{:.3f}'.format(v) for v in values)).encode() + b'\r\n'
+
+    def write(self, message):
+        self._reply = b''
+        message = message.strip()
+        if message == 'SGL':
+            self._sweep_end = time.time() + self.sweep_time
+        elif message in self.transfers:
+            self.transfers[message] += 1
+            wav = self._wavelengths()
+            if message == 'WDATA':
+                self._reply = self._array(wav)
+            else:
+                center = (self.state['STAWL'] + self.state['STPWL']) / 2
+                self._reply = self._array(-70 + 60 * np.exp(-((wav - center) / 5) ** 2))
+        elif message in self.SENSITIVITIES:
+            self.state['SENS'] = self.SENSITIVITIES.index(message) + 1
+        elif message.endswith('?'):
+            self._reply = '{}\r\n'.format(self.state[message[:-1]]).encode()
+        else:
+            for command in self.COMMANDS:
+                if message.startswith(command):
+                    self.state[command] = float(message[len(command):])
+
+    def read_raw(self):
+        reply, self._reply = self._reply, b''
+        return reply
+
+    def read(self):
+        return self.read_raw().decode().rstrip('\r\n')
+
+    def query(self, message):
+        self.write(message)
+        return self.read()
+
+    def query_ascii_values(self, message):
+        return [float(value) for value in self.query(message).split(',')]
+
+    def read_stb(self):
+        self.stb_reads += 1
+        return int(self._done())
+
+    def enable_event(self, event_type, mechanism):
+        if not self.srq:
+            raise VisaIOError(constants.StatusCode.error_nonsupported_operation)
+        self._events = True
+
+    def disable_event(self, event_type, mechanism):
+        self._events = False
+
+    def discard_events(self, event_type, mechanism):
+        pass
+
+    def wait_on_event(self, event_type, timeout):
+        if self.event_error:
+            raise VisaIOError(constants.StatusCode.error_connection_lost)
+        remaining = timeout / 1000
+        if self._sweep_end is not None:
+            remaining = min(remaining, max(0, self._sweep_end - time.time()))
+        time.sleep(remaining)
+        if not (self._events and self._done()):
+            raise VisaIOError(constants.StatusCode.error_timeout)
+
+    def close(self):
+        pass
+
+
 class OsaControllerDummy(OsaController):
     """
     Dummy for the Osa controller
     ============================
 
-    In essence we have the same methods and we re-write the query to answer something meaningful but
-    without connecting to the real device.
+    It uses a simulated VISA resource (_SimulatedResource), so all the methods of the controller run
+    without connecting to the real device. A sweep takes the setting 'sweep_time' (default 0.05 s), and
+    the setting 'srq' (default True) says if the simulated interface supports service request events.
 
     """
     def query(self, msg):
@@ -303,10 +504,11 @@ class OsaControllerDummy(OsaController):
         self.logger.debug('Ask id to example device.')
         return 'ExampleController device'
 
-    def initialize(self):
-        """ Dummy initialize"""
+    def _open_resource(self):
+        """ Dummy resource """
         self.logger.info('Dummy initialize')
-        self._is_initialized = True
+        return _SimulatedResource('GPIB0::1::INSTR', self._settings.get('sweep_time', 0.05),
+                                  self._settings.get('srq', True))
 
 
 if __name__ == "__main__":
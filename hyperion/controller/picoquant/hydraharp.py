@@ -211,6 +211,7 @@ class Hydraharp(BaseController):
         assert devidx in range(self.settings['MAXDEVNUM'])
         assert mode in Measurement_mode._member_names_
         assert clock in Reference_clock._member_names_
+        self.mode = mode
         func = self.hhlib.HH_Initialize
         func.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_int]
         func.restype = ctypes.c_int
@@ -433,6 +434,8 @@ class Hydraharp(BaseController):
         assert devidx in range(self.settings['MAXDEVNUM'])
         lencode = int(np.log2(length/1024))
         assert (lencode >= 0) and (lencode <= self.settings['MAXLENCODE'])
+        if self.mode == 'Continuous':
+            assert lencode <= self.settings['MAXLENCODE_CONT'], "In continuous mode the histogram length is at most {}".format(self.settings['MAXHISTLEN_CONT'])
         func = self.hhlib.HH_SetHistoLen
         func.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.POINTER(ctypes.c_int)]
         func.restype = ctypes.c_int
@@ -566,6 +569,44 @@ class Hydraharp(BaseController):
         else:
             warnings.warn(self.error_string)
 
+    def all_count_rates(self):
+        """| Sync rate and the count rates of all input channels in one call, **without waiting**.
+        | Uses HH_GetAllCountRates if the library has it, otherwise HH_GetSyncRate and HH_GetCountRate per channel.
+        | The rate meters have a gate time of 100 ms, so there is no use in calling this more often than that.
+
+        :return: (sync rate, array with the count rate of every channel) in counts per second
+        """
+        devidx = self.__devidx
+        assert devidx in range(self.settings['MAXDEVNUM'])
+        channels = self.number_input_channels
+        rates = np.zeros(channels, dtype=np.int32)
+        try:
+            func = self.hhlib.HH_GetAllCountRates
+        except AttributeError:
+            sync = self.sync_rate()
+            func = self.hhlib.HH_GetCountRate
+            func.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.POINTER(ctypes.c_int)]
+            func.restype = ctypes.c_int
+            data = ctypes.c_int(devidx)
+            data3 = ctypes.c_int()
+            for ch in range(channels):
+                self.error_code = func(data, ctypes.c_int(ch), data3)
+                if self.error_code != 0:
+                    warnings.warn(self.error_string)
+                    return
+                rates[ch] = data3.value
+            return sync, rates
+        func.argtypes = [ctypes.c_int, ctypes.POINTER(ctypes.c_int), ctypes.POINTER(ctypes.c_int)]
+        func.restype = ctypes.c_int
+        data = ctypes.c_int(devidx)
+        data2 = ctypes.c_int()
+        data3 = rates.ctypes.data_as(ctypes.POINTER(ctypes.c_int))
+        self.error_code = func(data, data2, data3)
+        if self.error_code == 0:
+            return data2.value, rates
+        else:
+            warnings.warn(self.error_string)
+
     @property
     def warnings(self):
         """
@@ -746,6 +787,129 @@ class Hydraharp(BaseController):
         else:
             warnings.warn(self.error_string)
 
+    def all_histograms(self, clear=True):
+        """| Histograms of all input channels, read out in one pass.
+        | Uses HH_GetAllHistograms if the library has it (hhlib >= 3.0), otherwise it loops over HH_GetHistogram.
+        | HH_GetAllHistograms never clears the acquisition buffer itself, so with clear=True it is cleared afterwards.
+
+        :param clear: False keeps the histograms in the acquisition buffer; True clears the buffer
+        :type clear: bool
+
+        :return histograms: array of shape (channels, histogram_length)
+        """
+        devidx = self.__devidx
+        assert devidx in range(self.settings['MAXDEVNUM'])
+        assert isinstance(clear, bool), "HH_GetAllHistograms, clear must be a bool."
+        channels = self.number_input_channels
+        hists = np.zeros((channels, self._histoLen), dtype=np.uint32)
+        try:
+            func = self.hhlib.HH_GetAllHistograms
+        except AttributeError:
+            self.logger.debug('HH_GetAllHistograms not in library, reading channels one by one')
+            for ch in range(channels):
+                hist = self.histogram(ch, False)
+                if hist is None:
+                    return
+                hists[ch] = hist
+        else:
+            func.argtypes = [ctypes.c_int, ctypes.POINTER(ctypes.c_uint)]
+            func.restype = ctypes.c_int
+            data = ctypes.c_int(devidx)
+            data2 = hists.ctypes.data_as(ctypes.POINTER(ctypes.c_uint))
+            self.error_code = func(data, data2)
+            if self.error_code != 0:
+                warnings.warn(self.error_string)
+                return
+        if clear:
+            self.clear_histogram()
+        return hists
+
+    def measurement_control(self, control='SINGLESHOT_CTC', start_edge=1, stop_edge=1):
+        """| Sets how a measurement is started and stopped (HH_SetMeasControl).
+        | In continuous mode use one of the CONT_ options, e.g. 'CONT_CTC_RESTART' to let the device start a new
+        | block every acquisition time until stop_measurement is called.
+
+        :param control: name of the measurement control, see Measurement_control
+        :type control: string
+
+        :param start_edge: active edge of the start signal (only for the C1/C2 options); 1 is rising, 0 is falling
+        :type start_edge: int
+
+        :param stop_edge: active edge of the stop signal (only for the C1/C2 options); 1 is rising, 0 is falling
+        :type stop_edge: int
+        """
+        devidx = self.__devidx
+        assert devidx in range(self.settings['MAXDEVNUM'])
+        assert control in Measurement_control._member_names_, "HH_SetMeasControl, control not valid."
+        func = self.hhlib.HH_SetMeasControl
+        func.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int]
+        func.restype = ctypes.c_int
+        data = ctypes.c_int(devidx)
+        data2 = ctypes.c_int(Measurement_control[control].value)
+        data3 = ctypes.c_int(start_edge)
+        data4 = ctypes.c_int(stop_edge)
+        self.error_code = func(data, data2, data3, data4)
+        if self.error_code != 0:
+            warnings.warn(self.error_string)
+
+    def continuous_mode_block(self):
+        """| Reads one block of continuous mode data (HH_GetContModeBlock).
+        | **Only works when the device is initialized in 'Continuous' mode and a measurement is running.**
+        | The block is read into a buffer that is reused for every call, and the histograms are returned as a view on it,
+        | so copy them (or write them into your own array) before asking for the next block.
+
+        :return: (header, histograms, sums); header is a numpy record with blocknum, starttime, ctctime, etc.,
+                 histograms is an array of shape (channels, histogram_length) and sums holds the total counts per channel.
+                 Returns None if no block was ready.
+        """
+        devidx = self.__devidx
+        assert devidx in range(self.settings['MAXDEVNUM'])
+        if getattr(self, '_cont_buffer', None) is None:
+            self._cont_buffer = np.zeros(self.settings['MAXCONTMODEBUFLEN'], dtype=np.uint8)
+        func = self.hhlib.HH_GetContModeBlock
+        func.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.POINTER(ctypes.c_int)]
+        func.restype = ctypes.c_int
+        data = ctypes.c_int(devidx)
+        data2 = self._cont_buffer.ctypes.data_as(ctypes.c_void_p)
+        data3 = ctypes.c_int()
+        self.error_code = func(data, data2, data3)
+        if self.error_code != 0:
+            warnings.warn(self.error_string)
+            return
+        if data3.value == 0:
+            return
+        return parse_continuous_block(self._cont_buffer)
+
+    def read_fifo(self, count=None):
+        """| Reads time tag records from the FiFo of the device (HH_ReadFiFo), in T2 or T3 mode.
+        | The records are read into a buffer that is reused for every call and are returned as a view on it,
+        | so copy them before reading again. The record format is described in decode_t2_records and decode_t3_records.
+
+        :param count: maximum number of records to read, multiple of 128, at most TTREADMAX (default)
+        :type count: int
+
+        :return records: array of uint32 records; can be empty
+        """
+        devidx = self.__devidx
+        assert devidx in range(self.settings['MAXDEVNUM'])
+        if count is None:
+            count = self.settings['TTREADMAX']
+        assert (count >= self.settings['TTREADMIN']) and (count <= self.settings['TTREADMAX']) and count % 128 == 0, "HH_ReadFiFo, count not valid."
+        if getattr(self, '_fifo_buffer', None) is None:
+            self._fifo_buffer = np.zeros(self.settings['TTREADMAX'], dtype=np.uint32)
+        func = self.hhlib.HH_ReadFiFo
+        func.argtypes = [ctypes.c_int, ctypes.POINTER(ctypes.c_uint), ctypes.c_int, ctypes.POINTER(ctypes.c_int)]
+        func.restype = ctypes.c_int
+        data = ctypes.c_int(devidx)
+        data2 = self._fifo_buffer.ctypes.data_as(ctypes.POINTER(ctypes.c_uint))
+        data3 = ctypes.c_int(count)
+        data4 = ctypes.c_int()
+        self.error_code = func(data, data2, data3, data4)
+        if self.error_code == 0:
+            return self._fifo_buffer[:data4.value]
+        else:
+            warnings.warn(self.error_string)
+
     @property
     def flags(self):
         """Use the predefined bit mask values in hhdefin.h (e.g. FLAG_OVERFLOW) to extract individual bits through a bitwise AND.
@@ -788,10 +952,503 @@ class Reference_clock(Enum):
     Internal = 0
     External = 1
 
+class Measurement_control(Enum):
+    SINGLESHOT_CTC = 0
+    C1_GATED = 1
+    C1_START_CTC_STOP = 2
+    C1_START_C2_STOP = 3
+    CONT_C1_GATED = 4
+    CONT_C1_START_CTC_STOP = 5
+    CONT_CTC_RESTART = 6
+
+def decode_t2_records(records, overflow_start=0):
+    """| Decodes HydraHarp (V2) T2 records: bit 31 special, bits 30-25 channel, bits 24-0 time tag in ps.
+    | Special records with channel 63 are overflows (the time tag holds the number of overflows),
+    | channel 0 is a sync event and channels 1-15 are markers; these are dropped except for the sync.
+
+    :param records: uint32 T2 records
+    :type records: numpy array
+    :param overflow_start: number of overflows before these records (returned by the previous call)
+    :type overflow_start: int
+
+    :return: (channel, time in ps, number of overflows so far); the sync has channel -1
+    """
+    records = np.asarray(records, dtype=np.uint32)
+    special = (records >> 31).astype(bool)
+    channel = ((records >> 25) & 0x3F).astype(np.int64)
+    timetag = (records & 0x1FFFFFF).astype(np.int64)
+    overflow = special & (channel == 63)
+    overflows = overflow_start + np.cumsum(np.where(overflow, timetag, 0))
+    keep = ~special | (channel == 0)
+    time_ps = overflows[keep] * 33554432 + timetag[keep]
+    channel = np.where(special[keep], -1, channel[keep])
+    last = int(overflows[-1]) if len(overflows) else overflow_start
+    return channel, time_ps, last
+
+def decode_t3_records(records, overflow_start=0):
+    """| Decodes HydraHarp (V2) T3 records: bit 31 special, bits 30-25 channel, bits 24-10 dtime, bits 9-0 nsync.
+    | Special records with channel 63 are overflows (nsync holds the number of overflows); markers are dropped.
+
+    :param records: uint32 T3 records
+    :type records: numpy array
+    :param overflow_start: number of overflows before these records (returned by the previous call)
+    :type overflow_start: int
+
+    :return: (channel, sync number, dtime in units of the resolution, number of overflows so far)
+    """
+    records = np.asarray(records, dtype=np.uint32)
+    special = (records >> 31).astype(bool)
+    channel = ((records >> 25) & 0x3F).astype(np.int64)
+    dtime = ((records >> 10) & 0x7FFF).astype(np.int64)
+    nsync = (records & 0x3FF).astype(np.int64)
+    overflow = special & (channel == 63)
+    overflows = overflow_start + np.cumsum(np.where(overflow, nsync, 0))
+    keep = ~special
+    last = int(overflows[-1]) if len(overflows) else overflow_start
+    return channel[keep], overflows[keep] * 1024 + nsync[keep], dtime[keep], last
+
+# Header of a continuous mode block, followed per channel by histogram_length uint32 bins and one uint64 sum.
+cont_block_header = np.dtype([('channels', '<u2'), ('histolen', '<u2'), ('blocknum', '<u4'),
+                              ('starttime', '<u8'), ('ctctime', '<u8'),
+                              ('firstM1time', '<u8'), ('firstM2time', '<u8'), ('firstM3time', '<u8'), ('firstM4time', '<u8'),
+                              ('sumM1', '<u2'), ('sumM2', '<u2'), ('sumM3', '<u2'), ('sumM4', '<u2')])
+
+def parse_continuous_block(buffer):
+    """| Splits a raw continuous mode block in header, histograms and sums, without copying.
+
+    :param buffer: raw block as received from HH_GetContModeBlock
+    :type buffer: numpy array of uint8 or bytes
+
+    :return: (header, histograms, sums); histograms has shape (channels, histolen)
+    """
+    header = np.frombuffer(buffer, dtype=cont_block_header, count=1)[0]
+    channels = int(header['channels'])
+    histolen = int(header['histolen'])
+    step = histolen * 4 + 8
+    hists = np.ndarray((channels, histolen), dtype='<u4', buffer=buffer,
+                       offset=cont_block_header.itemsize, strides=(step, 4))
+    sums = np.ndarray((channels,), dtype='<u8', buffer=buffer,
+                      offset=cont_block_header.itemsize + histolen * 4, strides=(step,))
+    return header, hists, sums
+
    
+class HydraharpDummy(Hydraharp):
+    """
+    ===============
+    Hydraharp Dummy
+    ===============
+
+    This is the dummy controller for the Hydraharp400. The idea is to load this class instead of the real one
+    to do testing (and profiling) of higher level functions without the device or hhlib.dll.
+
+    It has the same methods as the real controller, but instead of calling the library it simulates the photon
+    statistics: histograms are Poisson samples of an expected histogram that is built from the count rates,
+    the lifetime (or g2 shape), the instrument response and the background. In T2 and T3 mode read_fifo returns
+    records in the HydraHarp V2 format, including overflow records. All of it is generated with numpy in one go,
+    so it is fast enough to simulate MHz count rates.
+
+    The simulation settings are loaded from /controller/dummy/hydraharp.yml; every key of that file can be
+    overwritten by putting it in the settings dictionary.
+
+    :param config: same as for Hydraharp, plus (optionally) any of the simulation settings
+    :type config: dict
+    """
+    def __init__(self, config):
+        BaseController.__init__(self, config)
+        self.logger = logging.getLogger(__name__)
+        self.logger.debug('This is the dummy correlator (controller) speaking')
+        self._config = config
+        self.name = 'Dummy Hydraharp400'
+
+        self.settings = {}
+        self.load_config()
+        self.sim = {}
+        self.load_simulation(config)
+        self._rng = np.random.default_rng(self.sim['seed'])
+
+        self.error_code = 0
+        self._histoLen = 65536
+        self._binning_code = 0
+        self._sync_div = 1
+        self._sync_offset = 0
+        self._input_offsets = [0] * self.sim['channels']
+        self._hist_offset = 0
+        self._meas_control = 'SINGLESHOT_CTC'
+        self._running = False
+        self._t_start = self._t_end = self._t_last = 0.0
+        self._hist = np.zeros((self.sim['channels'], self._histoLen), dtype=np.uint32)
+        self._profile = None
+
+        self.initialize(mode=config['mode'], clock=config['clock'])
+        self._base_resolution = self.sim['base_resolution']
+        self.logger.debug('Hydraharp dummy controller fully created')
+
+    def load_simulation(self, config):
+        """ Loads the simulation settings from /controller/dummy/hydraharp.yml and overwrites them with the ones in config.
+
+        :param config: settings of the controller
+        :type config: dict
+        """
+        filename = os.path.join(root_dir, 'controller', 'dummy', 'hydraharp.yml')
+        self.logger.debug('Loading Hydraharp dummy simulation file: {}'.format(filename))
+        with open(filename, 'r') as f:
+            self.sim = yaml.safe_load(f)
+        for key in self.sim:
+            if key in config:
+                self.sim[key] = config[key]
+        for key in ['count_rate', 'shape', 'lifetime', 'delay']:
+            if not isinstance(self.sim[key], (list, tuple)):
+                self.sim[key] = [self.sim[key]] * self.sim['channels']
+
+    # --- identification and set up ---------------------------------------------------------
+    @property
+    def library_version(self):
+        return self.settings['LIB_VERSION']
+
+    def _open_device(self):
+        return b'DUMMY000'
+
+    @property
+    def error_string(self):
+        return 'Dummy Hydraharp, error code {}'.format(self.error_code)
+
+    def initialize(self, mode='Histogram', clock='Internal'):
+        self.logger.info('Initializing the dummy correlator device in {} mode.'.format(mode))
+        assert mode in Measurement_mode._member_names_
+        assert clock in Reference_clock._member_names_
+        self._is_initialized = True
+        self.mode = mode
+        self._running = False
+        self._meas_control = 'SINGLESHOT_CTC'
+
+    @property
+    def hardware_info(self):
+        return b'HydraHarp 400', b'DUMMY', b'1.0'
+
+    @property
+    def number_input_channels(self):
+        return self.sim['channels']
+
+    def calibrate(self):
+        self.logger.debug('Calibrating the dummy (nothing to do)')
+
+    def sync_divider(self, divider=1):
+        assert divider in 2**np.arange(np.log2(self.settings['SYNCDIVMIN']), np.log2(self.settings['SYNCDIVMAX'])+1), "Invalid value for SetSyncDiv"
+        self._sync_div = int(divider)
+
+    def sync_CFD(self, level=50, zerox=0):
+        assert (level >= self.settings['DISCRMIN']) and (level <= self.settings['DISCRMAX'])
+        assert (zerox >= self.settings['ZCMIN']) and (zerox <= self.settings['ZCMAX'])
+
+    def sync_offset(self, value=0):
+        assert (value >= self.settings['CHANOFFSMIN']) and (value <= self.settings['CHANOFFSMAX']), "SyncChannelOffset outside of valid values."
+        self._sync_offset = value
+
+    def input_CFD(self, channel=0, level=50, zerox=0):
+        assert channel in range(self.number_input_channels), "SetInputCFD, Channel not valid."
+        assert (level >= self.settings['DISCRMIN']) and (level <= self.settings['DISCRMAX']), "SetInputCFD, Level not valid."
+        assert (zerox >= self.settings['ZCMIN']) and (zerox <= self.settings['ZCMAX']), "SetInputCFD, ZeroCross not valid."
+
+    def input_offset(self, channel=0, offset=0):
+        assert channel in range(self.number_input_channels), "SetInputChannelOffset, Channel not valid."
+        assert (offset >= self.settings['CHANOFFSMIN']) and (offset <= self.settings['CHANOFFSMAX']), "SetInputChannelOffset, Offset not valid."
+        self._input_offsets[channel] = offset
+
+    @property
+    def histogram_length(self):
+        return self._histoLen
+
+    @histogram_length.setter
+    def histogram_length(self, length=65536):
+        lencode = int(np.log2(length/1024))
+        assert (lencode >= 0) and (lencode <= self.settings['MAXLENCODE'])
+        if self.mode == 'Continuous':
+            assert lencode <= self.settings['MAXLENCODE_CONT'], "In continuous mode the histogram length is at most {}".format(self.settings['MAXHISTLEN_CONT'])
+        self._histoLen = 1024 * 2**lencode
+        self._hist = np.zeros((self.sim['channels'], self._histoLen), dtype=np.uint32)
+        return self._histoLen
+
+    def _binning(self, binning=0):
+        assert (binning >= 0) and (binning <= self.settings['BINSTEPSMAX'])
+        self._binning_code = binning
+
+    def histogram_offset(self, offset=0):
+        assert (offset >= self.settings['OFFSETMIN']) and (offset <= self.settings['OFFSETMAX'])
+        self._hist_offset = offset
+
+    @property
+    def resolution(self):
+        return self.sim['base_resolution'] * 2**self._binning_code
+
+    @resolution.setter
+    def resolution(self, resolution):
+        self._binning(int(np.log2((resolution/self._base_resolution))))
+
+    def stop_overflow(self, stop_at_overflow=0, stop_count=0):
+        pass
+
+    def measurement_control(self, control='SINGLESHOT_CTC', start_edge=1, stop_edge=1):
+        assert control in Measurement_control._member_names_, "HH_SetMeasControl, control not valid."
+        self._meas_control = control
+
+    # --- rates -----------------------------------------------------------------------------
+    def _gate(self, rate):
+        """ Rate as the rate meter would show it: Poisson counts in a 100 ms gate."""
+        return int(self._rng.poisson(rate * 0.1) * 10)
+
+    def sync_rate(self):
+        return self._gate(self.sim['sync_rate'])
+
+    def count_rate(self, channel=0):
+        time.sleep(0.1)
+        assert channel in range(self.number_input_channels), "SetInputChannelOffset, Channel not valid."
+        return self._gate(self.sim['count_rate'][channel])
+
+    def all_count_rates(self):
+        rates = self._rng.poisson(np.array(self.sim['count_rate']) * 0.1) * 10
+        return self._gate(self.sim['sync_rate']), rates.astype(np.int32)
+
+    @property
+    def warnings(self):
+        self.warning_code = 0
+        return 0
+
+    @property
+    def warnings_text(self):
+        return b''
+
+    @property
+    def flags(self):
+        return 0
+
+    # --- simulation ------------------------------------------------------------------------
+    def _expected(self, nbins, resolution, offset):
+        """| Expected counts per second in every bin, for every channel.
+        | Bin i covers the time offset + i*resolution ... offset + (i+1)*resolution (in ps) after the sync.
+
+        :return: array of shape (channels, nbins)
+        """
+        sim = self.sim
+        t = offset + (np.arange(nbins) + 0.5) * resolution
+        period = 1e12 / sim['sync_rate']
+        out = np.zeros((sim['channels'], nbins))
+        sigma = sim['irf'] / resolution
+        if sigma > 0.5:
+            half = min(int(4 * sigma) + 1, nbins)
+            k = np.arange(-half, half + 1)
+            kernel = np.exp(-0.5 * (k / sigma)**2)
+            kernel /= kernel.sum()
+        for ch in range(sim['channels']):
+            delay = sim['delay'][ch] + self._input_offsets[ch] - self._sync_offset
+            tau = sim['lifetime'][ch]
+            rate = sim['count_rate'][ch]
+            if sim['shape'][ch] == 'g2':
+                dt = t - delay
+                g2 = 1 - (1 - sim['g2_zero']) * np.exp(-np.abs(dt) / tau)
+                out[ch] = sim['sync_rate'] * rate * 1e-12 * resolution * g2
+            else:
+                tm = np.mod(t - delay, period)
+                pdf = np.exp(-tm / tau) / (tau * (1 - np.exp(-period / tau)))
+                out[ch] = rate * resolution * ((1 - sim['background']) * pdf + sim['background'] / period)
+            if sigma > 0.5:
+                out[ch] = np.convolve(out[ch], kernel, mode='same')
+        return out
+
+    def _accumulate(self):
+        """ Adds the counts collected since the last call to the histogram memory."""
+        if not self._running or self.mode not in ('Histogram', 'Continuous'):
+            return
+        now = min(time.time(), self._t_end)
+        dt = now - self._t_last
+        if dt > 0:
+            self._hist += self._rng.poisson(self._profile * dt).astype(np.uint32)
+            self._t_last = now
+        if now >= self._t_end:
+            self._running = False
+
+    def _sampler(self, channel, nbins, resolution):
+        """ Cumulative distribution of the arrival time after the sync, used to draw photons in T2 and T3 mode."""
+        cdf = np.cumsum(self._expected(nbins, resolution, 0)[channel])
+        return cdf / cdf[-1]
+
+    # --- measurement -----------------------------------------------------------------------
+    def clear_histogram(self):
+        self._hist[:] = 0
+
+    def start_measurement(self, acquisition_time=1000):
+        tacq = acquisition_time
+        assert (tacq >= self.settings['ACQTMIN']) and (tacq <= self.settings['ACQTMAX']), "HH_StartMeas, tacq not valid."
+        self._tacq = tacq / 1000
+        self._t_start = self._t_last = time.time()
+        if self.mode == 'Continuous' and self._meas_control.startswith('CONT'):
+            self._t_end = float('inf')
+        else:
+            self._t_end = self._t_start + self._tacq
+        self._running = True
+        if self.mode in ('Histogram', 'Continuous'):
+            self._profile = self._expected(self._histoLen, self.resolution, self._hist_offset)
+            self._blocks = 0
+        else:
+            self._start_fifo()
+
+    @property
+    def ctc_status(self):
+        self._accumulate()
+        return time.time() >= self._t_end or not self._running
+
+    def stop_measurement(self):
+        if self.mode in ('Histogram', 'Continuous'):
+            self._accumulate()
+        self._t_end = min(self._t_end, time.time())
+        self._running = False
+
+    def histogram(self, channel=0, clear=True):
+        assert channel in range(self.number_input_channels), "HH_GetHistogram, Channel not valid."
+        assert isinstance(clear, bool), "HH_GetHistogram, clear must be a bool."
+        self._accumulate()
+        hist = self._hist[channel].copy()
+        if clear:
+            self._hist[channel] = 0
+        return hist
+
+    def all_histograms(self, clear=True):
+        assert isinstance(clear, bool), "HH_GetAllHistograms, clear must be a bool."
+        self._accumulate()
+        hists = self._hist.copy()
+        if clear:
+            self.clear_histogram()
+        return hists
+
+    def continuous_mode_block(self):
+        if self.mode != 'Continuous' or self._profile is None:
+            return
+        if time.time() < self._t_start + (self._blocks + 1) * self._tacq or (self._blocks + 1) * self._tacq > self._t_end - self._t_start:
+            return
+        if getattr(self, '_cont_buffer', None) is None:
+            self._cont_buffer = np.zeros(self.settings['MAXCONTMODEBUFLEN'], dtype=np.uint8)
+        channels = self.sim['channels']
+        header = np.zeros(1, dtype=cont_block_header)
+        header['channels'] = channels
+        header['histolen'] = self._histoLen
+        header['blocknum'] = self._blocks
+        header['starttime'] = int(self._blocks * self._tacq * 1e9)
+        header['ctctime'] = int(self._tacq * 1e9)
+        self._cont_buffer[:cont_block_header.itemsize] = header.view(np.uint8)
+        _, hists, sums = parse_continuous_block(self._cont_buffer)
+        hists[:] = self._rng.poisson(self._profile * self._tacq)
+        sums[:] = hists.sum(axis=1)
+        self._blocks += 1
+        return parse_continuous_block(self._cont_buffer)
+
+    def _start_fifo(self):
+        """ Resets the state of the time tag simulation at the start of a T2/T3 measurement."""
+        self._pending = np.zeros(0, dtype=np.uint32)
+        self._t_fifo = self._t_start
+        self._wrap = 0
+        if self.mode == 'T2':
+            self._period = 1e12 / self.sim['sync_rate']           # ps between two laser pulses
+            nbins = max(int(np.ceil(self._period / self.sim['base_resolution'])), 1)
+            self._cdf = [self._sampler(ch, nbins, self.sim['base_resolution']) for ch in range(self.sim['channels'])]
+            self._fifo_resolution = self.sim['base_resolution']
+        else:
+            self._period = 1e12 * self._sync_div / self.sim['sync_rate']
+            nbins = min(max(int(np.ceil(self._period / self.resolution)), 1), 32768)
+            self._cdf = [self._sampler(ch, nbins, self.resolution) for ch in range(self.sim['channels'])]
+            self._fifo_resolution = self.resolution
+
+    def _with_overflows(self, wraps, records, max_count):
+        """| Puts overflow records (special, channel 63, count in the lowest bits) in front of every record
+        | that is in a later overflow period than the one before it.
+        """
+        diff = np.maximum(np.diff(np.concatenate(([self._wrap], wraps))), 0)
+        if len(wraps):
+            self._wrap = int(wraps[-1])
+        n_ovf = -(-diff // max_count)
+        out = np.empty(len(records) + int(n_ovf.sum()), dtype=np.uint32)
+        pos = np.arange(len(records)) + np.cumsum(n_ovf)
+        out[pos] = records
+        is_ovf = np.ones(len(out), dtype=bool)
+        is_ovf[pos] = False
+        counts = np.full(int(n_ovf.sum()), max_count, dtype=np.int64)
+        has = n_ovf > 0
+        counts[np.cumsum(n_ovf)[has] - 1] = diff[has] - max_count * (n_ovf[has] - 1)
+        out[is_ovf] = (1 << 31) | (63 << 25) | counts
+        return out
+
+    def _generate_records(self, t0, t1):
+        """ Simulates all T2 or T3 records between t0 and t1 (in s after the start)."""
+        sim = self.sim
+        dt = t1 - t0
+        first = int(np.ceil(t0 * 1e12 / self._period))
+        last = int(np.ceil(t1 * 1e12 / self._period))
+        channels, syncs, dtimes = [], [], []
+        for ch in range(sim['channels']):
+            n = self._rng.poisson(sim['count_rate'][ch] * dt)
+            if n == 0 or last <= first:
+                continue
+            channels.append(np.full(n, ch, dtype=np.int64))
+            syncs.append(self._rng.integers(first, last, n))
+            dtimes.append(np.searchsorted(self._cdf[ch], self._rng.random(n)))
+        if self.mode == 'T2':
+            div = self._sync_div
+            sync_k = np.arange(-(-first // div) * div, last, div)
+            channels.append(np.full(len(sync_k), -1, dtype=np.int64))
+            syncs.append(sync_k)
+            dtimes.append(np.zeros(len(sync_k), dtype=np.int64))
+        if not channels:
+            return np.zeros(0, dtype=np.uint32)
+        channels = np.concatenate(channels)
+        syncs = np.concatenate(syncs)
+        dtimes = np.concatenate(dtimes)
+        if self.mode == 'T2':
+            # the input and sync offsets are already in the arrival time distribution (see _expected)
+            times = (syncs * self._period).astype(np.int64) + dtimes * self._fifo_resolution
+            order = np.argsort(times, kind='stable')
+            times, channels = times[order], channels[order]
+            records = np.where(channels < 0, 1 << 31, channels << 25) | (times & 0x1FFFFFF)
+            return self._with_overflows(times >> 25, records, 0x1FFFFFF)
+        else:
+            order = np.lexsort((dtimes, syncs))
+            syncs, dtimes, channels = syncs[order], dtimes[order], channels[order]
+            records = (channels << 25) | ((dtimes & 0x7FFF) << 10) | (syncs & 0x3FF)
+            return self._with_overflows(syncs >> 10, records, 0x3FF)
+
+    def read_fifo(self, count=None):
+        if count is None:
+            count = self.settings['TTREADMAX']
+        assert (count >= self.settings['TTREADMIN']) and (count <= self.settings['TTREADMAX']) and count % 128 == 0, "HH_ReadFiFo, count not valid."
+        assert self.mode in ('T2', 'T3'), "read_fifo only works in T2 and T3 mode."
+        if getattr(self, '_fifo_buffer', None) is None:
+            self._fifo_buffer = np.zeros(self.settings['TTREADMAX'], dtype=np.uint32)
+        if self._running:
+            now = min(time.time(), self._t_end)
+            if now > self._t_fifo:
+                new = self._generate_records(self._t_fifo - self._t_start, now - self._t_start)
+                self._pending = np.concatenate((self._pending, new))
+                self._t_fifo = now
+            if now >= self._t_end:
+                self._running = False
+        n = min(count, len(self._pending))
+        self._fifo_buffer[:n] = self._pending[:n]
+        self._pending = self._pending[n:]
+        return self._fifo_buffer[:n]
+
+    def finalize(self):
+        self.logger.info('Closing the dummy correlator.')
+        self._running = False
+        self._is_initialized = False
+
+
 if __name__ == "__main__":
-    
-    with Hydraharp({'devidx':0, 'mode':'Histogram', 'clock':'Internal'}) as q:
+
+    dummy = False  # change this to True to work with the simulated device
+
+    if dummy:
+        my_class = HydraharpDummy
+    else:
+        my_class = Hydraharp
+
+    with my_class({'devidx':0, 'mode':'Histogram', 'clock':'Internal'}) as q:
 #    q = Hydraharp({'devidx':0, 'mode':'Histogram', 'clock':'Internal'})
 
         q.calibrate()
@@ -45,8 +45,16 @@ if sys.maxsize > 2**32:
 else:
     import win32com.client
 from hyperion.controller.base_controller import BaseController
+from hyperion import root_dir
+import os
+import time
+import yaml
+import numpy as np
 
-import pythoncom  # required for threading support
+try:
+    import pythoncom  # required for threading support
+except ImportError:
+    pythoncom = None    # not on Windows; only the WinspecContrDummy can be used
 
 # This controller should detect if PyQt5 is used (or other threading packages) and automatically start in
 # "threading mode", but if it doesn't and there are threading issues (e.g. an error mentioning that CoInitialize has
@@ -84,6 +92,18 @@ class WinspecContr(BaseController):
             self._force_threading = None
         self._threading_mode = None
 
+        # Parameter cache: values read with exp_get and spt_get are remembered (per parameter id and arguments), so
+        # reading them again doesn't need a round-trip to Winspec. exp_set and spt_set go straight to Winspec and clear
+        # the cached values of their group, because Winspec may change related parameters as well (e.g. units).
+        # Use refresh_all() if settings were changed in Winspec itself. Disable it with settings key use_cache = False
+        self.use_cache = settings.get('use_cache', True)
+        self._cache = {}
+        self.cache_hits = 0
+        self.cache_misses = 0
+        # parameters that change by themselves are never cached:
+        self.volatile = {'EXP': {'RUNNING', 'RUNNING_EXPERIMENT', 'ACTUAL_TEMP', 'TEMP_STATUS', 'DATFILENAME', 'FILEINCCOUNT'},
+                         'SPT': {'CUR_POSITION', 'CUR_GRATING', 'INST_CUR_GRAT_POS', 'ACTIVE_GRAT_POS'}}
+
         # pythoncom.CoInitialize()                    # added this line for threading
         self.name = 'Winspec Controller'
         # self.ws = None
@@ -94,7 +114,11 @@ class WinspecContr(BaseController):
         # self._spec_mgr = None
         # self.spt = None
         # I don't really understand this stuff, but after a very long search trying many things, this turns out to work for collecting spectral data
-        self._variant_array = win32com.client.VARIANT( win32com.client.pythoncom.VT_BYREF | win32com.client.pythoncom.VT_ARRAY | win32com.client.pythoncom.VT_I4 , [1,2,3,4] )
+        self._variant_array = self._make_variant_array()
+
+    def _make_variant_array(self):
+        """ Low level function that creates the COM variant that GetFrame() fills."""
+        return win32com.client.VARIANT( win32com.client.pythoncom.VT_BYREF | win32com.client.pythoncom.VT_ARRAY | win32com.client.pythoncom.VT_I4 , [1,2,3,4] )
 
     def initialize(self):
         self._is_initialized = False
@@ -308,6 +332,45 @@ class WinspecContr(BaseController):
             self.logger.error('Winspec Controller is not initialized')
             return True
 
+    def _cached_get(self, group, msg, getter, args, kwargs):
+        """ Low level function that returns the cached value or, if there is none, gets it with getter and caches it."""
+        if not self.use_cache or msg in self.volatile[group]:
+            return getter()
+        key = (group, msg, args, tuple(sorted(kwargs.items())))
+        if key in self._cache:
+            self.cache_hits += 1
+            return self._cache[key]
+        self.cache_misses += 1
+        value = getter()
+        self._cache[key] = value
+        return value
+
+    def invalidate(self, group=None, msg=None):
+        """
+        Removes values from the parameter cache.
+
+        :param group: 'EXP' or 'SPT'; None for both
+        :type group: string
+        :param msg: only this parameter (a key of params_exp or params_spt); None for the whole group
+        :type msg: string
+        """
+        self._cache = {key: value for key, value in self._cache.items()
+                       if not ((group is None or key[0] == group) and (msg is None or key[1] == msg.upper()))}
+
+    def refresh_all(self):
+        """ Clears the whole parameter cache, e.g. after changing settings in the Winspec software itself."""
+        self.logger.debug('Clearing the parameter cache ({} hits, {} misses)'.format(self.cache_hits, self.cache_misses))
+        self._cache = {}
+
+    def cache_stats(self):
+        """
+        Number of reads that were answered from the parameter cache (hits) and that needed Winspec (misses).
+
+        :return: dictionary with keys hits, misses and size
+        :rtype: dict
+        """
+        return {'hits': self.cache_hits, 'misses': self.cache_misses, 'size': len(self._cache)}
+
     def exp_get(self, msg, *args, **kwargs):
         """ Retrieve WinSpec Experiment parameter
 
@@ -319,7 +382,7 @@ class WinspecContr(BaseController):
         """
         if self._check_not_init(): return
         if msg.upper() in self.params_exp:
-            return self.exp.GetParam(self.params_exp[msg.upper()], *args, **kwargs)[:-1]
+            return self._cached_get('EXP', msg.upper(), lambda: self.exp.GetParam(self.params_exp[msg.upper()], *args, **kwargs)[:-1], args, kwargs)
         else:
             self.logger.warning('Unknown EXP parameter: {}'.format(msg))
             return None
@@ -336,6 +399,7 @@ class WinspecContr(BaseController):
         """
         if self._check_not_init(): return
         if msg.upper() in self.params_exp:
+            self.invalidate('EXP')
             return self.exp.SetParam(self.params_exp[msg.upper()], value)
         else:
             self.logger.warning('Unknown EXP parameter: {}'.format(msg))
@@ -354,7 +418,7 @@ class WinspecContr(BaseController):
         """
         if self._check_not_init(): return
         if msg.upper() in self.params_spt:
-            return self.spt.GetParam(self.params_spt[msg.upper()], *args, **kwargs)[:-1]
+            return self._cached_get('SPT', msg.upper(), lambda: self.spt.GetParam(self.params_spt[msg.upper()], *args, **kwargs)[:-1], args, kwargs)
         else:
             self.logger.warning('Unknown SPT parameter: {}'.format(msg))
             return None
@@ -371,6 +435,7 @@ class WinspecContr(BaseController):
         """
         if self._check_not_init(): return
         if msg.upper() in self.params_spt:
+            self.invalidate('SPT')
             return self.spt.SetParam(self.params_spt[msg.upper()], value)
         else:
             self.logger.warning('Unknown SPT parameter: {}'.format(msg))
@@ -380,27 +445,316 @@ class WinspecContr(BaseController):
 
 class WinspecContrDummy(WinspecContr):
     """
-    Example Controller Dummy
+    Winspec Controller Dummy
     ========================
 
-    A dummy version of the Example Controller.
+    | A simulated Winspec, so the WinspecInstr (and everything above it) can be used without Windows and a spectrometer.
+    | It has the same exp_get/exp_set/spt_get/spt_set, exp.Start/Stop/GetROI/SetROI, spt.Move, docfile().GetFrame and
+    | GetCalibration().Lambda as the real controller, but for a subset of the parameters (see PARAMS_EXP and PARAMS_SPT).
+    | Acquisitions take exposure time x accumulations + readout time per frame (RUNNING and RUNNING_EXPERIMENT
+    | follow that) and the frames contain a synthetic spectrum (emission lines on a background) with dark current,
+    | bias and noise, taking the grating, central wavelength, ROI, binning and shutter into account.
+    | The simulation settings are in /controller/dummy/winspec.yml; every key can be overwritten in the settings dictionary.
+    """
+    PARAMS_EXP = ['XDIMDET', 'YDIMDET', 'EXPOSURETIME', 'EXPOSURETIME_UNITS', 'EXPOSURE', 'ACCUMS', 'SEQUENTS',
+                  'RUNNING', 'RUNNING_EXPERIMENT', 'ACTUAL_TEMP', 'TEMP_STATUS', 'TEMPERATURE', 'ROTATE', 'REVERSE',
+                  'FLIP', 'GAIN', 'AVGAIN', 'USEROI', 'ROIMODE', 'BBACKSUBTRACT', 'DARKNAME', 'BDOFLATFIELD',
+                  'FLATFLDNAME', 'DATATYPE', 'OVERWRITECONFIRM', 'DATFILENAME', 'AUTOSAVE', 'FILEINCENABLE',
+                  'FILEINCCOUNT', 'DELAY_TIME', 'TIMING_MODE', 'SHUTTER_CONTROL', 'SYNC_ASYNC', 'ASCIIOUTPUTFILE']
+    PARAMS_SPT = ['GRATINGSPERTURRET', 'INST_GRAT_GROOVES', 'GRAT_USERNAME', 'CUR_GRATING', 'NEW_GRATING',
+                  'INST_CUR_GRAT_NUM', 'CUR_POSITION', 'NEW_POSITION', 'ACTIVE_GRAT_POS', 'INST_CUR_GRAT_POS']
+    PARAMS_X = {'INT': 0, 'LONG': 1, 'UINT': 2, 'FLOAT': 3}
+    EXPOSURE_UNITS = [1e-6, 1e-3, 1, 60]      # seconds per EXPOSURETIME_UNITS 1, 2, 3, 4
+    SHUTTER_CLOSED = 2                          # value of SHUTTER_CONTROL for 'Closed'
+
+    def __init__(self, settings={}):
+        super().__init__(settings)
+        self.name = 'Winspec Controller Dummy'
+        self.sim = {}
+        self.load_simulation(settings)
+        self._rng = np.random.default_rng(self.sim['seed'])
+        self._values = {}
+        self._acquisition = None                # _SimDoc of the running (or last) acquisition
+        self._roi = (1, 1, self.sim['ydim'], self.sim['xdim'], 1, 1)
+
+    def _make_variant_array(self):
+        return None
+
+    def load_simulation(self, settings):
+        """ Loads the simulation settings from /controller/dummy/winspec.yml and overwrites them with the ones in settings.
+
+        :param settings: settings of the controller
+        :type settings: dict
+        """
+        filename = os.path.join(root_dir, 'controller', 'dummy', 'winspec.yml')
+        self.logger.debug('Loading Winspec dummy simulation file: {}'.format(filename))
+        with open(filename, 'r') as f:
+            self.sim = yaml.safe_load(f)
+        for key in self.sim:
+            if key in settings:
+                self.sim[key] = settings[key]
 
-    In essence we have the same methods and we re-write the query to answer something meaningful but
-    without connecting to the real device.
+    def initialize(self):
+        self.logger.info('Starting the simulated Winspec')
+        self._threading_mode = False
+        self._generate_params()
+        self._ws_app = _SimApp(self)
+        self._exp = _SimExp(self)
+        self._spt = _SimSpt(self)
+        sim = self.sim
+        self._values = {
+            'XDIMDET': sim['xdim'], 'YDIMDET': sim['ydim'], 'EXPOSURETIME': 1.0, 'EXPOSURETIME_UNITS': 3,
+            'EXPOSURE': 1.0, 'ACCUMS': 1, 'SEQUENTS': 1, 'TEMPERATURE': sim['temperature'], 'TEMP_STATUS': 1,
+            'ROTATE': 0, 'REVERSE': 0, 'FLIP': 0, 'GAIN': 1, 'AVGAIN': 0, 'USEROI': 0, 'ROIMODE': 1,
+            'BBACKSUBTRACT': 0, 'DARKNAME': '', 'BDOFLATFIELD': 0, 'FLATFLDNAME': '', 'DATATYPE': self.PARAMS_X['FLOAT'],
+            'OVERWRITECONFIRM': 0, 'DATFILENAME': 'temp.SPE', 'AUTOSAVE': 3, 'FILEINCENABLE': 0, 'FILEINCCOUNT': 1,
+            'DELAY_TIME': 0, 'TIMING_MODE': 1, 'SHUTTER_CONTROL': 1, 'SYNC_ASYNC': 0, 'ASCIIOUTPUTFILE': 0,
+            'GRATINGSPERTURRET': len(sim['gratings']), 'CUR_GRATING': 1, 'NEW_GRATING': 1,
+            'CUR_POSITION': float(sim['central_nm']), 'NEW_POSITION': float(sim['central_nm'])}
+        self._is_initialized = True
+        self.xdim = self.exp_get('XDIMDET')[0]
+        self.ydim = self.exp_get('YDIMDET')[0]
 
-    """
+    def _generate_params(self):
+        """ Generates the parameter dictionaries with made up ids, for the parameters the simulation knows."""
+        self.params_exp = {name: 100 + k for k, name in enumerate(self.PARAMS_EXP)}
+        self.params_spt = {name: 500 + k for k, name in enumerate(self.PARAMS_SPT)}
+        self.params_x = dict(self.PARAMS_X)
+        self.params_tgc, self.params_tgp, self.params_dm, self.params_other = {}, {}, {}, {}
+        self.params = {}
+        for prefix, params in (('EXP_', self.params_exp), ('SPT_', self.params_spt), ('X_', self.params_x)):
+            self.params.update({prefix + name: value for name, value in params.items()})
+        self._names = {value: name for name, value in list(self.params_exp.items()) + list(self.params_spt.items())}
+
+    def docfile(self):
+        return _SimDoc(self)
+
+    # --- simulation ----------------------------------------------------------------------------------------------
+
+    def _get(self, param_id, *args):
+        """ Value of a parameter (by id) as Winspec would return it: (value, error)."""
+        name = self._names[param_id]
+        now = time.time()
+        acq = self._acquisition
+        if name == 'RUNNING':
+            value = int(acq is not None and now < acq.t_end)
+        elif name == 'RUNNING_EXPERIMENT':
+            value = int(acq is not None and now < acq.t_end + acq.save_time)
+        elif name == 'ACTUAL_TEMP':
+            value = self._values['TEMPERATURE'] + self._rng.normal(0, 0.05)
+        elif name == 'EXPOSURE':
+            value = self.exposure_s
+        elif name == 'INST_GRAT_GROOVES':
+            value = self.sim['gratings'][args[0]]['grooves']
+        elif name == 'GRAT_USERNAME':
+            value = self.sim['gratings'][args[0] - 1]['name']
+        elif name in ('INST_CUR_GRAT_NUM', 'ACTIVE_GRAT_POS', 'INST_CUR_GRAT_POS'):
+            value = self._values['CUR_GRATING']
+        else:
+            value = self._values[name]
+        return (value, 0)
 
+    def _set(self, param_id, value):
+        name = self._names[param_id]
+        if name == 'EXPOSURE':
+            self._values['EXPOSURETIME'] = value / self.EXPOSURE_UNITS[self._values['EXPOSURETIME_UNITS'] - 1]
+        else:
+            self._values[name] = value
+        return 0
 
-    def query(self, msg):
-        """ writes into the device msg
+    @property
+    def exposure_s(self):
+        """ Exposure time in seconds."""
+        return self._values['EXPOSURETIME'] * self.EXPOSURE_UNITS[self._values['EXPOSURETIME_UNITS'] - 1]
+
+    @property
+    def roi(self):
+        """ (top, left, bottom, right, h_group, v_group) of the current readout (full chip if USEROI is 0)."""
+        if self._values['USEROI'] == 0:
+            return (1, 1, self.sim['ydim'], self.sim['xdim'], 1, 1)
+        return self._roi
+
+    def calibration(self):
+        """ Coefficients (constant first) of the wavelength in nm as a polynomial of the chip pixel (starting at 1)."""
+        grooves = self.sim['gratings'][self._values['CUR_GRATING'] - 1]['grooves']
+        dispersion = self.sim['dispersion'] * 1200 / grooves
+        center = (self.sim['xdim'] + 1) / 2
+        c0, c1, c2 = self._values['CUR_POSITION'], dispersion, self.sim['dispersion_curvature'] * dispersion
+        # central + c1 (p - center) + c2 (p - center)^2, expanded in powers of p:
+        return [c0 - c1 * center + c2 * center**2, c1 - 2 * c2 * center, c2]
+
+    def _photon_rate(self, wavelengths):
+        """ Counts per second per pixel, for a full column (vertical direction summed), at the given wavelengths."""
+        rate = np.full(len(wavelengths), float(self.sim['background']))
+        for line in self.sim['lines']:
+            rate += line['counts'] * np.exp(-0.5 * ((wavelengths - line['nm']) / line['width'])**2)
+        return rate
+
+    def _make_frame(self, roi, exposure, accums, closed, datatype):
+        """ Simulates one frame (summed over accumulations) for the given readout; returns array of shape (x, y)."""
+        top, left, bottom, right, h_group, v_group = roi
+        sim = self.sim
+        pixels = np.arange(1, sim['xdim'] + 1)
+        wavelengths = np.polynomial.polynomial.polyval(pixels, self.calibration())
+        y = np.arange(1, sim['ydim'] + 1)
+        profile = np.exp(-0.5 * ((y - sim['stripe_center']) / sim['stripe_width'])**2)
+        profile /= profile.sum()
+        rate = np.outer(profile, self._photon_rate(wavelengths)) * (not closed) + sim['dark_current']
+        rate = rate[top - 1:bottom, left - 1:right]
+        ny, nx = (bottom - top + 1) // v_group, (right - left + 1) // h_group
+        rate = rate[:ny * v_group, :nx * h_group].reshape(ny, v_group, nx, h_group).sum(axis=(1, 3))
+        counts = self._rng.poisson(rate * exposure * accums).astype(float)
+        counts += accums * (sim['bias'] + self._rng.normal(0, sim['read_noise'], counts.shape))
+        if datatype != self.PARAMS_X['FLOAT']:
+            counts = np.round(counts)
+        return counts.T
+
+
+class _SimApp:
+    """ Simulated WinX32.Winx32App."""
+    def __init__(self, controller):
+        self.Version = '2.6 (simulated)'
+
+    def Hide(self, value):
+        pass
+
+    def close(self):
+        pass
 
-        :param msg: command to write into the device port
-        :type msg: string
-        """
-        self.logger.debug('Writing into the dummy device:{}'.format(msg))
-        ans = 'A general dummy answer'
-        return ans
 
+class _SimROI:
+    """ Simulated ROI object: Get() returns and Set() takes (top, left, bottom, right, h_group, v_group)."""
+    def __init__(self, values):
+        self._values = tuple(values)
+
+    def Get(self):
+        return self._values
+
+    def Set(self, top, left, bottom, right, h_group, v_group):
+        self._values = (top, left, bottom, right, h_group, v_group)
+
+
+class _SimExp:
+    """ Simulated WinX32.ExpSetup."""
+    def __init__(self, controller):
+        self._c = controller
+
+    def GetParam(self, param_id, *args):
+        return self._c._get(param_id, *args)
+
+    def SetParam(self, param_id, value):
+        return self._c._set(param_id, value)
+
+    def GetROI(self, index):
+        return _SimROI(self._c._roi)
+
+    def ClearROIs(self):
+        pass
+
+    def SetROI(self, roi):
+        self._c._roi = roi.Get()
+
+    def Start(self, doc):
+        doc._start(focus=False)
+        return True
+
+    def StartFocus(self, doc):
+        doc._start(focus=True)
+        return True
+
+    def Stop(self):
+        acq = self._c._acquisition
+        if acq is not None and time.time() < acq.t_end:
+            acq.t_end = time.time()
+            acq.save_time = 0
+
+
+class _SimSpt:
+    """ Simulated spectrograph (SpectroObjMgr.Current)."""
+    def __init__(self, controller):
+        self._c = controller
+
+    def GetParam(self, param_id, *args):
+        return self._c._get(param_id, *args)
+
+    def SetParam(self, param_id, value):
+        return self._c._set(param_id, value)
+
+    def Move(self):
+        values = self._c._values
+        if values['NEW_GRATING'] != values['CUR_GRATING']:
+            time.sleep(self._c.sim['grating_change_time'])
+            values['CUR_GRATING'] = values['NEW_GRATING']
+        distance = abs(values['NEW_POSITION'] - values['CUR_POSITION'])
+        time.sleep(distance / self._c.sim['move_speed'])
+        values['CUR_POSITION'] = values['NEW_POSITION']
+
+
+class _SimCalibration:
+    """ Simulated calibration object of a document: Order, PolyCoeffs(k) and Lambda(point) (point starts at 1)."""
+    def __init__(self, chip_coefficients, roi):
+        top, left, bottom, right, h_group, v_group = roi
+        # chip pixel of data point i: p = left - 1 + (i - 1/2) h_group + 1/2 = a + b i
+        a, b = left - 0.5 - h_group / 2, h_group
+        c0, c1, c2 = chip_coefficients
+        self._coefficients = [c0 + c1 * a + c2 * a**2, c1 * b + 2 * c2 * a * b, c2 * b**2]
+        self.Order = 2
+
+    def PolyCoeffs(self, k):
+        return self._coefficients[k]
+
+    def Lambda(self, point):
+        return float(np.polynomial.polynomial.polyval(point, self._coefficients))
+
+
+class _SimDoc:
+    """ Simulated WinX32.DocFile, holding the frames of one acquisition."""
+    def __init__(self, controller):
+        self._c = controller
+        self.t_start = self.t_end = 0
+        self.save_time = 0
+        self._frames = {}
+        self._settings = None
+
+    def _start(self, focus):
+        c = self._c
+        values = c._values
+        frames = 1 if focus else values['SEQUENTS']
+        self._settings = dict(roi=c.roi, exposure=c.exposure_s, accums=values['ACCUMS'],
+                              closed=values['SHUTTER_CONTROL'] == c.SHUTTER_CLOSED, datatype=values['DATATYPE'])
+        self.frame_time = c.exposure_s * values['ACCUMS'] + c.sim['readout_time']
+        self.n_frames = frames
+        self.t_start = time.time()
+        self.t_end = np.inf if focus else self.t_start + frames * self.frame_time
+        self.save_time = c.sim['save_time'] if values['AUTOSAVE'] == 2 else 0
+        self._frames = {}
+        self._calibration = _SimCalibration(c.calibration(), self._settings['roi'])
+        c._acquisition = self
+
+    def GetFrame(self, k, variant=None):
+        """ Frame k (starting at 1) as tuple of columns (x) of tuples (y); zeros if it's not acquired yet."""
+        if self._settings is None:
+            return ((0,),)
+        if k not in self._frames:
+            done = time.time() >= min(self.t_start + k * self.frame_time, self.t_end)
+            if not done:
+                top, left, bottom, right, h_group, v_group = self._settings['roi']
+                shape = ((right - left + 1) // h_group, (bottom - top + 1) // v_group)
+                return tuple(map(tuple, np.zeros(shape)))
+            self._frames[k] = tuple(map(tuple, self._c._make_frame(**self._settings).tolist()))
+        return self._frames[k]
+
+    def GetCalibration(self):
+        return self._calibration
+
+    def Close(self):
+        pass
+
+    def Save(self):
+        pass
+
+    def SaveAs(self, filename):
+        pass
 
 
 if __name__ == "__main__":
@@ -421,7 +775,7 @@ if __name__ == "__main__":
     dummy = False  # change this to false to work with the real device
 
     if dummy:
-        my_class = WinspecControllerDummy
+        my_class = WinspecContrDummy
     else:
         my_class = WinspecContr
 
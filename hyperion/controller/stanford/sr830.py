@@ -13,9 +13,9 @@
     :license: BSD, see LICENSE for more details.
 """
 from hyperion import logging
-import visa
 import time
 from hyperion.controller.base_controller import BaseController
+from hyperion.tools.port_tools import holds_port, port_lock, port_manager
 
 class sr830(BaseController):
     """ The controller for the lock-in.
@@ -30,9 +30,10 @@ class sr830(BaseController):
         self.logger.info('Class Lock-in created.')
         self.name = 'Lock-in Controller'
 
-        self._rm = visa.ResourceManager()
+        self._rm = port_manager.resource_manager()
         self._resource_list = self._rm.list_resources()
         self._osa = None
+        self._port_lock = port_lock(None)      # the lock of the port of the OSA, once it is opened
         #these are @properties variables
         self._start_wav = None
         self._end_wav = None
@@ -55,17 +56,21 @@ class sr830(BaseController):
         if self._port == 'AUTO':
             for dev in self._resource_list:
                 if dev[:4] == 'GPIB':
-                    self._osa = self._rm.open_resource(dev)
-                    if self._osa.query("*IDN?")[:11] == 'ANDO,AQ6317':
+                    self._osa = port_manager.open_visa(dev)
+                    with port_lock(dev).hold():
+                        idn = self._osa.query("*IDN?")
+                    if idn[:11] == 'ANDO,AQ6317':
                         break
-                    self._osa.close()
+                    port_manager.release(self._osa)
                     logging.error('OSA not found')
         else:
-            self._osa = self._rm.open_resource(self._port)
+            self._osa = port_manager.open_visa(self._port)
 
+        self._port_lock = port_lock(self._osa.resource_name)
         self._osa.read_termination = '\r\n'
 
-        self._osa.write('SRQ1')     # This seems to be necessary in order to poll whether device is done with self._osa.read_stb())
+        with self._port_lock.hold():
+            self._osa.write('SRQ1')     # This seems to be necessary in order to poll whether device is done with self._osa.read_stb())
         self._is_initialized = True  # THIS IS MANDATORY!!
         # this is to prevent you to close the device connection if you
         # have not initialized it inside a with statement
@@ -87,13 +92,16 @@ class sr830(BaseController):
             timeout = 4.0 + 1.05 * self._sample_points * self._time_constants[self._sensitivity-1]
         start_time = time.time()
         while (time.time() - start_time) < timeout:
-            if ((self._osa.read_stb()) % 2) == 1:
+            with self._port_lock.hold():
+                stb = self._osa.read_stb()
+            if stb % 2 == 1:
                 return
             time.sleep(.1)
         self.logger.info('Timout expired')
 
 
     @property
+    @holds_port
     def start_wav(self):
         """"
         The start_wav is the start wavelength of the osa.
@@ -104,6 +112,7 @@ class sr830(BaseController):
         return self._start_wav
 
     @start_wav.setter
+    @holds_port
     def start_wav(self, start_wav):
         start_wav = round(start_wav, 2)
         if start_wav < 600 or start_wav > 1750:
@@ -116,6 +125,7 @@ class sr830(BaseController):
                 self.logger.warning('Start_wav value not set in OSA')
 
     @property
+    @holds_port
     def end_wav(self):
         """"
         The end_wav is the end wavelength of the osa.
@@ -126,6 +136,7 @@ class sr830(BaseController):
         return self._end_wav
 
     @end_wav.setter
+    @holds_port
     def end_wav(self, end_wav):
         end_wav = round(end_wav, 2)
         if end_wav <600 or end_wav > 1750:
@@ -138,6 +149,7 @@ class sr830(BaseController):
                 self.logger.warning("End_wav value not set in OSA")
 
     @property
+    @holds_port
     def optical_resolution(self):
         """"
         The optical resolution is the resolution of the spectrum you can take
@@ -148,6 +160,7 @@ class sr830(BaseController):
         return self._optical_resolution
 
     @optical_resolution.setter
+    @holds_port
     def optical_resolution(self, optical_resolution):
         optical_resolution = round(optical_resolution, 2)
         if not optical_resolution in [0.01,0.02,0.05,0.1,0.2,0.5,1.0,2.0,5.0]:
@@ -161,6 +174,7 @@ class sr830(BaseController):
 
 
     @property
+    @holds_port
     def sample_points(self):
         """"
         The amount of sample_points the osa machine must use in order to take a spectrum
@@ -171,6 +185,7 @@ class sr830(BaseController):
         return self._sample_points
 
     @sample_points.setter
+    @holds_port
     def sample_points(self, sample_points):
         if sample_points != self._sample_points:
             self._sample_points = sample_points
@@ -180,6 +195,7 @@ class sr830(BaseController):
                 self.logger.warning("The sample points value did not set in OSA")
 
     @property
+    @holds_port
     def sensitivity(self):
         """"
         The sensitivity of the osa machine
@@ -190,6 +206,7 @@ class sr830(BaseController):
         return self._sensitivities[self._sensitivity - 1]
 
     @sensitivity.setter
+    @holds_port
     def sensitivity(self, sensitivity_string):
         if sensitivity_string in self._sensitivities:
             sensitivity_number = self._sensitivities.index(sensitivity_string)
@@ -202,12 +219,14 @@ class sr830(BaseController):
             if sensitivity_number != self._sensitivity:
                 self.logger.warning('Value not set in OSA')
 
+    @holds_port
     def perform_single_sweep(self):
         """
         Gives a command to the osa machine to perform a single sweep.
         """
         self._osa.write('SGL')
 
+    @holds_port
     def get_data(self):
         """
         Calculates the data created with the single sweep.
@@ -228,9 +247,10 @@ class sr830(BaseController):
         osa machine.
         """
         self.logger.info('Closing connection to device.')
-        self._osa.close()
+        port_manager.release(self._osa)
         self._is_initialized = False
 
+    @holds_port
     def query(self, msg):
         """ writes into the device message
 
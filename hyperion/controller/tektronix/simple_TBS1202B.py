@@ -1,7 +1,8 @@
 # this is not reviewed for Hyperion.
-import visa
 import time
 import numpy as np
+from hyperion.tools.port_tools import holds_port, port_lock, port_manager
+from hyperion.tools.array_tools import ieee_block_to_array
 
 
 class TBS1202B():
@@ -14,32 +15,55 @@ class TBS1202B():
 
     def __init__(self, instrument_id):
         self.instrument_id = instrument_id
+        self._port_lock = port_lock(None)
+        self._reset_cache()
+
+    def _reset_cache(self):
+        """ Forgets the settings sent to the oscilloscope (source, binary format and range, scaling)."""
+        self._source = None
+        self._data_format = None
+        self._data_range = None
+        self._scaling = None
 
     def initiate(self):
         self.resource_name = 'USB0::0x0699::' + self.instrument_id + '::C020303::INSTR'
-        rm = visa.ResourceManager()
-        self.rsc = rm.open_resource(self.resource_name)
-        time.sleep(0.5)
+        self._port_lock = port_lock(self.resource_name)
+        self.rsc = port_manager.open_visa(self.resource_name)
+        self._reset_cache()
+        if port_manager.users(self.rsc) == 1:
+            time.sleep(0.5)
+
+    def finalize(self):
+        """ Releases the connection (it is closed when nobody else uses it).
+
+        """
+        if self.rsc is not None:
+            port_manager.release(self.rsc)
+            self.rsc = None
 
+    @holds_port
     def idn(self):
         """Identification
 
         """
         return self.rsc.query('*IDN?')
 
+    @holds_port
     def forcetrigger(self):
         """ Creates a trigger event.
         """
         self.rsc.write('TRIG:FORC')
         return
 
+    @holds_port
     def get_acquire_state(self):
         """ Gets the state of the acquisition
 
         """
 
-        return osc.rsc.query('ACQUIRE:STATE?')
+        return self.rsc.query('ACQUIRE:STATE?')
 
+    @holds_port
     def acquire_parameters(self):
         """ Acquire parameters of the osciloscope.
             It is intended for adjusting the values obtained in acquire_curve
@@ -51,14 +75,18 @@ class TBS1202B():
             parameters[v] = float(j)
         return parameters
 
+    @holds_port
     def acquire_curve(self, start=1, stop=2500):
         """ Gets data from the oscilloscope. It accepts setting the start and
             stop points of the acquisition (by default the entire range).
+            Slow ASCII transfer; see acquire_curve_binary for the fast one.
         """
-        parameters = self.acquire_parameters()
         self.rsc.write('DAT:ENC ASCI;WID 2')
+        self._data_format = None
+        parameters = self.acquire_parameters()      # after setting the format, YMU and YOF depend on it
         self.rsc.write('DAT:STAR {}'.format(start))
         self.rsc.write('DAT:STOP {}'.format(stop))
+        self._data_range = None
         data = self.rsc.query('CURV?')
         data = data.split(',')
         data = np.array(list(map(float, data)))
@@ -66,6 +94,270 @@ class TBS1202B():
         xdata = np.arange(len(data)) * parameters['XIN'] + parameters['XZE']
         return list(xdata), list(ydata)
 
+    # Binary transfer
+    # RIB: signed integer, RPB: positive (unsigned) integer, both most significant byte first.
+    DTYPES = {('RIB', 1): '>i1', ('RIB', 2): '>i2', ('RPB', 1): '>u1', ('RPB', 2): '>u2'}
+
+    @holds_port
+    def _set_source(self, channel):
+        if self._source != channel:
+            self.rsc.write('DAT:SOU CH{}'.format(channel))
+            self._source = channel
+
+    @holds_port
+    def set_data_format(self, encoding='RIB', width=1, start=1, stop=2500):
+        """ Sets the binary transfer format and range (only sends what changed).
+
+        :param encoding: 'RIB' (signed) or 'RPB' (unsigned)
+        :type encoding: str
+        :param width: bytes per point, 1 or 2. The digitizer has 8 bits, so 1 is enough unless averaging.
+        :type width: int
+        :param start: first point
+        :type start: int
+        :param stop: last point
+        :type stop: int
+        """
+        if (encoding, width) not in self.DTYPES:
+            raise ValueError('Unknown binary format: {} with width {}'.format(encoding, width))
+        if self._data_format != (encoding, width):
+            self.rsc.write('DAT:ENC {};WID {}'.format(encoding, width))
+            self._data_format = (encoding, width)
+            self._scaling = None
+        if self._data_range != (start, stop):
+            self.rsc.write('DAT:STAR {};STOP {}'.format(start, stop))
+            self._data_range = (start, stop)
+
+    def invalidate_scaling(self):
+        """ Forgets the cached scaling parameters (needed after changing the scale, offset or time base)."""
+        self._scaling = None
+
+    @holds_port
+    def scaling(self, channel, refresh=False):
+        """ Scaling parameters of the channel in the current format, cached.
+
+        :param channel: 1 or 2
+        :type channel: int
+        :param refresh: ask the oscilloscope again
+        :type refresh: bool
+        :return: dict with the WFMP values (XZE, XIN, PT_OF, YZE, YMU, YOF)
+        :rtype: dict
+        """
+        if self._scaling is None:
+            self._scaling = {}
+        if refresh or channel not in self._scaling:
+            self._set_source(channel)
+            self._scaling[channel] = self.acquire_parameters()
+        return self._scaling[channel]
+
+    def time_axis(self, channel=1):
+        """ Time of every point of the current range, in seconds.
+
+        :rtype: numpy.ndarray
+        """
+        p = self.scaling(channel)
+        start, stop = self._data_range
+        return (np.arange(start - 1, stop) - p['PT_OF']) * p['XIN'] + p['XZE']
+
+    @holds_port
+    def read_curve_raw(self, channel=1):
+        """ Transfers the curve of the channel as binary block, in the current format.
+
+        :return: the raw values (digitizing levels)
+        :rtype: numpy.ndarray
+        """
+        self._set_source(channel)
+        self.rsc.write('CURV?')
+        return ieee_block_to_array(self.rsc.read_raw(), self.DTYPES[self._data_format], termination='\n')
+
+    @holds_port
+    def acquire_curve_binary(self, channel=1, start=1, stop=2500, encoding='RIB', width=1, refresh=False):
+        """ Gets data from the oscilloscope, with binary transfer and cached scaling parameters.
+
+        :param channel: 1 or 2
+        :type channel: int
+        :param start: first point
+        :type start: int
+        :param stop: last point
+        :type stop: int
+        :param encoding: 'RIB' or 'RPB'
+        :type encoding: str
+        :param width: 1 or 2 bytes per point
+        :type width: int
+        :param refresh: ask the scaling parameters again (e.g. after changing the vertical scale)
+        :type refresh: bool
+        :return: time in s and voltage in V
+        :rtype: (numpy.ndarray, numpy.ndarray)
+        """
+        self.set_data_format(encoding, width, start, stop)
+        p = self.scaling(channel, refresh)
+        raw = self.read_curve_raw(channel)
+        ydata = (raw - p['YOF']) * p['YMU'] + p['YZE']
+        return self.time_axis(channel)[:len(ydata)], ydata
+
+    @holds_port
+    def acquire_channels(self, channels=(1, 2), repeat=1, start=1, stop=2500, encoding='RIB', width=1,
+                         single=False, callback=None):
+        """ Repeated acquisition of several channels, with binary transfer.
+
+        :param channels: channels to read
+        :type channels: tuple
+        :param repeat: number of acquisitions
+        :type repeat: int
+        :param start: first point
+        :type start: int
+        :param stop: last point
+        :type stop: int
+        :param encoding: 'RIB' or 'RPB'
+        :type encoding: str
+        :param width: 1 or 2 bytes per point
+        :type width: int
+        :param single: if True, every repetition starts a single sequence acquisition and waits for it;
+                       afterwards the previous stop after mode and run/stop state are restored
+        :type single: bool
+        :param callback: called after every repetition as callback(k, data[k])
+        :type callback: function
+        :return: time in s and voltages in V with shape (repeat, len(channels), points)
+        :rtype: (numpy.ndarray, numpy.ndarray)
+        """
+        self.set_data_format(encoding, width, start, stop)
+        scales = [self.scaling(ch) for ch in channels]
+        ymu = np.array([p['YMU'] for p in scales])[:, None]
+        yof = np.array([p['YOF'] for p in scales])[:, None]
+        yze = np.array([p['YZE'] for p in scales])[:, None]
+        data = np.empty((repeat, len(channels), stop - start + 1))
+        if single:
+            stop_after = self.rsc.query('ACQ:STOPA?').strip()
+            state = self.rsc.query('ACQ:STATE?').strip()
+            self.rsc.write('ACQ:STOPA SEQ')
+        try:
+            for k in range(repeat):
+                if single:
+                    self.rsc.write('ACQ:STATE ON')
+                    self.rsc.query('*OPC?')
+                for i, ch in enumerate(channels):
+                    data[k, i] = self.read_curve_raw(ch)
+                data[k] = (data[k] - yof) * ymu + yze
+                if callback is not None:
+                    callback(k, data[k])
+        finally:
+            if single:
+                self.rsc.write('ACQ:STOPA {}'.format(stop_after))
+                self.rsc.write('ACQ:STATE {}'.format(state))
+        return self.time_axis(channels[0]), data
+
+
+class _SimulatedResource:
+    """ Simulated VISA resource of the TBS1202B: two channels with a noisy sine, ASCII and binary curves.
+    byte_time simulates the transfer time per byte of the reply."""
+    def __init__(self, resource_name, byte_time=0.0):
+        self.resource_name = resource_name
+        self.timeout = 2000
+        self.byte_time = byte_time
+        self.state = {'ENC': 'ASCI', 'WID': 1, 'SOU': 1, 'STAR': 1, 'STOP': 2500, 'STOPA': 'RUNSTOP', 'STATE': 1}
+        self._reply = b''
+
+    def _levels(self):
+        n = self.state['STOP'] - self.state['STAR'] + 1
+        t = np.arange(n)
+        levels = 100 * np.sin(2 * np.pi * t / 500 + self.state['SOU']) + np.random.default_rng(self.state['SOU']).normal(0, 2, n)
+        return np.clip(np.round(levels), -127, 127).astype(int)
+
+    def write(self, message):
+        self._reply = b''
+        if message.lstrip(':').startswith('WFMP'):      # one query for all the preamble values
+            self._reply = self._answer('WFMP')
+            return
+        for command in message.split(';'):
+            command = command.strip().lstrip(':')
+            if command.endswith('?'):
+                self._reply = self._answer(command)
+                continue
+            if ' ' not in command:
+                continue
+            key, value = command.split(' ', 1)
+            node = key.split(':')[-1].upper()
+            if node.startswith('STOPA'):
+                self.state['STOPA'] = 'SEQUENCE' if value.upper().startswith('SEQ') else 'RUNSTOP'
+                continue
+            if node.startswith('STATE'):
+                # a single sequence is acquired at once, after which the acquisition is stopped
+                running = value.upper() in ('1', 'ON', 'RUN')
+                self.state['STATE'] = int(running and self.state['STOPA'] == 'RUNSTOP')
+                continue
+            key = node[:4]
+            if key == 'SOU':
+                self.state['SOU'] = int(value[2:])
+            elif key in ('WID', 'STAR', 'STOP'):
+                self.state[key] = int(value)
+            elif key in ('ENC', 'ENCD'):
+                self.state['ENC'] = value.upper()
+
+    def _answer(self, command):
+        node = command.split(':')[-1].upper().rstrip('?')
+        if node.startswith('STOPA'):
+            return self.state['STOPA'].encode() + b'\n'
+        if node.startswith('STATE'):
+            return str(self.state['STATE']).encode() + b'\n'
+        if command.startswith('CURV'):
+            levels = self._levels()
+            enc, width = self.state['ENC'], self.state['WID']
+            if width == 2:
+                levels = levels * 256       # the 8 bit value is in the most significant byte
+            if enc == 'ASCI':
+                return ','.join(map(str, levels)).encode() + b'\n'
+            if enc == 'RPB':
+                levels = levels + (128 if width == 1 else 32768)
+            dtype = TBS1202B.DTYPES[(enc, width)]
+            data = levels.astype(dtype).tobytes()
+            length = str(len(data)).encode()
+            return b'#' + str(len(length)).encode() + length + data + b'\n'
+        if command.startswith('WFMP'):
+            yof = 0.0
+            if self.state['ENC'] == 'RPB':
+                yof = 128.0 if self.state['WID'] == 1 else 32768.0
+            ymu = 0.04 if self.state['WID'] == 1 else 0.04 / 256
+            return '1e-3;4e-7;0;0;{};{}\n'.format(ymu, yof).encode()
+        if command.startswith('*IDN'):
+            return b'TEKTRONIX,TBS 1202B,C020303,SIMULATED\n'
+        return b'1\n'
+
+    def read_raw(self):
+        reply, self._reply = self._reply, b''
+        time.sleep(self.byte_time * len(reply))
+        return reply
+
+    def read(self):
+        return self.read_raw().decode().rstrip('\n')
+
+    def query(self, message):
+        self.write(message)
+        return self.read()
+
+    def close(self):
+        pass
+
+
+class TBS1202BDummy(TBS1202B):
+    """ Dummy TBS1202B that uses a simulated VISA resource.
+
+    :param instrument_id: kept for compatibility
+    :type instrument_id: str
+    :param byte_time: simulated transfer time per byte, in seconds
+    :type byte_time: float
+    """
+    def __init__(self, instrument_id='0x0368', byte_time=0.0):
+        super().__init__(instrument_id)
+        self.byte_time = byte_time
+
+    def initiate(self):
+        self.resource_name = 'USB0::0x0699::' + self.instrument_id + '::C020303::INSTR'
+        self._port_lock = port_lock(self.resource_name)
+        self.rsc = _SimulatedResource(self.resource_name, self.byte_time)
+        self._reset_cache()
+
+    def finalize(self):
+        self.rsc = None
+
 
 if __name__ == "__main__":
     osc = TBS1202B('0x0368')
@@ -75,3 +367,5 @@ if __name__ == "__main__":
     print('Try to get a curve')
     data = osc.acquire_curve()
     print(data)
+    t, v = osc.acquire_curve_binary(channel=1)
+    print(t[:5], v[:5])
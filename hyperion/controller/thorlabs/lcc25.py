@@ -18,6 +18,7 @@ import yaml
 from time import sleep, time
 from hyperion import ur, root_dir
 from hyperion.controller.base_controller import BaseController
+from hyperion.tools.port_tools import FramedReader, holds_port, port_lock, port_manager
 
 
 class Lcc(BaseController):
@@ -31,7 +32,8 @@ class Lcc(BaseController):
                 'encoding': 'ascii',
                 'baudrate': 115200,
                 'write_timeout': 2,
-                'read_timeout': 3}
+                'read_timeout': 3,
+                'prompt': '> '}
 
     OUTPUT_MODE = {'Voltage1': 1,
                    'Voltage2': 2,
@@ -50,6 +52,8 @@ class Lcc(BaseController):
         self._port = settings['port']
         self.dummy = settings['dummy']
         self.rsc = None
+        self._reader = None
+        self._port_lock = port_lock(None if self.dummy else self._port)
         self.logger.debug('Created object for the LCC. ')
 
         # these are variables for the @property methods
@@ -67,23 +71,25 @@ class Lcc(BaseController):
             self._is_initialized = True
 
         else:
-            self.rsc = serial.Serial()
-            self.rsc.port = self._port
-            self.rsc.baudrate = self.DEFAULTS['baudrate']
-            self.rsc.timeout = self.DEFAULTS['read_timeout']
-            self.rsc.write_timeout = self.DEFAULTS['write_timeout']
             self.logger.info('Initializing device LCC at port {}.'.format(self._port))
             # try to init
             while not self._is_initialized and count < 150:
                 try:
-                    self.rsc.open()
+                    self.rsc = port_manager.open_serial(self._port,
+                                                        baudrate=self.DEFAULTS['baudrate'],
+                                                        timeout=self.DEFAULTS['read_timeout'],
+                                                        write_timeout=self.DEFAULTS['write_timeout'])
                     self._is_initialized = True
 
-                except:
+                except serial.SerialException:
                     #self.logger.debug('Initialization Failed')
                     count  += 1
+                    sleep(0.05)
 
-                sleep(0.05)
+            if self._is_initialized:
+                self._reader = FramedReader(self.rsc,
+                                            terminator=self.DEFAULTS['prompt'].encode(self.DEFAULTS['encoding']),
+                                            timeout=self.DEFAULTS['read_timeout'])
 
         if self._is_initialized:
             self.logger.debug('Initialization succeded after {} failed attempts'.format(count))
@@ -104,6 +110,7 @@ class Lcc(BaseController):
         ans = self.query('*idn?')
         return ans
 
+    @holds_port
     def write(self, message):
         """ Sends the message to the device.
 
@@ -118,14 +125,12 @@ class Lcc(BaseController):
         msg = msg.encode(self.DEFAULTS['encoding'])
         self.rsc.write(msg)
 
+    @holds_port
     def read_serial_buffer_in(self):
         """
-        Reads everything the device has sent. By default it waits until a line
-        is terminated by a termination character (\n or \r), but that check can
-        be disabled using the input parameter.
+        Reads everything the device has sent, until the prompt ('> ') that the device sends
+        after each reply. It returns as soon as the prompt arrives (or after the read timeout).
 
-        :param untill_at_least_one_termination_char: defaults to True
-        :type untill_at_least_one_termination_char: bool
         :return: complete serial buffer from the device
         :rtype: bytes
 
@@ -133,19 +138,13 @@ class Lcc(BaseController):
         if not self._is_initialized:
             raise Warning('Trying to read from {} before initializing'.format(self.name))
 
-        raw = b''
-        # Keep checking
         to = time()
-        expire_time = time() + self.DEFAULTS['read_timeout'] + 0.00001 # in case _read_timeout is null
-
-        while (time() < expire_time):
-            raw += self.rsc.read(1)
-            if raw[-2:] == '> '.encode(self.DEFAULTS['encoding']):
-                break
+        raw = self._reader.read_until()
         self.logger.debug('Elapsed time: {} s'.format(time()-to))
         self.logger.debug('{} bytes received'.format(len(raw)))
         return raw
 
+    @holds_port
     def read(self):
         """ Reads message from the device
 
@@ -164,6 +163,7 @@ class Lcc(BaseController):
         self.logger.debug('Split: {}'.format(list))
         return list[-2]
 
+    @holds_port
     def query(self, message):
         """ Writes in the buffer and Reads the response.
 
@@ -175,7 +175,7 @@ class Lcc(BaseController):
         if not self._is_initialized:
             raise Warning('Trying to query from device before initializing.')
 
-        self.rsc.reset_input_buffer()
+        self._reader.reset()
         buf_size = self.rsc.in_waiting
         self.logger.debug('The buffer size before query is: {}'.format(buf_size))
         self.write(message)
@@ -191,7 +191,7 @@ class Lcc(BaseController):
         if self._is_initialized:
             if self.rsc is not None:
                 self.logger.debug('Is open? = {}'.format(self.rsc.is_open))
-                self.rsc.close()
+                port_manager.release(self.rsc)
                 self.logger.info('Resource connection closed.')
                 self.logger.debug('Is open? = {}'.format(self.rsc.is_open))
         else:
@@ -10,11 +10,13 @@ from hyperion import logging
 import yaml           #for the configuration file
 import os             #for playing with files in operation system
 import time
+import threading
 from hyperion import root_dir, ur
 import matplotlib.pyplot as plt
 import numpy as np
 
 from hyperion.instrument.base_instrument import BaseInstrument
+from hyperion.tools.array_tools import RingBuffer, correlation_delay, peak_position, rising_edge_delay
 
 class HydraInstrument(BaseInstrument):
     """
@@ -32,10 +34,18 @@ class HydraInstrument(BaseInstrument):
         self.sync = 0
         self.count = 0
         self.hist = []
+        self.all_hist = np.array([])
         self.initialize()
 
-        self.stop = False
+        self._stop_event = threading.Event()
         self.hist_ended = False
+        self.poll_margin = 0.2*ur('s')      # start asking ctc_status this long before the expected end
+        self.poll_min = 10*ur('ms')         # shortest time between two ctc_status polls
+        self.poll_max = 1*ur('s')           # longest sleep, also sets how often time_passed is updated
+
+        self.rate_buffer = None             # RingBuffer filled by the count rate monitor
+        self._monitor_thread = None
+        self._monitor_stop = threading.Event()
         #self.remaining_time = 0*ur('s')
         self.time_passed = 0*ur('s')
 
@@ -104,6 +114,60 @@ class HydraInstrument(BaseInstrument):
         self.count = self.controller.count_rate(channel) * ur('cps')
         return self.count
 
+    def start_count_rate_monitor(self, interval=100*ur('ms'), length=1000):
+        """ | Starts a background thread that reads the sync rate and the count rates of all channels every interval,
+        | in one call to the device, and stores them in self.rate_buffer (a RingBuffer).
+        | Every row of the buffer is [time in s, sync rate, rate channel 0, rate channel 1, ...] in counts per second.
+        | Use count_rate_history() to get them. Calling it while the monitor runs restarts it with the new settings.
+
+        :param interval: time between two samples; the rate meters of the device update every 100 ms
+        :type interval: pint quantity
+
+        :param length: number of samples to keep
+        :type length: int
+        """
+        self.stop_count_rate_monitor()
+        channels = self.controller.number_input_channels
+        self.rate_buffer = RingBuffer(length, 2 + channels)
+        self._monitor_stop.clear()
+        self._monitor_thread = threading.Thread(target=self._count_rate_monitor, args=(interval.m_as('s'),), daemon=True)
+        self._monitor_thread.start()
+        self.logger.debug('Count rate monitor started')
+
+    def _count_rate_monitor(self, interval):
+        """ Loop of the count rate monitor thread, see start_count_rate_monitor."""
+        next_time = time.time()
+        while not self._monitor_stop.is_set():
+            rates = self.controller.all_count_rates()
+            if rates is not None:
+                sync, counts = rates
+                self.rate_buffer.append(np.concatenate(([time.time(), sync], counts)))
+            next_time = max(next_time + interval, time.time())
+            self._monitor_stop.wait(next_time - time.time())
+
+    def stop_count_rate_monitor(self):
+        """ Stops the count rate monitor thread (if it is running). The buffer is kept."""
+        if self._monitor_thread is not None:
+            self._monitor_stop.set()
+            self._monitor_thread.join()
+            self._monitor_thread = None
+            self.logger.debug('Count rate monitor stopped')
+
+    def count_rate_history(self, copy=False):
+        """ | The samples of the count rate monitor, oldest first, as array of shape (samples, 2 + channels).
+        | Columns are [time in s, sync rate, rate channel 0, rate channel 1, ...].
+        | By default this is a view on the buffer (no copy), see RingBuffer.view().
+
+        :param copy: return a copy instead of a view
+        :type copy: bool
+
+        :return: the stored samples, or None if the monitor was never started
+        :rtype: array
+        """
+        if self.rate_buffer is None:
+            return None
+        return self.rate_buffer.view(copy)
+
     def set_histogram(self,leng,res):
         """ | Clears the possible previous histogram, sets the histogram length and resolution.
         | *Has also to do with the binning and the length of the histogram.*
@@ -120,100 +184,329 @@ class HydraInstrument(BaseInstrument):
         self.controller.resolution = res.m_as('ps')
         self.logger.debug('Set the parameters for taking a histogram')
     
-    def make_histogram(self, integration_time, count_channel):
+    @property
+    def stop(self):
+        """ True if a stop of the running histogram is requested; setting it wakes up wait_till_finished immediately."""
+        return self._stop_event.is_set()
+
+    @stop.setter
+    def stop(self, value):
+        if value:
+            self._stop_event.set()
+        else:
+            self._stop_event.clear()
+
+    def make_histogram(self, integration_time, count_channel=None, hist_interval=None, callback=None):
         """ | Does the histogram measurement, checking for the status, saving the histogram.
         | **You need to start the measurement and than you could collect the histogram.**
-        | This communicates with the controller method start_measurement and than goes to the wait_till_finished method. 
-        
-        :param count_channel: number of channel that is correlated with the sync channel, 1 or 2
-        :type count_channel: int
+        | This communicates with the controller method start_measurement and than goes to the wait_till_finished method.
+        | The histograms of all channels are read out in one go and stored in self.all_hist, so one acquisition gives every channel.
 
         :param integration_time: acquisition time of the histogram; **(please don't use the word time)**
         :type integration_time: pint quantity
 
-        :return: array containing the histogram
+        :param count_channel: number of channel that is correlated with the sync channel, 0 or 1; None returns all channels
+        :type count_channel: int or None
+
+        :param hist_interval: if given, the intermediate histogram is downloaded this often (see wait_till_finished)
+        :type hist_interval: pint quantity or None
+
+        :param callback: function called with every intermediate histogram (only used with hist_interval)
+        :type callback: callable or None
+
+        :return: array containing the histogram, or array of shape (channels, bins) if count_channel is None
         :rtype: array
         """
         #self.logger.info('Remaining time: ' + str(self.prepare_to_take_histogram(tijd)))
         #self.prepare_to_take_histogram(tijd)
 
         self.logger.debug('Start the histogram measurement')
+        self.stop = False
         self.controller.start_measurement(int(integration_time.m_as('ms')))
 
-        self.wait_till_finished(integration_time, count_channel)
+        self.wait_till_finished(integration_time, 0 if count_channel is None else count_channel,
+                                hist_interval=hist_interval, callback=callback)
         self.logger.debug('Time passed: ' + str(self.time_passed))
 
-        self.hist = self.controller.histogram(int(count_channel), True)     #Last time, put the histogram memory to 0
+        self.hist_ended = False
+        self.all_histograms(True)     #Last time, put the histogram memory to 0
 
         self.logger.debug('Collect the histogram after taking it.')
 
-        self.hist_ended = False
+        if count_channel is None:
+            self.hist = self.all_hist[0]
+            return self.all_hist
+        self.hist = self.all_hist[int(count_channel)]
         return self.hist
 
-    def show_time_passed(self, integration_time, time_passed):
-        self.time_passed = time_passed
-        #print(self.time_passed)
-        remaining_time = integration_time - time_passed
-        return self.time_passed
+    def all_histograms(self, clear=True):
+        """ | Reads out the histograms of all channels at once, without starting a measurement.
+        | Stores them in self.all_hist. If the device does not give them, a RuntimeError is raised and self.all_hist is not changed.
 
-    def wait_till_finished(self, integration_time, count_channel):
-        """| This method should ask the device its status and keep asking until it's finished.
-        | However, the remaining time is printed but not shown with the timer in the gui.
-        | The loop breaks if self.stop is put to True, which could be done in a higher level with a thread.
+        :param clear: clears the histogram memory of the device after reading if True
+        :type clear: bool
 
-        :param integration_time: integration time of histogram **(please don't use the word time)**
+        :return: array of shape (channels, bins)
+        :rtype: array
+        """
+        hists = self.controller.all_histograms(clear)
+        if hists is None:
+            self.logger.error('Reading the histograms failed: {}'.format(self.controller.error_string))
+            raise RuntimeError('The correlator did not return the histograms ({})'.format(self.controller.error_string))
+        self.all_hist = hists
+        return self.all_hist
+
+    def set_mode(self, mode='Histogram'):
+        """ | Re-initializes the device in another measurement mode ('Histogram', 'T2', 'T3' or 'Continuous').
+        | This resets the device, so it is calibrated and configured again; set the histogram afterwards with set_histogram.
+
+        :param mode: measurement mode
+        :type mode: string
+        """
+        self.logger.info('Putting the correlator in {} mode'.format(mode))
+        self.controller.initialize(mode=mode, clock=self.controller._config['clock'])
+        self.controller.calibrate()
+        self.configurate()
+
+    def make_continuous_histograms(self, block_time, n_blocks, out=None, callback=None):
+        """ | Takes n_blocks consecutive histograms of block_time each, with one start of the device.
+        | **The device has to be in 'Continuous' mode (see set_mode) and the histogram length can be at most 8192.**
+        | The device restarts the acquisition by itself after every block, so there is no setup time between blocks,
+        | which makes it suited for taking a whole line of a scan at once.
+        | Every block is written into out[k] and, if given, callback(k, histograms) is called, e.g. to store it
+        | with the DataManager: callback=lambda k, h: datman.var('hist', h, indices=[k], dims=('block',), extra_dims=('channel', 'bin'))
+
+        :param block_time: acquisition time of a single histogram
+        :type block_time: pint quantity
+
+        :param n_blocks: number of histograms to take
+        :type n_blocks: int
+
+        :param out: array of shape (n_blocks, channels, histogram_length) to write into; created if None
+        :type out: numpy array or None
+
+        :param callback: function called as callback(block_index, histograms) for every block
+        :type callback: callable or None
+
+        :return: array of shape (n_blocks, channels, histogram_length) with the histograms
+        :rtype: array
+        """
+        if self.controller.mode != 'Continuous':
+            raise RuntimeError("The correlator has to be in 'Continuous' mode, use set_mode('Continuous') first.")
+        channels = self.controller.number_input_channels
+        if out is None:
+            out = np.zeros((n_blocks, channels, self.controller.histogram_length), dtype=np.uint32)
+
+        self.stop = False
+        self.controller.measurement_control('CONT_CTC_RESTART')
+        k = 0
+        try:
+            self.controller.start_measurement(int(block_time.m_as('ms')))
+            t_start = time.time()
+            poll = min(self.poll_min.m_as('s'), block_time.m_as('s') / 10)
+            first_block = None
+            while k < n_blocks:
+                block = self.controller.continuous_mode_block()
+                if block is None:
+                    if self._stop_event.wait(poll):
+                        self.logger.info('Stopping the continuous measurement after {} blocks'.format(k))
+                        self.stop = False
+                        break
+                    continue
+                header, hists, sums = block
+                if first_block is None:
+                    first_block = int(header['blocknum'])
+                elif int(header['blocknum']) - first_block != k:
+                    self.logger.warning('Lost {} block(s) in continuous mode'.format(int(header['blocknum']) - first_block - k))
+                out[k] = hists
+                if callback is not None:
+                    callback(k, out[k])
+                k += 1
+                self.show_time_passed(n_blocks * block_time, (time.time() - t_start) * ur('s'))
+        finally:
+            # also if the callback raised: the device should not keep restarting, and make_histogram expects a single shot
+            try:
+                self.controller.stop_measurement()
+            finally:
+                self.controller.measurement_control('SINGLESHOT_CTC')
+
+        self.all_hist = out[max(k - 1, 0)]
+        self.hist = self.all_hist[0]
+        return out[:k]
+
+    def auto_align_offsets(self, integration_time=1*ur('s'), reference=None, target=None, channels=None,
+                           iterations=2, tolerance=1*ur('ps'), method='edge', edge_width=50*ur('ps')):
+        """ | Aligns the input channels by taking short histograms and writing corrected offsets to the device.
+        | The delay of every channel with respect to a reference is compensated with input_offset; the new offsets are also stored in self.settings.
+        | With method 'edge' the delay is that of the rising edges (see array_tools.rising_edge_delay), so channels with
+        | different lifetimes are aligned on the start of their decays. With method 'correlation' it comes from the
+        | cross-correlation of the whole histograms, which is only right if they have the same shape (e.g. all IRFs, or an IRF as reference).
+        | Without reference, all channels are aligned to the first one in channels.
+        | With a reference histogram (same resolution, e.g. one saved after a manual alignment), every channel is aligned to it.
+        | If target is given (and no reference), the sync offset is changed too, so the maximum of the first channel ends up at target.
+        | This is repeated until all corrections are below tolerance, at most iterations times; stop_histogram interrupts it.
+        | Use set_histogram first to choose the resolution: it should resolve the features, while the histogram covers the delays.
+
+        :param integration_time: acquisition time of every histogram
         :type integration_time: pint quantity
 
-        :param count_channel: number of channel that is correlated with the sync channel, 1 or 2
-        :type count_channel: int
+        :param reference: histogram to align all channels to (optional)
+        :type reference: array or None
 
-        :return: remaining time in seconds
-        :rtype: pint quantity
+        :param target: time (in the histogram) where the maximum of the first channel should be (optional)
+        :type target: pint quantity or None
+
+        :param channels: input channels to align, e.g. [0, 1]; defaults to all
+        :type channels: list or None
+
+        :param iterations: maximum number of acquisitions (defaults to 2)
+        :type iterations: int
+
+        :param tolerance: stop when all corrections are smaller (defaults to 1 ps, the step of the offsets)
+        :type tolerance: pint quantity
+
+        :param method: 'edge' (default) to align the rising edges, 'correlation' to align the whole histograms
+        :type method: string
+
+        :param edge_width: width of the rising edge (about the instrument response), used to smooth the histograms with method 'edge'
+        :type edge_width: pint quantity
 
+        :return: the offsets after aligning, e.g. {'sync_offset': 0 ps, 'chan1_offset': 0 ps, 'chan2_offset': 250 ps}
+        :rtype: dict
         """
-        # ended = self.hist_ended
-        #t = round(float(tijd.magnitude) / 20)
+        assert method in ('edge', 'correlation'), "method should be 'edge' or 'correlation'"
+        if channels is None:
+            channels = list(range(self.controller.number_input_channels))
+        low = self.controller.settings['CHANOFFSMIN']
+        high = self.controller.settings['CHANOFFSMAX']
+        resolution = self.controller.resolution
+        smooth = max(int(round(edge_width.m_as('ps') / resolution)), 1)
+        offsets = {}
+
+        for iteration in range(iterations):
+            self.stop = False
+            self.controller.start_measurement(int(integration_time.m_as('ms')))
+            self.wait_till_finished(integration_time, channels[0])
+            if not self.hist_ended:
+                self.logger.info('Stopped aligning the offsets')
+                break
+            hists = self.all_histograms(True)
+
+            corrections = {}
+            ref = hists[channels[0]] if reference is None else reference
+            for ch in channels:
+                if reference is None and ch == channels[0]:
+                    continue
+                if method == 'edge':
+                    delay = rising_edge_delay(hists[ch], ref, smooth) * resolution
+                else:
+                    delay = correlation_delay(hists[ch], ref) * resolution
+                corrections['chan{}_offset'.format(ch + 1)] = -delay
+            if target is not None and reference is None:
+                peak = peak_position(hists[channels[0]]) * resolution + self.settings['hist_offset'].m_as('ps')
+                corrections['sync_offset'] = peak - target.m_as('ps')
+            self.logger.debug('Offset corrections (ps) in iteration {}: {}'.format(iteration, corrections))
+
+            for key, correction in corrections.items():
+                value = int(round(self.settings.get(key, 0*ur('ps')).m_as('ps') + correction))
+                if value < low or value > high:
+                    self.logger.warning('{} of {} ps is out of range, using the limit'.format(key, value))
+                    value = min(max(value, low), high)
+                self.settings[key] = value * ur('ps')
+                if key == 'sync_offset':
+                    self.controller.sync_offset(value)
+                else:
+                    self.controller.input_offset(int(key[4:-7]) - 1, value)
+                offsets[key] = self.settings[key]
+
+            if all(abs(c) < tolerance.m_as('ps') for c in corrections.values()):
+                break
 
-        t = 1       # in s
-        total_time_passed = ur('0s')
+        self.logger.info('Aligned offsets: {}'.format(offsets))
+        return offsets
 
-        self.logger.debug('Ended?: ' + str(self.hist_ended))
-        total_time_passed += t * ur('s')
+    def show_time_passed(self, integration_time, time_passed):
+        self.time_passed = time_passed
+        #print(self.time_passed)
+        remaining_time = integration_time - time_passed
+        return self.time_passed
 
-        self.logger.debug('time passed: {}'.format(self.show_time_passed(integration_time, total_time_passed)))
+    def wait_till_finished(self, integration_time, count_channel, hist_interval=None, callback=None):
+        """| This method waits until the device says the acquisition is finished.
+        | It sleeps until shortly (poll_margin) before the expected end and then polls ctc_status every poll_min,
+        | so there is almost no dead time between the end of the acquisition and the read out.
+        | The intermediate histogram is only downloaded if hist_interval is given; it is stored in self.hist and passed to callback.
+        | The wait is interrupted as soon as stop_histogram is called (or self.stop is set), which could be done in a higher level with a thread.
 
-        time.sleep(1)
+        :param integration_time: integration time of histogram **(please don't use the word time)**
+        :type integration_time: pint quantity
 
-        while self.hist_ended == False:
-            self.hist_ended = self.controller.ctc_status
-            self.logger.debug('Is the histogram finished? ' + str(self.hist_ended))
+        :param count_channel: number of channel that is correlated with the sync channel, 0 or 1
+        :type count_channel: int
 
-            total_time_passed += t * ur('s')
-            #this line returns a pint quantity which tells the user how much time the program needs before it can collect the histogram
-            self.logger.debug('time passed ' + str(total_time_passed))
+        :param hist_interval: time between intermediate histograms; None for no intermediate histograms
+        :type hist_interval: pint quantity or None
 
-            self.show_time_passed(integration_time, total_time_passed)
-            self.logger.debug('time_passed value: {}'.format(self.time_passed))
+        :param callback: function called with every intermediate histogram
+        :type callback: callable or None
 
-            self.hist = self.controller.histogram(int(count_channel), False)        #Dont let the histogram memory be cleared
-            time.sleep(t)
+        :return: time passed in seconds
+        :rtype: pint quantity
+        """
+        t_start = time.time()
+        t_end = t_start + integration_time.m_as('s')
+        margin = self.poll_margin.m_as('s')
+        poll_min = self.poll_min.m_as('s')
+        poll_max = self.poll_max.m_as('s')
+        if hist_interval is not None:
+            interval = max(hist_interval.m_as('s'), poll_min)
+            next_hist = t_start + interval
 
-            if self.stop:
+        self.hist_ended = False
+        while not self.hist_ended:
+            now = time.time()
+            self.show_time_passed(integration_time, (now - t_start) * ur('s'))
+
+            if now >= t_end - margin:
+                self.hist_ended = bool(self.controller.ctc_status)
+                if self.hist_ended:
+                    break
+                wait = poll_min
+            else:
+                wait = min(t_end - margin - now, poll_max)
+
+            if hist_interval is not None:
+                if now >= next_hist:
+                    hist = self.controller.histogram(int(count_channel), False)  # Dont let the histogram memory be cleared
+                    if hist is None:
+                        self.logger.warning('Reading the intermediate histogram failed: {}'.format(self.controller.error_string))
+                    else:
+                        self.hist = hist
+                        if callback is not None:
+                            callback(self.hist)
+                    next_hist += interval * (1 + (now - next_hist) // interval)
+                wait = min(wait, max(next_hist - time.time(), 0))
+
+            if self._stop_event.wait(max(wait, 0)):
                 self.logger.info('Stopping the histogram')
                 self.stop = False
                 break
 
-        self.logger.debug('Time passed: ' + str(self.show_time_passed(integration_time, total_time_passed)))
-        self.logger.debug('Ended? ' + str(self.hist_ended))
+        self.show_time_passed(integration_time, (time.time() - t_start) * ur('s'))
+        self.logger.debug('Time passed: {}, ended? {}'.format(self.time_passed, self.hist_ended))
+        return self.time_passed
 
     def stop_histogram(self):
         """| This method stops taking the histogram, could be used in higher levels with a thread.
+        | It also wakes up wait_till_finished, so the waiting thread returns right away.
         """
+        self.stop = True
         self.controller.stop_measurement()
 
     def finalize(self):
         """ This method is to close connection to the device."""
         self.logger.info('Closing connection to hydraharp.')
+        self.stop_count_rate_monitor()
         self.controller.finalize()
 
 if __name__ == "__main__":
@@ -102,50 +102,44 @@ class FunGen(BaseInstrument):
             self.logger.info('Applying defaults from the configuration file.')
             self.logger.debug('Dict to use: {}'.format(self.DEFAULTS['defaults']))
 
-            for di in self.DEFAULTS['defaults']:
-                ch = di['channel']
-                self.logger.info('Applying defaults to channel {}'.format(ch))
-
-                if ch not in self.CHANNELS:
-                    raise Warning('The channel "{}" is not recognized by this instrument.'.format(ch))
-
-                self.logger.debug('Applying waveform = {}'.format(di['waveform']))
-                self.set_waveform(ch, di['waveform']['function'])
-                sleep(0.1)
-
-                if 'frequency' in di['waveform'].keys():
-                    self.logger.debug('Applying Frequency = {}'.format(di['waveform']['frequency']))
-                    self.set_frequency(ch, ur(di['waveform']['frequency']))
-                    sleep(0.1)
-
-
-                self.logger.debug('Applying Voltage limit high={} and low={}'.format(di['limit_high'],
-                                                                                     di['limit_low']))
-                self.set_voltage_limits(ch, ur(di['limit_high']), ur(di['limit_low']))
-                self.logger.debug('Turning on voltage limits')
-                self.enable_voltage_limits(ch, True)
-                sleep(0.1)
-
-                if 'high' in di['waveform'].keys():
-                    self.logger.debug('Applying High Voltage {}'.format(di['waveform']['high']))
-                    self.set_voltage_high(ch, ur(di['waveform']['high']))
-                    sleep(0.1)
-
-                if 'low' in di['waveform'].keys():
-                    self.logger.debug('Applying Low Voltage {}'.format(di['waveform']['low']))
-                    self.set_voltage_low(ch, ur(di['waveform']['low']))
-                    sleep(0.1)
-
-                if 'dc' in di['waveform'].keys():
-                    self.logger.debug('Setting DC offset {} for channel.'.format(di['waveform']['dc']))
-                    self.set_voltage_offset(ch, ur(di['waveform']['dc']))
-                    sleep(0.1)
-
-                self.logger.debug('Setting status {} for channel.'.format(di['output']))
-                self.enable_output(ch, di['output'])
-                sleep(0.1)
-
-                self.logger.info('Error info: {}.'.format(self.get_system_error()))
+            # all the settings are sent in one batch: no sleeps needed and the errors are checked once
+            with self.controller.batch() as errors:
+                for di in self.DEFAULTS['defaults']:
+                    ch = di['channel']
+                    self.logger.info('Applying defaults to channel {}'.format(ch))
+
+                    if ch not in self.CHANNELS:
+                        raise Warning('The channel "{}" is not recognized by this instrument.'.format(ch))
+
+                    self.logger.debug('Applying waveform = {}'.format(di['waveform']))
+                    self.set_waveform(ch, di['waveform']['function'])
+
+                    if 'frequency' in di['waveform'].keys():
+                        self.logger.debug('Applying Frequency = {}'.format(di['waveform']['frequency']))
+                        self.set_frequency(ch, ur(di['waveform']['frequency']))
+
+                    self.logger.debug('Applying Voltage limit high={} and low={}'.format(di['limit_high'],
+                                                                                         di['limit_low']))
+                    self.set_voltage_limits(ch, ur(di['limit_high']), ur(di['limit_low']))
+                    self.logger.debug('Turning on voltage limits')
+                    self.enable_voltage_limits(ch, True)
+
+                    if 'high' in di['waveform'].keys():
+                        self.logger.debug('Applying High Voltage {}'.format(di['waveform']['high']))
+                        self.set_voltage_high(ch, ur(di['waveform']['high']))
+
+                    if 'low' in di['waveform'].keys():
+                        self.logger.debug('Applying Low Voltage {}'.format(di['waveform']['low']))
+                        self.set_voltage_low(ch, ur(di['waveform']['low']))
+
+                    if 'dc' in di['waveform'].keys():
+                        self.logger.debug('Setting DC offset {} for channel.'.format(di['waveform']['dc']))
+                        self.set_voltage_offset(ch, ur(di['waveform']['dc']))
+
+                    self.logger.debug('Setting status {} for channel.'.format(di['output']))
+                    self.enable_output(ch, di['output'])
+
+            self.logger.info('Error info: {}.'.format(errors if errors else 'no errors'))
         else:
             self.logger.info('The default settings were not applied.')
 
@@ -331,6 +325,56 @@ class FunGen(BaseInstrument):
         """
         return self.controller.get_waveform(channel)
 
+    def upload_arb(self, channel, samples, sample_rate, name='HYP_ARB', dtype='int16', clear=True):
+        """ Uploads an arbitrary waveform to the channel and plays it. The waveform runs on the device
+        with its own sample clock, so timing-critical patterns do not depend on Python.
+        See Agilent33522A.upload_arb.
+
+        :param channel: number of channel. it can be 1 or 2 for this model
+        :type channel: int
+        :param samples: values between -1 and 1, scaled by the amplitude and offset of the channel
+        :type samples: numpy array
+        :param sample_rate: sample rate
+        :type sample_rate: pint quantity
+        :param name: name of the waveform on the device
+        :type name: string
+        :param dtype: 'int16' or 'float32'
+        :type dtype: string
+        :param clear: clear the waveforms uploaded before to this channel
+        :type clear: logical
+        :return: list of errors reported by the device
+        :rtype: list
+        """
+        self.logger.info('Uploading arbitrary waveform {} of {} points to channel {}'.format(name, len(samples), channel))
+        return self.controller.upload_arb(channel, samples, sample_rate.m_as('hertz'), name, dtype, clear)
+
+    def upload_sequence(self, channel, name, steps, sample_rate):
+        """ Plays a sequence of arbitrary waveforms that are uploaded to the channel with upload_arb.
+        See Agilent33522A.upload_sequence.
+
+        :param channel: number of channel. it can be 1 or 2 for this model
+        :type channel: int
+        :param name: name of the sequence
+        :type name: string
+        :param steps: list of (name of a waveform, number of times it is repeated)
+        :type steps: list
+        :param sample_rate: sample rate
+        :type sample_rate: pint quantity
+        :return: list of errors reported by the device
+        :rtype: list
+        """
+        return self.controller.upload_sequence(channel, name, steps, sample_rate.m_as('hertz'))
+
+    def get_sample_rate(self, channel):
+        """ Gets the sample rate of the arbitrary waveform of the channel.
+
+        :param channel: number of channel. it can be 1 or 2 for this model
+        :type channel: int
+        :return: sample rate
+        :rtype: pint quantity
+        """
+        return float(self.controller.get_sample_rate(channel)) * ur('hertz')
+
     def finalize(self, state=True):
         """ Closes the connection to the device
 
@@ -339,9 +383,9 @@ class FunGen(BaseInstrument):
 
         if not state:
             self.logger.info('The output will be turned off for both channels.')
-            for ch in self.CHANNELS:
-                self.controller.enable_output(ch, False)
-                sleep(0.1)
+            with self.controller.batch():
+                for ch in self.CHANNELS:
+                    self.controller.enable_output(ch, False)
         else:
             self.logger.info('The output will be kept on.')
 
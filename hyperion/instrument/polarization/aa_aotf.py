@@ -71,9 +71,8 @@ class AaAotf(BaseInstrument):
         if 'apply_defaults' in settings.keys():
             if settings['apply_defaults']:
                 self.logger.info('Applying defaults to AaAOTF')
-                # apply defaults to all values
-                for i in range(8):
-                    self.set_defaults(i+1)
+                # apply defaults to all values (in one write)
+                self.set_defaults(range(1, 9))
                 self.blanking(True, 'internal')
 
     def load_calibration(self, cal_file):
@@ -169,19 +168,20 @@ class AaAotf(BaseInstrument):
         """ Sets channel to default values given in the dictionary
         at the beginning of the class.
 
-        :param channel: channel value to put to default settings.
-        :type channel: int
+        :param channel: channel value to put to default settings, or list of channels (set in one write)
+        :type channel: int or list
         """
-
-        self.logger.info('Setting defaults for channel {}'.format(channel))
-        self.logger.debug('Frequency: {}'.format(self.DEFAULT_SETTINGS['frequency'][channel - 1]))
-        self.logger.debug('Power: {}'.format(self.DEFAULT_SETTINGS['power'][channel - 1]))
+        channels = [channel] if np.isscalar(channel) else list(channel)
+        values = []
+        for ch in channels:
+            self.logger.info('Setting defaults for channel {}'.format(ch))
+            values.append((ch, self.DEFAULT_SETTINGS['frequency'][ch - 1],
+                           self.DEFAULT_SETTINGS['power'][ch - 1],
+                           self.DEFAULT_SETTINGS['state'], self.DEFAULT_SETTINGS['mode']))
         self.logger.debug('State: {}'.format(self.DEFAULT_SETTINGS['state']))
         self.logger.debug('Mode: {}'.format(self.DEFAULT_SETTINGS['mode']))
 
-        self.controller.set_all(channel, self.DEFAULT_SETTINGS['frequency'][channel - 1],
-                            self.DEFAULT_SETTINGS['power'][channel - 1],
-                            self.DEFAULT_SETTINGS['state'], self.DEFAULT_SETTINGS['mode'])
+        self.controller.set_all_channels(values)
 
     def set_frequency_all_range(self, freq, power, state=True, mode='internal'):
         """ Automatically chooses channel 1 or 7 depending on the frequency requested and sets it.
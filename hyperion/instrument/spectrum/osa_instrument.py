@@ -176,8 +176,8 @@ class OsaInstrument(BaseInstrument):
         """
         Method where a spectrum will be taken using the osa machine.
 
-        :return: wav, spec: two list containing the data from the taken spectrum.
-        :rtype wav, sepec: wav(a list of floats), spec(a list of floats)
+        :return: wav, spec: two arrays containing the data from the taken spectrum.
+        :rtype wav, sepec: wav(numpy array of floats), spec(numpy array of floats)
         """
         self.logger.info('taking spectrum')
         self.is_busy = True
@@ -37,7 +37,7 @@ from hyperion import ur, Q_
 import time
 import os
 import yaml
-# import numpy as np      # I'm having issues with numpy on the computer I'm developing, so I disable it temporarily and modified take_spectrum not to depend on it
+import numpy as np
 
 class WinspecInstr(BaseInstrument):
     """ Winspec Instrument
@@ -54,6 +54,8 @@ class WinspecInstr(BaseInstrument):
 
     """
 
+    frame_dtypes = {'FLOAT': np.float32, 'LONG': np.int32}     # numpy dtype of the frames per Winspec data type
+
     def __init__(self, settings):                   # not specifying a default value for settings is less confusing for novice users
         # don't place the docstring here but above in the class definition
         super().__init__(settings)                  # mandatory line
@@ -68,6 +70,31 @@ class WinspecInstr(BaseInstrument):
         self._ccd = self._remove_unavailable('ccd', ['Full', 'ROI'])
         self._autosave = self._remove_unavailable('autosave', ['Ask', 'Auto', 'No'])
         self._accums = 1
+        self._data_type = 'FLOAT'
+        self._frame_buffer = None   # reused for every frame, see _frame_to_array()
+        self._nm_axis = None        # cached by nm_axis(), reset when grating, central_nm or ROI change
+
+        # settings of wait_till_finished():
+        self.poll_margin = 50*ur('ms')      # start polling this long before the expected end of the exposure
+        self.poll_min = 1*ur('ms')          # first time between two polls; it doubles after every poll ...
+        self.poll_max = 100*ur('ms')        # ... up to this value
+        self._stop_event = threading.Event()
+        self._acquisition_start = None      # time.time() at start_acquiring
+        self._expected_duration = 0         # exposure time x accumulations in s, at start_acquiring
+        self.overhead_after_exposure = None # time between expected end of the exposures and Winspec being done
+
+        # Dark and flat field correction in python (see take_dark, take_flat and correct):
+        self.correction = self.settings.get('correction', False)    # apply the correction to every frame
+        self.auto_dark = True               # take a new dark when there is none for the current settings
+        self.dark_frames = 1                # number of frames averaged for a dark or a flat
+        self._darks = {}                    # dark per (exposure time, accumulations, ROI)
+        self._flats = {}                    # 1/(normalized flat) per ROI
+        self._roi_key = None                # ROI and binning as tuple, reset when the ROI changes
+        self._corrected = None              # reused float32 buffer for corrected frames
+        self._taking_reference = False      # True while taking a dark or a flat (no correction and no auto dark)
+
+        # collect_spectrum returns lists (like it used to) instead of numpy arrays if this is True
+        self.return_list = self.settings.get('return_list', False)
 
         if 'horz_width_multiple' in self.settings:
             self._horz_width_multiple = self.settings['horz_width_multiple']  # This parameter specifies if camera requires horizontal range of certain interval
@@ -131,14 +158,15 @@ class WinspecInstr(BaseInstrument):
 
         self.configure_settings()
 
-        if self.data_type != 'FLOAT' or self.data_type != 'LONG':
-            self.logger.warning('Datatype should be FLOAT or LONG, not {}. Changing to FLOAT'.format(self.data_type))
+        if self.data_type not in self.frame_dtypes:
+            self.logger.warning('Datatype should be FLOAT or LONG, not {}. Changing to FLOAT'.format(self._data_type))
             self.data_type = 'FLOAT'
 
     def _move_grating(self):
         """ Low level function to move grating after specifying the new position. """
         self._is_moving = True
         self.controller.spt.Move()
+        self.controller.invalidate('SPT')          # the grating position changed
         self._is_moving = False
 
     def finalize(self):
@@ -176,10 +204,12 @@ class WinspecInstr(BaseInstrument):
         Starts acquisition of spectrum. Does not wait for it to finish.
         If name is specified. The last spectrum in WinSpec is closed and a new spectrum with the specified name is created.
         If name is None (DEFAULT) the current spectrum will be overwritten.
+        If correction and auto_dark are on and there is no dark for the current settings, a dark is taken first.
 
         :param name: Full path to file to store. Or None, for using default.
         :type name: string
         """
+        self._take_missing_dark()
 
         if name==None:
             # name=self.default_name
@@ -197,33 +227,137 @@ class WinspecInstr(BaseInstrument):
                     self.logger.warning('Winspec: Failed to close doc')
             self.filename = name
             self.doc = self.controller.docfile()
+        self._stop_event.clear()
+        self._expected_duration = self._exposure_time.m_as('s') * self._accums
+        self._acquisition_start = time.time()
         self.controller.exp.Start(self.doc)
 
+    def _take_missing_dark(self):
+        """ Low level function that takes a dark if correction and auto_dark are on and there is none for the current settings."""
+        if self.correction and self.auto_dark and not self._taking_reference and self._correction_key() not in self._darks:
+            self.logger.info('No dark for the current settings, taking one')
+            self.take_dark()
+
+    def wait_till_finished(self, timeout=None, flag='RUNNING_EXPERIMENT'):
+        """
+        | Waits until Winspec is done with the acquisition started by start_acquiring().
+        | It sleeps until shortly (poll_margin) before the expected end, exposure_time x accumulations after the start,
+        | and then asks Winspec if it's still running, first every poll_min and then with increasing intervals up to poll_max.
+        | The wait is interrupted by stop_acquiring() (e.g. from another thread).
+        | The time between the expected end of the exposures and the end (readout, saving, ...) is stored in
+        | self.overhead_after_exposure.
+        | Note that the expected duration uses the last exposure time and accumulations read or set through this instrument.
+
+        :param timeout: maximum time to wait after the expected end; None (DEFAULT) waits as long as needed
+        :type timeout: pint quantity
+        :param flag: Winspec parameter to poll: 'RUNNING_EXPERIMENT' (DEFAULT, includes saving) or 'RUNNING'
+        :type flag: str
+        :return: True if Winspec finished, False if it was stopped or timed out
+        :rtype: bool
+        """
+        start = self._acquisition_start if self._acquisition_start is not None else time.time()
+        expected_end = start + self._expected_duration
+        wait = expected_end - self.poll_margin.m_as('s') - time.time()
+        if wait > 0 and self._stop_event.wait(wait):
+            self.logger.info('Stopped waiting for Winspec')
+            return False
+        deadline = None if timeout is None else expected_end + timeout.m_as('s')
+        poll = self.poll_min.m_as('s')
+        poll_max = self.poll_max.m_as('s')
+        polls = 0
+        while self.controller.exp_get(flag)[0]:
+            polls += 1
+            if deadline is not None and time.time() > deadline:
+                self.logger.warning('Winspec did not finish within {} after the expected end'.format(timeout))
+                return False
+            if self._stop_event.wait(poll):
+                self.logger.info('Stopped waiting for Winspec')
+                return False
+            poll = min(2 * poll, poll_max)
+        self.overhead_after_exposure = (time.time() - expected_end) * ur('s')
+        self.logger.debug('Winspec finished after {} polls, overhead after exposure: {}'.format(polls, self.overhead_after_exposure))
+        return True
+
+    def stop_acquiring(self):
+        """ Stops the running acquisition in Winspec and interrupts wait_till_finished(). """
+        self._stop_event.set()
+        self.controller.exp.Stop()
+
     @property
     def is_acquiring(self):
         """ Read only property that indicates if WinSpec is still busy acquiring. Returns True or False."""
         return self.controller.exp_get('RUNNING')[0]==1
 
     def nm_axis(self):
-        """ Returns list with nm axis values of last collected spectrum."""
-        # Retrieve nm axis in cumbersome way. (There must be a better/faster way,  but haven't found it yet)
-        wav = []
-        cal = self.doc.GetCalibration()
-        for index in range(len(self.frame)):
-            wav.append(cal.Lambda(index+1))
-        return wav
+        """
+        | Returns array with nm axis values of last collected spectrum (a list if self.return_list is True).
+        | The axis is calculated once and cached; the cache is cleared when the grating, central_nm or ROI change.
+        """
+        if self._nm_axis is None or len(self._nm_axis) != len(self.frame):
+            self._nm_axis = self._calculate_nm_axis(len(self.frame))
+        if self.return_list:
+            return self._nm_axis.tolist()
+        return self._nm_axis
 
-    def collect_spectrum_alt(self):
+    def _calculate_nm_axis(self, points):
+        """
+        | Low level function that evaluates the calibration polynomial of Winspec for all points at once.
+        | The coefficients are read once; the result is checked against cal.Lambda() at the first and last point.
+        | If that fails, it falls back to asking cal.Lambda() for every point (the slow way it used to be done).
+
+        :param points: number of points of the spectrum
+        :type points: int
+        :return: nm axis
+        :rtype: numpy array
+        """
+        cal = self.doc.GetCalibration()
+        pixels = np.arange(1, points + 1)
+        try:
+            coefficients = [cal.PolyCoeffs(k) for k in range(cal.Order + 1)]
+            axis = np.polynomial.polynomial.polyval(pixels, coefficients)
+            if not np.allclose(axis[[0, -1]], [cal.Lambda(1), cal.Lambda(points)], rtol=0, atol=1e-3):
+                raise ValueError('calibration polynomial does not match Lambda')
+        except Exception as e:
+            self.logger.debug('Could not use the calibration polynomial ({}), asking Lambda for every point'.format(e))
+            axis = np.array([cal.Lambda(int(index)) for index in pixels], dtype=float)
+        self.logger.debug('Calculated nm axis {} - {} nm'.format(axis[0], axis[-1]))
+        return axis
+
+    def _frame_to_array(self, frame, as_list=None, copy=False):
+        """
+        | Low level function that copies a frame from GetFrame (tuple of tuples) into a numpy array in one go.
+        | The array has the dtype of the Winspec data type (float32 for FLOAT, int32 for LONG) and is reused for every
+        | frame of the same shape, so no memory is allocated in a loop. Note that this means the next frame overwrites it.
+
+        :param frame: frame as returned by doc.GetFrame()
+        :type frame: tuple of tuples
+        :param as_list: return a list (1D) or nested list (2D) instead; None uses self.return_list
+        :type as_list: bool
+        :param copy: return a copy instead of the reused buffer
+        :type copy: bool
+        :return: 1D array (spectrum) or 2D array with shape (x, y) (image)
+        :rtype: numpy array or list
+        """
+        dtype = self.frame_dtypes.get(self._data_type, np.float32)
+        shape = (len(frame), len(frame[0]))
+        if self._frame_buffer is None or self._frame_buffer.shape != shape or self._frame_buffer.dtype != dtype:
+            self._frame_buffer = np.empty(shape, dtype=dtype)
+        self._frame_buffer[...] = frame
+        self.frame = self._frame_buffer[:, 0] if shape[1] == 1 else self._frame_buffer
+        if self.correction and not self._taking_reference:
+            self.frame = self.correct(self.frame)
+
+        if as_list is None:
+            as_list = self.return_list
+        if as_list:
+            return self.frame.tolist()
+        return self.frame.copy() if copy else self.frame
+
+    def collect_spectrum_alt(self, as_list=None, copy=True):
         thread = threading.Thread(self.waitforacquiring())
         thread.start()
         thread.join()
-        self.frame = self.doc.GetFrame(1,self.controller._variant_array)
-        # return frame                      # direct tuple of tuples
-        # return np.asarray(frame)          # np approach
-        if len(self.frame[0])==1:
-            return [col[0] for col in self.frame]  # convert to 1D list
-        else:
-            return [list(col) for col in self.frame]  # convert to nested list
+        return self._frame_to_array(self.doc.GetFrame(1,self.controller._variant_array), as_list, copy)
 
     def start_focus(self):
 
@@ -239,7 +373,7 @@ class WinspecInstr(BaseInstrument):
 
 
 
-    def collect_spectrum(self, wait = True, sleeptime = True):
+    def collect_spectrum(self, wait = True, sleeptime = True, as_list = None, copy = True):
         """
         | Retrieves the last acquired spectrum from Winspec.
         | There are a few possibilities:
@@ -258,30 +392,30 @@ class WinspecInstr(BaseInstrument):
         :param sleeptime: Sleeptime adds some sleeps to make sure Winspec has enough time to Autosave ascii images
         :type sleeptime: bool
 
-        :return: list or nested list
+        :param as_list: If True it returns a list or nested list (the old behaviour). None (DEFAULT) uses self.return_list
+        :type as_list: bool
+
+        :param copy: If True (DEFAULT) it returns a new array. False returns the reused frame buffer without copying,
+                     which the next frame overwrites (for loops that use every frame before taking the next one)
+        :type copy: bool
+
+        :return: 1D array (spectrum) or 2D array (image), with dtype float32 (FLOAT) or int32 (LONG); or list or nested list
         """
 
         self.logger.debug('saving ascii? {}'.format(self.config_settings['ascii_file']))
         self.logger.debug('autosaving? {}'.format(self.autosave))
 
-        self.logger.debug("waiting for Winspec to finish")
-        while self.controller.exp_get('RUNNING_EXPERIMENT')[0]:
-            time.sleep(0.001)
-        self.logger.debug("Winspec finished acquiring and saving")
+        if wait:
+            self.logger.debug("waiting for Winspec to finish")
+            self.wait_till_finished()
+            self.logger.debug("Winspec finished acquiring and saving")
 
-        self.frame = self.doc.GetFrame(1,self.controller._variant_array)
-        # return frame                      # direct tuple of tuples
-        # return np.asarray(frame)          # np approach
-        if len(self.frame[0])==1:
-            return [col[0] for col in self.frame] # convert to 1D list
-        else:
-            return [list(col) for col in self.frame] # convert to nested list
+        return self._frame_to_array(self.doc.GetFrame(1,self.controller._variant_array), as_list, copy)
 
     def waitforacquiring(self):
-        while self.is_acquiring == True:
-            time.sleep(0.1)
+        self.wait_till_finished(flag='RUNNING')
 
-    def take_spectrum(self, name=None, sleeptime=True):
+    def take_spectrum(self, name=None, sleeptime=True, as_list=None, copy=True):
         """
         Acquire spectrum, wait for data and collect it.
         Performs start_acquiring(name), followed by collect_spectrum(True).
@@ -289,7 +423,196 @@ class WinspecInstr(BaseInstrument):
         """
 
         self.start_acquiring(name)
-        return self.collect_spectrum(sleeptime)
+        return self.collect_spectrum(True, sleeptime, as_list, copy)
+
+    def take_series(self, n_frames, name=None, out=None, datman=None, store_name='frames', dims=('frame', 'y', 'x'),
+                    callback=None):
+        """
+        | Acquires n_frames frames (spectra or images) in one run of Winspec (Number of Images/Spectra = n_frames), so
+        | the camera runs back-to-back without setting up every frame from python.
+        | Every frame is collected with GetFrame(k) as soon as it is expected to be complete (exposure time x accumulations
+        | after the previous one; a frame that is still all zeros is asked again) and copied into out[k], with shape (y, x).
+        | If a DataManager is given, every frame is also written into the variable store_name with dimensions dims,
+        | which are created (with fixed lengths) before the first frame. stop_acquiring() stops the series.
+        | Afterwards, also after an exception, the acquisition is stopped and the number of frames in Winspec is set back to what it was.
+
+        :param n_frames: number of frames
+        :type n_frames: int
+        :param name: Full path to file to store. Or None, for using default (see start_acquiring)
+        :type name: string
+        :param out: array of shape (n_frames, y, x) to write into; created if None (y is 1 for spectra)
+        :type out: numpy array
+        :param datman: DataManager with an open file to stream the frames to (optional)
+        :type datman: DataManager
+        :param store_name: name of the variable in the DataManager (DEFAULT 'frames')
+        :type store_name: str
+        :param dims: names of the frame, y and x dimensions in the DataManager
+        :type dims: tuple of str
+        :param callback: function called as callback(k, frame) for every frame
+        :type callback: callable
+        :return: array of shape (frames, y, x) with the frames that were acquired
+        :rtype: numpy array
+        """
+        self._take_missing_dark()      # before changing SEQUENTS, so the dark is not a series of n_frames itself
+        previous_frames = self.controller.exp_get('SEQUENTS')[0]
+        self.controller.exp_set('SEQUENTS', n_frames)
+        k = 0
+        try:
+            self.start_acquiring(name)
+            frame_time = self._expected_duration
+            self._expected_duration *= n_frames
+            t_start = self._acquisition_start
+            poll_min = self.poll_min.m_as('s')
+            poll = poll_min
+            while k < n_frames:
+                running = self.controller.exp_get('RUNNING_EXPERIMENT')[0]
+                due = t_start + (k + 1) * frame_time - time.time()
+                if running and due > 0:
+                    if self._stop_event.wait(due):
+                        break
+                    continue
+                frame = self._frame_to_array(self.doc.GetFrame(k + 1, self.controller._variant_array), as_list=False)
+                # check the raw frame buffer: correct() writes into another array, so an incomplete (all zero) frame
+                # is still all zeros here, even if the returned frame is corrected
+                if running and not self._frame_buffer.any():
+                    if self._stop_event.wait(poll):
+                        break
+                    poll = min(2 * poll, self.poll_max.m_as('s'))
+                    continue
+                poll = poll_min
+                frame = frame.T if frame.ndim == 2 else frame[np.newaxis, :]     # (y, x)
+                if out is None:
+                    out = np.zeros((n_frames,) + frame.shape, dtype=frame.dtype)
+                    if datman is not None:
+                        for dim, length in zip(dims, out.shape):
+                            datman.dim(dim, length)
+                out[k] = frame
+                if datman is not None:
+                    datman.var(store_name, out[k], indices=[k], dims=(dims[0],), extra_dims=dims[1:])
+                if callback is not None:
+                    callback(k, out[k])
+                k += 1
+
+            if k < n_frames:
+                self.logger.info('Stopped the series after {} of {} frames'.format(k, n_frames))
+            else:
+                self.wait_till_finished()
+        finally:
+            try:
+                if k < n_frames:
+                    # stopped or an exception: Winspec should not keep acquiring the rest of the series
+                    self.controller.exp.Stop()
+            finally:
+                self.controller.exp_set('SEQUENTS', previous_frames)
+        return out[:k] if out is not None else np.zeros((0,))
+
+    # Dark and flat field correction:   ------------------------------------------------------------------------------
+
+    def _correction_key(self, exposure=True):
+        """
+        Low level function that returns the settings a dark (or a flat if exposure is False) belongs to:
+        (exposure time in s, accumulations, ROI mode, ROI and binning). The ROI is only asked to Winspec after it changed.
+        """
+        if self._roi_key is None:
+            self.getROI()
+        roi = (self.controller.exp_get('USEROI')[0],) + self._roi_key
+        if exposure:
+            return (round(self._exposure_time.m_as('s'), 9), self._accums) + roi
+        return roi
+
+    def _take_reference(self, shutter=None):
+        """ Low level function that takes the average of dark_frames frames, without correction, as float32 array.
+        Every frame is a single acquisition (SEQUENTS 1), whatever the number of frames in Winspec was."""
+        previous = self.shutter_control if shutter is not None else None
+        previous_frames = self.controller.exp_get('SEQUENTS')[0]
+        self._taking_reference = True
+        try:
+            if previous_frames != 1:
+                self.controller.exp_set('SEQUENTS', 1)
+            if shutter is not None:
+                self.shutter_control = shutter
+            reference = None
+            for k in range(self.dark_frames):
+                frame = self.take_spectrum(as_list=False, copy=False)     # it is added up before the next frame
+                if reference is None:
+                    reference = frame.astype(np.float32)
+                else:
+                    reference += frame
+            reference /= self.dark_frames
+        finally:
+            if shutter is not None:
+                self.shutter_control = previous
+            if previous_frames != 1:
+                self.controller.exp_set('SEQUENTS', previous_frames)
+            self._taking_reference = False
+        return reference
+
+    def take_dark(self, shutter='Closed'):
+        """
+        Takes a dark frame (average of dark_frames frames with the shutter closed) for the current exposure time,
+        accumulations and ROI, and keeps it in memory to subtract it from every frame while self.correction is True.
+
+        :param shutter: shutter control to use for the dark (DEFAULT 'Closed'); None leaves the shutter as it is
+        :type shutter: str
+        :return: the dark frame
+        :rtype: numpy array (float32)
+        """
+        dark = self._take_reference(shutter)
+        self._darks[self._correction_key()] = dark
+        self.logger.debug('Stored dark for {}, mean {:.1f} counts'.format(self._correction_key(), dark.mean()))
+        return dark
+
+    def take_flat(self):
+        """
+        Takes a flat field frame (average of dark_frames frames of a uniform light source), subtracts the dark and
+        normalizes it to a mean of 1. It is kept in memory per ROI; every frame is divided by it while self.correction is True.
+
+        :return: the normalized flat field
+        :rtype: numpy array (float32)
+        """
+        flat = self._take_reference()
+        dark = self._darks.get(self._correction_key())
+        if dark is not None and dark.shape == flat.shape:
+            flat -= dark
+        flat /= flat.mean()
+        with np.errstate(divide='ignore'):
+            self._flats[self._correction_key(False)] = np.where(flat > 0, 1 / flat, 0).astype(np.float32)
+        self.logger.debug('Stored flat field for {}'.format(self._correction_key(False)))
+        return flat
+
+    def clear_corrections(self):
+        """ Forgets all darks and flats."""
+        self._darks = {}
+        self._flats = {}
+
+    def correct(self, frame):
+        """
+        | Subtracts the dark and divides by the flat field for the current settings, with vectorized operations.
+        | The result is written into a reused float32 array, so the frame itself (e.g. the raw frame buffer) is not changed.
+        | Missing darks or flats (or ones with another shape) are skipped.
+
+        :param frame: frame from Winspec (1D or 2D)
+        :type frame: numpy array
+        :return: corrected frame
+        :rtype: numpy array (float32)
+        """
+        dark = self._darks.get(self._correction_key())
+        inverse_flat = self._flats.get(self._correction_key(False))
+        if self._corrected is None or self._corrected.shape != frame.shape:
+            self._corrected = np.empty(frame.shape, dtype=np.float32)
+        out = self._corrected
+        out[...] = frame
+        if dark is not None:
+            if dark.shape == frame.shape:
+                np.subtract(out, dark, out=out)
+            else:
+                self.logger.warning('Dark has shape {}, frame {}: not subtracted'.format(dark.shape, frame.shape))
+        if inverse_flat is not None:
+            if inverse_flat.shape == frame.shape:
+                np.multiply(out, inverse_flat, out=out)
+            else:
+                self.logger.warning('Flat has shape {}, frame {}: not applied'.format(inverse_flat.shape, frame.shape))
+        return out
 
     def take_spectrum_alt(self, name=None, sleeptime=True):
         """
@@ -349,6 +672,8 @@ class WinspecInstr(BaseInstrument):
                 self.controller.spt_set('NEW_GRATING', number)
                 self.logger.info('changing grating from {} to {} ...'.format(current, number))
                 self.controller.spt.Move()
+                self.controller.invalidate('SPT')          # the grating position changed
+                self._nm_axis = None
                 self.logger.info('finished changing grating')
         else:
             self.logger.warning('{} is invalid grating number (1-{})'.format(number, self.number_of_gratings))
@@ -374,6 +699,8 @@ class WinspecInstr(BaseInstrument):
             self.controller.spt_set('NEW_POSITION', nanometers)
             self.logger.info('moving grating from {} to {} ...'.format(current, nanometers))
             self.controller.spt.Move()
+            self.controller.invalidate('SPT')          # the grating position changed
+            self._nm_axis = None
             self.logger.info('finished moving grating')
             # self.move_grating_thread.start()
 
@@ -517,7 +844,7 @@ class WinspecInstr(BaseInstrument):
 
         :type: str
         """
-        number = ws.controller.exp_get('USEROI')[0]
+        number = self.controller.exp_get('USEROI')[0]
         return self._ccd[number]
 
     @ccd.setter
@@ -525,6 +852,8 @@ class WinspecInstr(BaseInstrument):
         number = self._setter_string_to_number(string, self._ccd)
         if number>=0:
             self.controller.exp_set('USEROI', number)
+            self._nm_axis = None
+            self._roi_key = None
 
     @property
     def spec_mode(self):
@@ -533,11 +862,11 @@ class WinspecInstr(BaseInstrument):
 
         :type: bool
         """
-        return ws.controller.exp_get('ROIMODE')[0]==1
+        return self.controller.exp_get('ROIMODE')[0]==1
 
     @spec_mode.setter
     def spec_mode(self, value):
-        ws.controller.exp_set('ROIMODE', value!=0)
+        self.controller.exp_set('ROIMODE', value!=0)
 
     def getROI(self):
         """
@@ -547,6 +876,7 @@ class WinspecInstr(BaseInstrument):
         # return top, bottom, v_group, left, right, h_group
         self._roi = self.controller.exp.GetROI(1)
         r = self._roi.Get()    # returns tuple: (top, left, bottom, right, h_group, v_group)
+        self._roi_key = tuple(r)
         return [r[0], r[2], r[5], r[1], r[3], r[4]]
 
     def setROI(self, top='full_im', bottom=None, v_binsize=None, left=1, right=None, h_binsize=1):
@@ -594,7 +924,7 @@ class WinspecInstr(BaseInstrument):
             if top =='full_spec':
                 top = 1
                 bottom = self.controller.ydim
-                v_binsize = 1024
+                v_binsize = self.controller.ydim
 
 
         # if v_group is not specified assume summing vertically from top to bottom:
@@ -649,7 +979,7 @@ class WinspecInstr(BaseInstrument):
                 new_h -= 1
 
         if new_h != h_binsize:
-            self.logger.warning('h_group {} does not fit in horizontal range of [{}-{}]: changing to: {}'.format(h_binsize, left, right, h_new))
+            self.logger.warning('h_group {} does not fit in horizontal range of [{}-{}]: changing to: {}'.format(h_binsize, left, right, new_h))
             h_binsize = new_h
 
         new_v = v_binsize
@@ -660,7 +990,7 @@ class WinspecInstr(BaseInstrument):
                 new_v -= 1
 
         if new_v != v_binsize:
-            self.logger.warning('v_group {} does not fit in vertical range of [{}-{}]: changing to: {}'.format(v_binsize, top, bottom, v_new))
+            self.logger.warning('v_group {} does not fit in vertical range of [{}-{}]: changing to: {}'.format(v_binsize, top, bottom, new_v))
             v_binsize = new_v
 
         # set the new ROI:
@@ -668,6 +998,9 @@ class WinspecInstr(BaseInstrument):
         self._roi.Set(top, left, bottom, right, h_binsize, v_binsize)       # put in the new values
         self.controller.exp.ClearROIs()                                 # clear ROIs in WinsSpec
         self.controller.exp.SetROI(self._roi)                           # set the ROI object in WinSpec
+        self.controller.invalidate('EXP')                               # the dimensions of the data changed
+        self._roi_key = None
+        self._nm_axis = None
         self.ccd = 'ROI'                                                # switch from Full Chip to Region Of Interest mode
 
         # I'm not sure if I need to do something with ROIMODE (0= Imaging Mode,   1= Spectroscopy Mode)
@@ -816,9 +1149,16 @@ class WinspecInstr(BaseInstrument):
     # Experiment / Data File settings: ----------------------------------
     @property
     def data_type(self):
+        """
+        attribute: Data type of the frames, 'FLOAT' or 'LONG' (the name of the X\_ parameter in Winspec).
+        The last value is remembered to pick the dtype of the frames without asking Winspec every frame.
+
+        :type: str
+        """
         code = self.controller.exp_get('DATATYPE')[0]
         # self.logger.debug('datatype code: {}'.format(code))
-        return [name for name, value in self.controller.params_x.items() if value==code][0]
+        self._data_type = [name for name, value in self.controller.params_x.items() if value==code][0]
+        return self._data_type
 
     @data_type.setter
     def data_type(self,type_name):
@@ -826,6 +1166,7 @@ class WinspecInstr(BaseInstrument):
         if type_name in self.controller.params_x:
             try:
                 self.controller.exp_set('DATATYPE', self.controller.params_x[type_name])
+                self._data_type = type_name
             except:
                 self.logger.warning('Something went wrong trying to set datatype: {}. Check Winspec for allowed values'.format(type_name))
         else:
@@ -10,6 +10,7 @@ Here we group some array tools that we use in the project.
 """
 from hyperion import logging
 import numpy as np
+import threading
 from hyperion import Q_
 
 def array_from_pint_quantities(start, stop, step=None, num=None):
@@ -98,3 +99,305 @@ def array_from_settings_dict(sweep_dict):
         return array_from_string_quantities(sweep_dict['start'], sweep_dict['stop'], num=sweep_dict['num'])
     else:
         return array_from_string_quantities(sweep_dict['start'], sweep_dict['stop'])
+
+
+def _parabolic_peak(y, i):
+    """ Sub-bin position of the maximum at index i of y, from a parabola through i and its two (circular) neighbours."""
+    a, b, c = y[i - 1], y[i], y[(i + 1) % len(y)]
+    denominator = a - 2 * b + c
+    if denominator >= 0:        # not a maximum (flat or noisy), keep the bin itself
+        return float(i)
+    return i + 0.5 * (a - c) / denominator
+
+def peak_position(y):
+    """
+    Position of the maximum of y, with sub-bin precision (parabolic interpolation around the highest bin).
+
+    :param y: 1D array
+    :type y: numpy.array
+    :return: position in (fractional) bins
+    :rtype: float
+    """
+    y = np.asarray(y, dtype=float)
+    return _parabolic_peak(y, int(np.argmax(y)))
+
+def correlation_delay(signal, reference):
+    """
+    Delay of signal with respect to reference, from the maximum of their cross-correlation.
+    The cross-correlation is computed with FFTs, zero padded so it is not circular, after subtracting the medians
+    (background). The maximum is interpolated with a parabola, so the delay has sub-bin precision.
+
+    :param signal: 1D array
+    :type signal: numpy.array
+    :param reference: 1D array with the same binning (the length may differ)
+    :type reference: numpy.array
+    :return: delay in (fractional) bins; positive if signal comes later than reference
+    :rtype: float
+    """
+    signal = np.asarray(signal, dtype=float)
+    reference = np.asarray(reference, dtype=float)
+    n = len(signal) + len(reference)
+    S = np.fft.rfft(signal - np.median(signal), n)
+    R = np.fft.rfft(reference - np.median(reference), n)
+    correlation = np.fft.irfft(S * np.conj(R), n)
+    delay = _parabolic_peak(correlation, int(np.argmax(correlation)))
+    return delay - n if delay > n / 2 else delay
+
+
+def rising_edge_delay(signal, reference, smooth=1):
+    """
+    Delay of the rising edge of signal with respect to the rising edge of reference.
+    Both are smoothed with a moving average of smooth bins and only their rising parts (the positive derivative)
+    are cross-correlated with correlation_delay. Unlike the cross-correlation of the whole signals, this does not
+    depend on what comes after the edge, so e.g. decays with different lifetimes are aligned on their start.
+    Choose smooth close to the width of the edge (in bins) to suppress the noise.
+
+    :param signal: 1D array
+    :type signal: numpy.array
+    :param reference: 1D array with the same binning (the length may differ)
+    :type reference: numpy.array
+    :param smooth: width of the moving average in bins
+    :type smooth: int
+    :return: delay in (fractional) bins; positive if signal comes later than reference
+    :rtype: float
+    """
+    def rising(y):
+        y = np.asarray(y, dtype=float)
+        if smooth > 1:
+            y = np.convolve(y, np.ones(smooth) / smooth, mode='same')
+        return np.clip(np.diff(y), 0, None)
+    return correlation_delay(rising(signal), rising(reference))
+
+
+def ieee_block_to_array(raw, dtype, offset=0, termination=None):
+    """
+    Decodes an IEEE-488.2 definite length binary block (#<n><length><data>, as sent by e.g. CURV? of
+    oscilloscopes) into a numpy array, without copying the data.
+    An indefinite length block (#0<data>) runs until the end of raw; if termination is given and raw ends with it,
+    that one termination is removed. Nothing else is stripped, because the last data bytes can have any value.
+
+    :param raw: the reply of the instrument (may contain a termination character after the block)
+    :type raw: bytes
+    :param dtype: data type of the values, e.g. '>i2' for signed 16 bit big-endian
+    :type dtype: str or numpy.dtype
+    :param offset: position of the # in raw
+    :type offset: int
+    :param termination: read termination after an indefinite length block, e.g. '\\n' (the read_termination of the resource)
+    :type termination: str or bytes or None
+    :return: the values
+    :rtype: numpy.ndarray
+    """
+    start = raw.index(b'#', offset)
+    digits = int(raw[start + 1:start + 2])
+    if digits == 0:
+        # indefinite length block: until the end, minus one termination
+        end = len(raw)
+        if termination:
+            if isinstance(termination, str):
+                termination = termination.encode('ascii')
+            if raw.endswith(termination) and end - len(termination) >= start + 2:
+                end -= len(termination)
+        data = memoryview(raw)[start + 2:end]
+    else:
+        length = int(raw[start + 2:start + 2 + digits])
+        begin = start + 2 + digits
+        if len(raw) < begin + length:
+            raise ValueError('Binary block is incomplete: {} of {} bytes'.format(len(raw) - begin, length))
+        data = memoryview(raw)[begin:begin + length]
+    dtype = np.dtype(dtype)
+    return np.frombuffer(data, dtype=dtype, count=len(data) // dtype.itemsize)
+
+
+def array_to_ieee_block(array):
+    """
+    Encodes a numpy array as IEEE-488.2 definite length binary block (#<n><length><data>), e.g. to send a
+    waveform to an instrument. The values are sent as they are in memory, so the dtype of the array sets
+    the data type and byte order.
+
+    :param array: the values
+    :type array: numpy.ndarray
+    :return: the binary block
+    :rtype: bytes
+    """
+    data = np.ascontiguousarray(array).tobytes()
+    length = str(len(data))
+    return '#{}{}'.format(len(length), length).encode('ascii') + data
+
+
+class RingBuffer:
+    """
+    Fixed size buffer that keeps the last `length` rows of `columns` values.
+    Every row is written twice (at index i and i+length) in an array of double length, so the last `length` rows are
+    always available as one contiguous slice. Adding a row and getting the view both cost O(1), independent of length.
+    Adding and reading is protected by a lock, so one thread can fill it while another one reads it.
+
+    :param length: number of rows to keep
+    :type length: int
+    :param columns: number of values per row (defaults to 1)
+    :type columns: int
+    :param dtype: data type of the values (defaults to float)
+    :type dtype: numpy dtype
+
+    :Example:
+
+    buf = RingBuffer(100, 3)
+    buf.append([time.time(), 1.0, 2.0])
+    last_rows = buf.view()      # shape (1, 3), oldest row first
+    """
+    def __init__(self, length, columns=1, dtype=float):
+        self.length = int(length)
+        self.columns = int(columns)
+        self._data = np.zeros((2 * self.length, self.columns), dtype=dtype)
+        self._index = 0         # position where the next row is written
+        self._count = 0         # total number of rows appended
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return min(self._count, self.length)
+
+    @property
+    def count(self):
+        """ Total number of rows appended since creation or the last clear()."""
+        return self._count
+
+    def append(self, row):
+        """
+        Adds one row, overwriting the oldest row if the buffer is full.
+
+        :param row: values to add
+        :type row: sequence or numpy array of length columns
+        """
+        with self._lock:
+            self._data[self._index] = row
+            self._data[self._index + self.length] = row
+            self._index = (self._index + 1) % self.length
+            self._count += 1
+
+    def view(self, copy=False):
+        """
+        The stored rows, oldest first, as a view on the internal array (no copy).
+        Note that the view is overwritten by later calls to append(); use copy=True to keep the values.
+
+        :param copy: return a copy instead of a view (defaults to False)
+        :type copy: bool
+        :return: array of shape (len(self), columns)
+        :rtype: numpy.array
+        """
+        with self._lock:
+            n = min(self._count, self.length)
+            start = self._index + self.length - n
+            out = self._data[start:start + n]
+            return out.copy() if copy else out
+
+    def last(self):
+        """ The most recently added row, or None if the buffer is empty."""
+        with self._lock:
+            if self._count == 0:
+                return None
+            return self._data[self._index + self.length - 1].copy()
+
+    def clear(self):
+        """ Removes all rows."""
+        with self._lock:
+            self._index = 0
+            self._count = 0
+
+
+class DecimationPyramid:
+    """
+    Min, max and sum of a (long) 1D array at decreasing resolutions, to plot it with only as many points as there are
+    pixels. Level k holds bins of 2**k original elements; every level is computed from the one below it, so updating
+    with a new array costs about 2x the array length and no memory is allocated if the length doesn't change.
+    Use segment() to get the points of a visible range at the right level.
+
+    :param data: array to start with (optional)
+    :type data: numpy.array
+    :param min_length: the coarsest level has at most this many bins (defaults to 64)
+    :type min_length: int
+
+    :Example:
+
+    pyramid = DecimationPyramid(histogram)
+    x, y = pyramid.segment(0, len(histogram), 1000)   # at most 2x1000 points (min and max) for the whole range
+    """
+    def __init__(self, data=None, min_length=64):
+        self.min_length = int(min_length)
+        self.levels = []        # per level a tuple (mins, maxs, sums)
+        if data is not None:
+            self.update(data)
+
+    def __len__(self):
+        return len(self.levels[0][0]) if self.levels else 0
+
+    def _allocate(self, length, dtype):
+        self.levels = [(np.zeros(length, dtype),) * 3]
+        while length > self.min_length:
+            length = (length + 1) // 2
+            self.levels.append((np.zeros(length, dtype), np.zeros(length, dtype), np.zeros(length, dtype)))
+
+    def update(self, data):
+        """
+        Recomputes all levels for new data.
+
+        :param data: 1D array
+        :type data: numpy.array
+        """
+        data = np.asarray(data)
+        dtype = np.float64 if data.dtype.kind == 'f' else np.int64
+        if not self.levels or len(self) != len(data) or self.levels[0][0].dtype != dtype:
+            self._allocate(len(data), dtype)
+        self.levels[0][0][:] = data
+        for k in range(1, len(self.levels)):
+            prev_min, prev_max, prev_sum = self.levels[k - 1]
+            mins, maxs, sums = self.levels[k]
+            pairs = np.arange(0, len(prev_min), 2)
+            np.minimum.reduceat(prev_min, pairs, out=mins)
+            np.maximum.reduceat(prev_max, pairs, out=maxs)
+            np.add.reduceat(prev_sum, pairs, out=sums)
+
+    def level_for(self, start, stop, max_points):
+        """
+        The finest level that shows the range start ... stop with at most max_points bins.
+
+        :return: level index k (bins of 2**k elements)
+        :rtype: int
+        """
+        span = max(stop - start, 1)
+        k = int(np.ceil(np.log2(max(span / max(max_points, 1), 1))))
+        return min(k, len(self.levels) - 1)
+
+    def segment(self, start, stop, max_points, mode='minmax'):
+        """
+        Points to plot the range start ... stop (in original indices) with about max_points bins.
+
+        :param start: first index of the visible range
+        :type start: float
+        :param stop: last index of the visible range
+        :type stop: float
+        :param max_points: number of bins to show, typically the width in pixels
+        :type max_points: int
+        :param mode: 'minmax' gives two points (min and max) per bin so peaks are never lost; 'sum' or 'mean' one point per bin
+        :type mode: str
+        :return: x (in original indices, bin centers) and y
+        :rtype: (numpy.array, numpy.array)
+        """
+        if not self.levels:
+            return np.zeros(0), np.zeros(0)
+        k = self.level_for(start, stop, max_points)
+        mins, maxs, sums = self.levels[k]
+        size = 2**k
+        i0 = int(np.clip(np.floor(start / size), 0, len(mins)))
+        i1 = int(np.clip(np.ceil(stop / size) + 1, i0, len(mins)))
+        x = (np.arange(i0, i1) + 0.5) * size - 0.5
+        if mode == 'minmax':
+            y = np.empty(2 * (i1 - i0), dtype=mins.dtype)
+            y[0::2] = mins[i0:i1]
+            y[1::2] = maxs[i0:i1]
+            return np.repeat(x, 2), y
+        elif mode == 'sum':
+            return x, sums[i0:i1]
+        elif mode == 'mean':
+            counts = np.minimum(size, len(self) - np.arange(i0, i1) * size)
+            return x, sums[i0:i1] / counts
+        else:
+            raise ValueError('Unknown mode: {}'.format(mode))
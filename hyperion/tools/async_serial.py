@@ -0,0 +1,312 @@
+"""
+============
+Async Serial
+============
+
+Asyncio transport for serial instruments, so that many devices can be queried concurrently from one event loop.
+
+AsyncSerial wraps a pyserial port. Commands are written immediately (pipelining: a new command does not wait
+for the reply to the previous one) and the replies are matched to the commands in the order they were sent.
+Every request has its own timeout. Reading is done by one thread per port that waits in a blocking read,
+so it works for every port pyserial supports (COM ports, ptys, 'loop://', ...) and does not poll.
+
+For existing, blocking code there is a sync facade: SerialLoop runs an event loop in a background thread and
+SyncSerial gives the usual write/query methods, plus SerialLoop.gather to run queries on several ports at once.
+
+:Example:
+
+    loop = SerialLoop()
+    lcc = loop.open('COM8', baudrate=115200, terminator=b'> ', write_termination=b'\\r')
+    aotf = loop.open('COM10', baudrate=57600, terminator=b'\\n', write_termination=b'\\r')
+    print(lcc.query('volt1?'))
+    v1, state = loop.gather(lcc.aquery('volt1?'), aotf.aquery('S', frames=9))
+    loop.close()
+
+:copyright: by Hyperion Authors, see AUTHORS for more details.
+:license: BSD, see LICENSE for more details.
+"""
+import asyncio
+import collections
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import serial
+from hyperion import logging
+
+
+class _Request:
+    """ A command waiting for its reply."""
+    __slots__ = ('future', 'frames', 'terminator', 'replies', 'timed_out')
+
+    def __init__(self, future, frames, terminator):
+        self.future = future
+        self.frames = frames
+        self.terminator = terminator
+        self.replies = []
+        self.timed_out = False
+
+
+class AsyncSerial:
+    """
+    Asyncio serial port with pipelined queries.
+
+    A request that times out still takes its reply if that arrives within late_reply seconds after the timeout
+    (and drops it), so the replies of the requests after it stay matched to the right command. After that it is
+    removed, for commands that never get a reply.
+
+    :param rsc: an open pyserial port (e.g. serial.Serial or serial.serial_for_url(...))
+    :type rsc: serial.Serial
+    :param terminator: end of every reply frame
+    :type terminator: bytes
+    :param write_termination: added to every command
+    :type write_termination: bytes
+    :param encoding: encoding of commands and replies
+    :type encoding: str
+    :param timeout: default timeout of a request, in seconds
+    :type timeout: float
+    :param late_reply: time in seconds after a timeout during which a late reply is still expected
+    :type late_reply: float
+    """
+    def __init__(self, rsc, terminator=b'\n', write_termination=b'\n', encoding='ascii', timeout=1.0, late_reply=0.2):
+        self.logger = logging.getLogger(__name__)
+        self.rsc = rsc
+        self.terminator = terminator
+        self.write_termination = write_termination
+        self.encoding = encoding
+        self.timeout = timeout
+        self.late_reply = late_reply
+        self.buffer = bytearray()
+        self._pending = collections.deque()
+        self._executor = None
+        self._reader_task = None
+        self._write_lock = None
+        self._closing = False
+        self.unexpected = collections.deque(maxlen=100)    # frames that arrived when no request was waiting
+
+    @classmethod
+    def from_port(cls, port, baudrate=9600, **kwargs):
+        """ Opens the port (a port name or a pyserial url) and returns an AsyncSerial for it.
+
+        :param port: e.g. 'COM8', '/dev/ttyUSB0' or 'loop://'
+        :type port: str
+        :param baudrate: baud rate
+        :type baudrate: int
+        :param kwargs: passed to AsyncSerial
+        """
+        rsc = serial.serial_for_url(port, baudrate=baudrate, timeout=0.1)
+        return cls(rsc, **kwargs)
+
+    @property
+    def is_open(self):
+        return self._reader_task is not None and not self._reader_task.done()
+
+    async def open(self):
+        """ Starts reading the port. Must be called from the event loop that will use this port."""
+        if self.is_open:
+            return
+        if self.rsc.timeout is None or self.rsc.timeout > 0.1:
+            self.rsc.timeout = 0.1      # so the reading thread notices close() within 0.1 s
+        self._closing = False
+        self._write_lock = asyncio.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='AsyncSerial')
+        self._reader_task = asyncio.get_running_loop().create_task(self._read_loop())
+
+    async def close(self):
+        """ Stops reading, fails the requests still waiting and closes the port."""
+        self._closing = True
+        if self._reader_task is not None:
+            await self._reader_task
+            self._reader_task = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        while self._pending:
+            request = self._pending.popleft()
+            if not request.future.done() and not request.timed_out:
+                request.future.set_exception(ConnectionError('Port closed'))
+        self.rsc.close()
+
+    def _read_chunk(self):
+        """ Blocking: waits for the first byte (up to the port timeout) and reads everything that is waiting."""
+        data = self.rsc.read(1)
+        if data:
+            waiting = self.rsc.in_waiting
+            if waiting:
+                data += self.rsc.read(waiting)
+        return data
+
+    async def _read_loop(self):
+        loop = asyncio.get_running_loop()
+        while not self._closing:
+            try:
+                data = await loop.run_in_executor(self._executor, self._read_chunk)
+            except (serial.SerialException, OSError) as e:
+                self.logger.error('Reading from {} failed: {}'.format(self.rsc.port, e))
+                for request in self._pending:
+                    if not request.future.done() and not request.timed_out:
+                        request.future.set_exception(e)
+                self._pending.clear()
+                return
+            if data:
+                self.buffer += data
+                self._dispatch()
+
+    def _dispatch(self):
+        """ Cuts the buffer in frames and gives them to the waiting requests, in order."""
+        while True:
+            terminator = self._pending[0].terminator if self._pending else self.terminator
+            end = self.buffer.find(terminator)
+            if end < 0:
+                return
+            end += len(terminator)
+            frame = bytes(self.buffer[:end - len(terminator)])
+            del self.buffer[:end]
+            if not self._pending:
+                self.logger.debug('Unexpected reply from {}: {}'.format(self.rsc.port, frame))
+                self.unexpected.append(frame)
+                continue
+            request = self._pending[0]
+            request.replies.append(frame)
+            if len(request.replies) >= request.frames:
+                self._pending.popleft()
+                if not request.future.done():
+                    request.future.set_result(request.replies)
+
+    def _drop(self, request):
+        """ Removes a timed out request that did not get its reply, and gives the waiting frames to the next ones."""
+        try:
+            self._pending.remove(request)
+        except ValueError:
+            return
+        self.logger.debug('Dropped timed out request on {}'.format(self.rsc.port))
+        self._dispatch()
+
+    async def write(self, message):
+        """ Sends a command that has no reply.
+
+        :param message: the command (write_termination is added)
+        :type message: str or bytes
+        """
+        if isinstance(message, str):
+            message = message.encode(self.encoding)
+        async with self._write_lock:
+            self.rsc.write(message + self.write_termination)
+
+    async def query(self, message, frames=1, terminator=None, timeout=None, decode=True):
+        """ Sends a command and waits for its reply. Several queries can wait at the same time (pipelining).
+
+        :param message: the command (write_termination is added)
+        :type message: str or bytes
+        :param frames: number of reply frames (e.g. lines) the command gives
+        :type frames: int
+        :param terminator: end of the reply frames, None uses self.terminator
+        :type terminator: bytes
+        :param timeout: timeout of this request in seconds, None uses self.timeout
+        :type timeout: float
+        :param decode: if True the frames are returned as str, otherwise as bytes
+        :type decode: bool
+        :return: the reply frames, without terminator
+        :rtype: list
+        """
+        if not self.is_open:
+            raise ConnectionError('AsyncSerial on {} is not open'.format(self.rsc.port))
+        if isinstance(message, str):
+            message = message.encode(self.encoding)
+        request = _Request(asyncio.get_running_loop().create_future(), frames,
+                           self.terminator if terminator is None else terminator)
+        async with self._write_lock:
+            self._pending.append(request)
+            self.rsc.write(message + self.write_termination)
+        self._dispatch()    # the reply may already be in the buffer
+        try:
+            replies = await asyncio.wait_for(asyncio.shield(request.future), self.timeout if timeout is None else timeout)
+        except asyncio.TimeoutError:
+            request.timed_out = True
+            asyncio.get_running_loop().call_later(self.late_reply, self._drop, request)
+            raise TimeoutError('No reply to {} from {} within {} s'.format(
+                message, self.rsc.port, self.timeout if timeout is None else timeout))
+        if decode:
+            return [str(frame, encoding=self.encoding) for frame in replies]
+        return replies
+
+    async def query_many(self, messages, **kwargs):
+        """ Sends all commands at once (pipelined) and returns the list of their replies."""
+        return await asyncio.gather(*(self.query(msg, **kwargs) for msg in messages))
+
+
+class SerialLoop:
+    """
+    Event loop in a background thread, with a sync facade to AsyncSerial ports.
+    """
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name='SerialLoop', daemon=True)
+        self._thread.start()
+        self.ports = []
+
+    def run(self, coro, timeout=None):
+        """ Runs the coroutine in the event loop and returns its result (blocking)."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+    def gather(self, *coros):
+        """ Runs the coroutines concurrently and returns the list of their results (blocking)."""
+        async def _gather():
+            return await asyncio.gather(*coros)
+        return self.run(_gather())
+
+    def open(self, port, baudrate=9600, **kwargs):
+        """ Opens a port and returns its sync facade.
+
+        :param port: port name or pyserial url, or an open pyserial port
+        :type port: str or serial.Serial
+        :param baudrate: baud rate (if port is a name)
+        :type baudrate: int
+        :param kwargs: passed to AsyncSerial
+        :rtype: SyncSerial
+        """
+        if isinstance(port, str):
+            dev = AsyncSerial.from_port(port, baudrate=baudrate, **kwargs)
+        else:
+            dev = AsyncSerial(port, **kwargs)
+        self.run(dev.open())
+        sync = SyncSerial(dev, self)
+        self.ports.append(sync)
+        return sync
+
+    def close(self):
+        """ Closes all ports and stops the event loop."""
+        for port in self.ports:
+            port.close()
+        self.ports = []
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
+
+
+class SyncSerial:
+    """
+    Blocking facade to an AsyncSerial that runs in a SerialLoop. It can be used from any thread.
+    The a* methods return coroutines for SerialLoop.gather.
+    """
+    def __init__(self, dev, serial_loop):
+        self.dev = dev
+        self.serial_loop = serial_loop
+
+    def write(self, message):
+        """ Sends a command that has no reply (see AsyncSerial.write)."""
+        self.serial_loop.run(self.dev.write(message))
+
+    def query(self, message, **kwargs):
+        """ Sends a command and returns its reply frames (see AsyncSerial.query)."""
+        return self.serial_loop.run(self.dev.query(message, **kwargs))
+
+    def query_many(self, messages, **kwargs):
+        """ Sends the commands pipelined and returns their replies (see AsyncSerial.query_many)."""
+        return self.serial_loop.run(self.dev.query_many(messages, **kwargs))
+
+    def aquery(self, message, **kwargs):
+        return self.dev.query(message, **kwargs)
+
+    def close(self):
+        if self.dev.is_open:
+            self.serial_loop.run(self.dev.close())
@@ -0,0 +1,354 @@
+"""
+================
+Lifetime fitting
+================
+
+Tools to fit mono- and bi-exponential decays to many histograms at once, like the Hydraharp histograms of every
+pixel of a lifetime (FLIM-like) scan. Instead of fitting the histograms one by one, all of them are handled as one
+(pixels, bins) array:
+
+- estimate_decays() gives starting values from the phasor (first Fourier component) of every histogram, with the
+  first moment as fall back.
+- fit_decays() refines them with a Levenberg-Marquardt fit that runs on all pixels in parallel. Pixels whose fit
+  ends at the lower limit of the lifetime are fitted again from the first moment, or else marked as not valid.
+- fit_decays_from_file() reads the histograms from a file written by the DataManager and fits them chunk by chunk.
+
+The model is a periodic decay (period = histogram length, or the sync period if given), convolved with the
+instrument response function (IRF) and shifted by the offset t0, on top of a constant background.
+It is evaluated in the Fourier domain, where the convolution, the shift and all derivatives are simple products.
+The IRF is a Gaussian of width irf_sigma, or a measured IRF; in that case t0 is the shift relative to the measured one.
+Times (tau, t0, irf_sigma, period) are in bins, unless a resolution is given for the results.
+
+:copyright: by Hyperion Authors, see AUTHORS for more details.
+:license: BSD, see LICENSE for more details.
+"""
+from hyperion import logging
+import numpy as np
+
+PARAMETERS = {'mono': ('amplitude', 'tau', 't0', 'background'),
+              'bi': ('amplitude1', 'tau1', 'amplitude2', 'tau2', 't0', 'background')}
+
+_TAU_MIN = 1e-3     # bins; keeps the lifetimes positive during the fit
+
+
+def _irf_spectrum(m, irf=None, irf_sigma=1.0):
+    """ Fourier transform (rfft, normalized to 1 at zero frequency) of the IRF on a grid of m bins."""
+    f = np.fft.rfftfreq(m)
+    if irf is None:
+        return np.exp(-2 * np.pi**2 * irf_sigma**2 * f**2)
+    irf = np.asarray(irf, dtype=float)[:m]
+    irf = np.concatenate((irf, np.zeros(m - len(irf))))
+    return np.fft.rfft(irf / irf.sum())
+
+
+def _evaluate(p, model, f, z, G, m, n, jacobian=True):
+    """
+    Model (and Jacobian) of all pixels.
+
+    :return: model of shape (pixels, n) and Jacobian of shape (pixels, parameters, n) (or None)
+    """
+    t0 = p[:, -2]
+    shift = G[None, :] * np.exp(-2j * np.pi * f[None, :] * t0[:, None])
+    X = np.zeros((len(p), len(f)), dtype=complex)
+    J = np.zeros((len(p), p.shape[1], len(f)), dtype=complex) if jacobian else None
+    for c in range(1 if model == 'mono' else 2):
+        A = p[:, 2 * c, None]
+        tau = p[:, 2 * c + 1, None]
+        q = np.exp(-1 / tau)
+        E = (1 - q) / (1 - q * z)
+        X += A * shift * E
+        if jacobian:
+            J[:, 2 * c] = shift * E
+            J[:, 2 * c + 1] = A * shift * (z - 1) / (1 - q * z)**2 * q / tau**2
+    if jacobian:
+        J[:, -2] = -2j * np.pi * f * X
+        J[:, -1, 0] = m
+    X[:, 0] += p[:, -1] * m
+    y = np.fft.irfft(X, m)[:, :n]
+    if jacobian:
+        J = np.fft.irfft(J, m)[:, :, :n]
+    return y, J
+
+
+def _rising_edge(y, smooth=3):
+    """
+    Position (in bins, interpolated) where every histogram crosses half its maximum on the rising side, searching
+    back from the maximum (periodically, so a rise that wraps around the start of the histogram is found as well).
+    For a decay convolved with a symmetric IRF, this is where the decay starts.
+
+    :param y: background corrected histograms of shape (pixels, bins)
+    :type y: numpy.array
+    :param smooth: width in bins of the moving average applied against noise before searching
+    :type smooth: int
+    :return: positions of shape (pixels,)
+    :rtype: numpy.array
+    """
+    n = y.shape[1]
+    if smooth > 1:
+        kernel = np.fft.rfft(np.roll(np.r_[np.ones(smooth), np.zeros(n - smooth)] / smooth, -(smooth // 2)))
+        y = np.fft.irfft(np.fft.rfft(y, axis=1) * kernel, n, axis=1)
+    rows = np.arange(len(y))
+    peak = np.argmax(y, axis=1)
+    half = y[rows, peak] / 2
+    back = np.arange(n // 2)
+    values = np.take_along_axis(y, (peak[:, None] - back[None, :]) % n, axis=1)
+    below = values < half[:, None]
+    first = np.argmax(below, axis=1)            # steps back from the maximum to the first bin below half
+    found = below.any(axis=1) & (first > 0)
+    first = np.where(found, first, 1)
+    above = values[rows, first - 1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fraction = np.where(found, (above - half) / (above - values[rows, first]), 0)
+    return np.where(found, peak - (first - 1) - fraction, peak).astype(float)
+
+
+def estimate_decays(histograms, model='mono', irf=None, irf_sigma=1.0, period=None, method='phasor'):
+    """
+    Fast starting values for fit_decays(), computed for all histograms at once.
+    t0 follows from the rising edge (half maximum, corrected for the IRF), the background is the mean before the
+    rising edge and the lifetime follows from the phasor (first Fourier component) corrected for the IRF and t0.
+    If that gives no valid lifetime (or if method is 'moment'), the first moment after t0 is used.
+
+    :param histograms: array of shape (pixels, bins) (or (bins,) for a single histogram)
+    :type histograms: numpy.array
+    :param model: 'mono' or 'bi'
+    :type model: str
+    :param irf: measured IRF (optional), otherwise a Gaussian of width irf_sigma is used
+    :type irf: numpy.array
+    :param irf_sigma: standard deviation of the Gaussian IRF in bins
+    :type irf_sigma: float
+    :param period: repetition period in bins, if different from the histogram length
+    :type period: float
+    :param method: 'phasor' (with the first moment as fall back) or 'moment' for the lifetime
+    :type method: str
+    :return: parameters of shape (pixels, number of parameters), in the order of PARAMETERS[model]
+    :rtype: numpy.array
+    """
+    y = np.atleast_2d(np.asarray(histograms, dtype=float))
+    n = y.shape[1]
+    m = max(int(round(period)), n) if period else n
+    t = np.arange(n)
+
+    background = np.percentile(y, 5, axis=1)
+    edge = _rising_edge(y - background[:, None])
+    # the background is the mean of the bins before the rising edge (the 5th percentile is too low for low counts)
+    before = np.floor(edge - 3 * irf_sigma - 1).astype(int)[:, None] - np.arange(max(n // 8, 4))[None, :]
+    background = np.take_along_axis(y, before % n, axis=1).mean(axis=1)
+    yc = np.clip(y - background[:, None], 0, None)
+    amplitude = yc.sum(axis=1)
+
+    # phasor: for the model, Y(f1)/Y(0) = G(f1) exp(-2 pi i f1 t0) (1-q)/(1-q z1), which can be solved for q
+    f = np.fft.rfftfreq(m)
+    z = np.exp(-2j * np.pi * f)
+    G = _irf_spectrum(m, irf, irf_sigma)
+    Y = np.fft.rfft(y - background[:, None], m, axis=1)    # not clipped: clipping the noise biases the lifetime up
+
+    def lifetime(t0):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            R = Y[:, 1] / Y[:, 0] / (G[1] * np.exp(-2j * np.pi * f[1] * t0))
+            q = np.real((1 - R) / (1 - R * z[1]))
+            tau = -1 / np.log(q)
+            # first moment after t0 as fall back
+            after = t[None, :] >= t0[:, None]
+            tau_moment = (yc * (t[None, :] - t0[:, None]) * after).sum(axis=1) / (yc * after).sum(axis=1)
+        if method == 'phasor':
+            valid = np.isfinite(tau) & (tau > _TAU_MIN) & (q > 0) & (q < 1)
+            tau = np.where(valid, tau, tau_moment)
+        elif method == 'moment':
+            tau = tau_moment
+        else:
+            raise ValueError('Unknown method: {}, use phasor or moment'.format(method))
+        return np.where(np.isfinite(tau) & (tau > _TAU_MIN), tau, 1.0)
+
+    # t0 from the rising edge. A decay convolved with the IRF crosses half its maximum before t0, by an amount
+    # that depends on the lifetime and the IRF: it is taken from the model without noise, and refined twice.
+    t0 = edge
+    reference = np.zeros((len(y), 4))
+    reference[:, 0] = 1
+    reference[:, 2] = n / 4
+    for iteration in range(2):
+        tau = lifetime(t0)
+        reference[:, 1] = tau
+        decay, _ = _evaluate(reference, 'mono', f, z, G, m, n, jacobian=False)
+        t0 = edge - (_rising_edge(decay) - n / 4)
+    tau = lifetime(t0)
+
+    if model == 'mono':
+        return np.stack((amplitude, tau, t0, background), axis=1)
+    elif model == 'bi':
+        return np.stack((amplitude / 2, tau / 2, amplitude / 2, tau * 2, t0, background), axis=1)
+    else:
+        raise ValueError('Unknown model: {}, use one of {}'.format(model, list(PARAMETERS)))
+
+
+def fit_decays(histograms, model='mono', irf=None, irf_sigma=1.0, period=None, fit_range=None, resolution=1,
+               start=None, max_iter=50, tol=1e-6, chunk_size=None):
+    """
+    Fits a mono- or bi-exponential decay to every histogram with a batched Levenberg-Marquardt fit.
+    All pixels (of a chunk) are fitted at the same time; every pixel has its own damping and stops when converged.
+    The residuals are weighted with 1/counts (Poisson statistics).
+
+    :param histograms: array of shape (pixels, bins) (or (bins,) for a single histogram)
+    :type histograms: numpy.array
+    :param model: 'mono' or 'bi'
+    :type model: str
+    :param irf: measured IRF (optional), otherwise a Gaussian of width irf_sigma is used
+    :type irf: numpy.array
+    :param irf_sigma: standard deviation of the Gaussian IRF in bins (defaults to 1)
+    :type irf_sigma: float
+    :param period: repetition period in bins, if different from the histogram length
+    :type period: float
+    :param fit_range: (first, last) bin to use in the fit (optional, defaults to all)
+    :type fit_range: tuple
+    :param resolution: time per bin, the lifetimes and t0 are multiplied by it (can be a pint quantity)
+    :type resolution: float or pint quantity
+    :param start: starting values of shape (pixels, parameters), in bins (optional, defaults to estimate_decays())
+    :type start: numpy.array
+    :param max_iter: maximum number of iterations (defaults to 50)
+    :type max_iter: int
+    :param tol: relative change of chi2 below which a pixel is converged (defaults to 1e-6)
+    :type tol: float
+    :param chunk_size: number of pixels fitted at the same time; defaults to what fits in about 200 MB
+    :type chunk_size: int
+    :return: dictionary with an array per parameter (see PARAMETERS[model]), 'chi2' (reduced chi2) and 'valid'
+             (False for pixels whose fit ended at the lower limit of the lifetime; their parameters are nan)
+    :rtype: dict
+    """
+    logger = logging.getLogger(__name__)
+    if model not in PARAMETERS:
+        raise ValueError('Unknown model: {}, use one of {}'.format(model, list(PARAMETERS)))
+    y = np.atleast_2d(np.asarray(histograms, dtype=float))
+    pixels, n = y.shape
+    m = max(int(round(period)), n) if period else n
+    k = len(PARAMETERS[model])
+    if start is None:
+        start = estimate_decays(y, model, irf, irf_sigma, period)
+    start = np.atleast_2d(np.asarray(start, dtype=float))
+    if chunk_size is None:
+        chunk_size = max(1, int(2.5e7 // (k * m)))
+
+    f = np.fft.rfftfreq(m)
+    z = np.exp(-2j * np.pi * f)
+    G = _irf_spectrum(m, irf, irf_sigma)
+    mask = np.ones(n)
+    if fit_range is not None:
+        mask[:] = 0
+        mask[fit_range[0]:fit_range[1]] = 1
+    dof = max(mask.sum() - k, 1)
+    taus = [1] if model == 'mono' else [1, 3]
+
+    def fit_chunks(y, start):
+        params = np.zeros(start.shape)
+        chi2 = np.zeros(len(y))
+        for c0 in range(0, len(y), chunk_size):
+            yy = y[c0:c0 + chunk_size]
+            w = mask / np.maximum(yy, 1)
+            p = start[c0:c0 + chunk_size].copy()
+            fit, J = _evaluate(p, model, f, z, G, m, n)
+            x2 = (w * (yy - fit)**2).sum(axis=1)
+            lam = np.full(len(p), 1e-3)
+            active = np.ones(len(p), dtype=bool)
+            for it in range(max_iter):
+                r = yy - fit
+                JW = J * w[:, None, :]
+                H = np.einsum('pkn,pln->pkl', JW, J)
+                g = np.einsum('pkn,pn->pk', JW, r)
+                diag = np.einsum('pkk->pk', H)
+                Hd = H + (lam[:, None] * diag + 1e-12 * diag.max(axis=1, keepdims=True) + 1e-30)[:, :, None] * np.eye(k)
+                try:
+                    step = np.linalg.solve(Hd, g[..., None])[..., 0]
+                except np.linalg.LinAlgError:
+                    step = np.einsum('pkl,pl->pk', np.linalg.pinv(Hd), g)
+                step[~active] = 0
+                p_new = p + step
+                # a lifetime shrinks at most a factor 10 per step, so it can not jump through zero into _TAU_MIN
+                p_new[:, taus] = np.maximum(p_new[:, taus], np.maximum(p[:, taus] / 10, _TAU_MIN))
+                fit_new, J_new = _evaluate(p_new, model, f, z, G, m, n)
+                x2_new = (w * (yy - fit_new)**2).sum(axis=1)
+                better = active & (x2_new <= x2)
+                converged = better & ((x2 - x2_new) <= tol * x2)
+                p[better] = p_new[better]
+                fit[better] = fit_new[better]
+                J[better] = J_new[better]
+                x2[better] = x2_new[better]
+                lam = np.where(better, lam / 10, lam * 10)
+                active &= ~converged & (lam < 1e10)
+                if not active.any():
+                    break
+            logger.debug('Fitted pixels {} to {} in {} iterations'.format(c0, c0 + len(p), it + 1))
+            params[c0:c0 + len(p)] = p
+            chi2[c0:c0 + len(p)] = x2 / dof
+        return params, chi2
+
+    def at_limit(params):
+        return (params[:, taus] <= 2 * _TAU_MIN).any(axis=1)
+
+    params, chi2 = fit_chunks(y, start)
+    # pixels that end with a lifetime at the lower limit did not converge: fit them again starting from the
+    # first moment, and mark the ones that end there again as invalid (all their parameters are nan)
+    valid = ~at_limit(params)
+    if not valid.all():
+        retry = np.flatnonzero(~valid)
+        logger.debug('{} pixels ended at the lifetime limit, fitting them again'.format(len(retry)))
+        params[retry], chi2[retry] = fit_chunks(y[retry], estimate_decays(y[retry], model, irf, irf_sigma, period,
+                                                                          method='moment'))
+        valid[retry] = ~at_limit(params[retry])
+        if not valid.all():
+            logger.warning('{} of {} pixels did not converge, their parameters are nan'.format(
+                (~valid).sum(), pixels))
+            params[~valid] = np.nan
+
+    result = {name: params[:, i] for i, name in enumerate(PARAMETERS[model])}
+    for name in result:
+        if name.startswith('tau') or name == 't0':
+            result[name] = result[name] * resolution
+    result['chi2'] = chi2
+    result['valid'] = valid
+    return result
+
+
+def fit_decays_from_file(filename, variable, model='mono', chunk_size=None, **kwargs):
+    """
+    Fits the histograms stored in a netCDF4 file written by the DataManager, reading them chunk by chunk so the
+    whole data set never has to be in memory. The last dimension of the variable are the bins; all others are pixels.
+
+    :param filename: file written by the DataManager
+    :type filename: str
+    :param variable: name of the variable holding the histograms
+    :type variable: str
+    :param model: 'mono' or 'bi'
+    :type model: str
+    :param chunk_size: (approximate) number of histograms to read at once (defaults to 1024)
+    :type chunk_size: int
+    :param **kwargs: passed to fit_decays() (irf, irf_sigma, period, fit_range, resolution, ...)
+    :return: dictionary with an array per parameter and 'chi2', with the shape of the pixel dimensions
+    :rtype: dict
+    """
+    from netCDF4 import Dataset
+    logger = logging.getLogger(__name__)
+    if chunk_size is None:
+        chunk_size = 1024
+    with Dataset(filename, 'r') as root:
+        var = root.variables[variable]
+        shape = var.shape
+        if len(shape) == 1:
+            return fit_decays(np.ma.filled(var[:], 0), model, **kwargs)
+        n = shape[-1]
+        pixels_per_row = int(np.prod(shape[1:-1]))
+        rows = max(1, chunk_size // max(pixels_per_row, 1))
+        result = None
+        for r0 in range(0, shape[0], rows):
+            logger.debug('Fitting rows {} to {} of {}'.format(r0, min(r0 + rows, shape[0]), shape[0]))
+            data = np.ma.filled(var[r0:r0 + rows], 0).reshape(-1, n)
+            res = fit_decays(data, model, **kwargs)
+            if result is None:
+                result = {name: np.zeros(shape[:-1]) for name in res}
+            for name, values in res.items():
+                if hasattr(values, 'magnitude'):
+                    values = values.magnitude
+                result[name][r0:r0 + rows] = values.reshape((-1,) + shape[1:-1])
+        if 'resolution' in kwargs and hasattr(kwargs['resolution'], 'units'):
+            for name in result:
+                if name.startswith('tau') or name == 't0':
+                    result[name] = result[name] * kwargs['resolution'].units
+    return result
@@ -0,0 +1,531 @@
+"""
+==========
+Port Tools
+==========
+
+Tools to share communication ports (serial ports, VISA resources, ...) between threads and controllers.
+
+PortLock is a mutex for one port. Threads that wait for the port sleep on a threading.Condition (no busy waiting)
+and it supports a guard interval: a time after a command during which the port stays blocked, e.g. because the
+device needs time to process it or to start up. The lock is re-entrant, so a query can hold it over its write and
+its read, which themselves lock the port as well.
+Use port_lock(name) to get the one PortLock of a port, shared by all controllers in this process.
+Controllers that share a port decorate the methods that talk to it with holds_port, so a write and its read are
+never interleaved with the commands of another controller (or thread) on the same port.
+
+port_manager is the process-wide registry of open serial ports and VISA resources. Controllers open their
+port through it; if the port is already open (by another controller, or still open from before an instrument
+reload) the same handle is returned. Handles are reference counted and only closed when the last user releases
+them. Inside port_manager.keep_open() released handles stay open, so reloading instruments does not
+reopen the ports (and does not wait for their startup time again). A controller that asks for a port that is already
+open with other line settings (baud rate, parity, ...) gets an error; other settings (like timeouts) of the open port
+are not changed, because the other users rely on them.
+
+FramedReader reads replies from a serial port that end in a terminator (e.g. a newline) or a prompt
+(e.g. '> ' for the LCC25). It reads whatever the port has received in one call into a bytearray buffer and
+returns as soon as a reply is complete, so a query does not have to wait for the read timeout.
+
+:copyright: by Hyperion Authors, see AUTHORS for more details.
+:license: BSD, see LICENSE for more details.
+"""
+import functools
+import threading
+import time
+from contextlib import contextmanager
+import serial
+from hyperion import logging
+
+
+class PortLock:
+    """
+    Re-entrant mutex for one port, with a guard interval after releasing it.
+
+    :param name: name of the port, only used in log messages
+    :type name: str
+
+    :Example:
+
+    lock = port_lock('COM8')
+    with lock.hold(guard=1.5):      # nobody else can use COM8 until 1.5 s after leaving this block
+        dev.initialize()
+    """
+    def __init__(self, name=None):
+        self.logger = logging.getLogger(__name__)
+        self.name = name
+        self._condition = threading.Condition(threading.Lock())
+        self._owner = None          # thread ident of the thread holding the lock
+        self._depth = 0             # number of times the owner acquired it
+        self._free_at = 0.0         # time.monotonic() at which the guard interval ends
+
+    @property
+    def locked(self):
+        """ True if a thread holds the lock (the guard interval is not taken into account)."""
+        return self._owner is not None
+
+    def acquire(self, timeout=None):
+        """
+        Waits until no other thread holds the lock and the guard interval has passed, and takes the lock.
+        The waiting thread sleeps; it is woken up when the lock is released.
+
+        :param timeout: maximum time to wait in seconds; None (default) waits as long as needed
+        :type timeout: float
+        :return: True if the lock was acquired, False if it timed out
+        :rtype: bool
+        """
+        me = threading.get_ident()
+        with self._condition:
+            if self._owner == me:
+                self._depth += 1
+                return True
+            deadline = None if timeout is None else time.monotonic() + timeout
+            while True:
+                now = time.monotonic()
+                if self._owner is None and now >= self._free_at:
+                    break
+                wait = None if self._owner is not None else self._free_at - now
+                if deadline is not None:
+                    if now >= deadline:
+                        return False
+                    wait = deadline - now if wait is None else min(wait, deadline - now)
+                self._condition.wait(wait)
+            self._owner = me
+            self._depth = 1
+            return True
+
+    def release(self, guard=0):
+        """
+        Releases the lock (if it was acquired more than once by the same thread, only the last release frees it).
+
+        :param guard: time in seconds, after this release, during which nobody else gets the lock
+        :type guard: float
+        """
+        with self._condition:
+            if self._owner != threading.get_ident():
+                raise RuntimeError('Releasing PortLock {} that is not held by this thread'.format(self.name))
+            if guard > 0:
+                self._free_at = max(self._free_at, time.monotonic() + guard)
+            self._depth -= 1
+            if self._depth == 0:
+                self._owner = None
+                self._condition.notify_all()
+
+    def block(self, duration):
+        """
+        Nobody can acquire the lock during the coming duration seconds (e.g. while a device starts up).
+
+        :param duration: time in seconds
+        :type duration: float
+        """
+        with self._condition:
+            self._free_at = max(self._free_at, time.monotonic() + duration)
+
+    @contextmanager
+    def hold(self, guard=0, timeout=None):
+        """
+        Context manager that acquires the lock and releases it with the given guard interval.
+
+        :param guard: guard interval after the block, in seconds (see release)
+        :type guard: float
+        :param timeout: maximum time to wait for the lock, raises TimeoutError if it expires
+        :type timeout: float
+        """
+        if not self.acquire(timeout):
+            raise TimeoutError('Port {} is busy'.format(self.name))
+        try:
+            yield self
+        finally:
+            self.release(guard)
+
+
+_port_locks = {}
+_port_locks_lock = threading.Lock()
+
+
+def port_lock(name):
+    """
+    The PortLock of a port, shared by everything in this process that uses the same port name.
+    If name is None, a new (not shared) PortLock is returned.
+
+    :param name: name of the port, e.g. 'COM8' or '/dev/ttyUSB0'
+    :type name: str
+    :return: the lock of the port
+    :rtype: PortLock
+    """
+    if name is None:
+        return PortLock()
+    with _port_locks_lock:
+        if name not in _port_locks:
+            _port_locks[name] = PortLock(name)
+        return _port_locks[name]
+
+
+def holds_port(fn):
+    """
+    Decorator for methods of a controller that use its (shared) port: the method holds the PortLock in
+    self._port_lock while it runs. The lock is re-entrant, so decorated methods can call each other.
+
+    :Example:
+
+    self._port_lock = port_lock(self.resource_name)     # in the controller, once the port name is known
+    ...
+    @holds_port
+    def query(self, message):
+        ...
+    """
+    @functools.wraps(fn)
+    def wrapper(self, *args, **kwargs):
+        with self._port_lock.hold():
+            return fn(self, *args, **kwargs)
+    return wrapper
+
+
+class _Handle:
+    """ An open port or resource in the PortManager."""
+    __slots__ = ('key', 'rsc', 'users', 'kind')
+
+    def __init__(self, key, rsc, kind):
+        self.key = key
+        self.rsc = rsc
+        self.users = 0
+        self.kind = kind
+
+
+class PortManager:
+    """
+    Process-wide registry of open serial ports and VISA resources, with reference counting.
+    Use the instance port_manager of this module instead of making a new one.
+
+    :Example:
+
+    rsc = port_manager.open_serial('COM8', baudrate=9600, timeout=0.5, startup_time=1.5)
+    ...
+    port_manager.release(rsc)
+
+    with port_manager.keep_open():      # e.g. around reloading all instruments
+        experiment.remove_all_instruments()
+        experiment.load_instruments()
+    """
+    LINE_SETTINGS = ('baudrate', 'bytesize', 'parity', 'stopbits', 'xonxoff', 'rtscts', 'dsrdtr')
+
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+        self._handles = {}
+        self._lock = threading.RLock()
+        self._keep_open = 0
+        self._resource_manager = None
+        self.opened = 0         # number of ports and resources really opened, for statistics
+        self.reused = 0         # number of times an open handle was returned
+
+    def _get(self, key):
+        handle = self._handles.get(key)
+        if handle is not None and handle.kind == 'serial' and not handle.rsc.is_open:
+            del self._handles[key]     # closed by someone else
+            handle = None
+        return handle
+
+    def open_serial(self, port, startup_time=0, **kwargs):
+        """
+        Returns the open serial port, opening it if it is not open yet.
+        If it is already open, it is not changed: a line setting in kwargs (see LINE_SETTINGS) that differs from
+        the open port raises a ValueError, other settings that differ (like timeouts) give a warning.
+
+        :param port: port name (or pyserial url)
+        :type port: str
+        :param startup_time: time in seconds after really opening the port during which the PortLock of the
+                             port is blocked (e.g. an Arduino restarts when the port is opened)
+        :type startup_time: float
+        :param kwargs: settings for serial.Serial, like baudrate, timeout, write_timeout, parity
+        :return: the port
+        :rtype: serial.Serial
+        """
+        with self._lock:
+            handle = self._get(('serial', port))
+            if handle is None:
+                rsc = serial.serial_for_url(port, **kwargs)
+                handle = _Handle(('serial', port), rsc, 'serial')
+                self._handles[handle.key] = handle
+                self.opened += 1
+                if startup_time:
+                    port_lock(port).block(startup_time)
+                self.logger.debug('Opened serial port {}'.format(port))
+            else:
+                for key, value in kwargs.items():
+                    current = getattr(handle.rsc, key, value)
+                    if current == value:
+                        continue
+                    if key in self.LINE_SETTINGS:
+                        raise ValueError('Port {} is already open with {}={}, can not use it with {}={}'.format(
+                            port, key, current, key, value))
+                    self.logger.warning('Port {} is already open with {}={}, keeping it instead of {}'.format(
+                        port, key, current, value))
+                self.reused += 1
+                self.logger.debug('Reusing open serial port {} ({} users)'.format(port, handle.users))
+            handle.users += 1
+            return handle.rsc
+
+    def resource_manager(self):
+        """ The (one) pyvisa ResourceManager of this process.
+
+        :rtype: pyvisa.ResourceManager
+        """
+        with self._lock:
+            if self._resource_manager is None:
+                import pyvisa
+                self._resource_manager = pyvisa.ResourceManager()
+            return self._resource_manager
+
+    def open_visa(self, resource_name, **kwargs):
+        """
+        Returns the open VISA resource, opening it if it is not open yet.
+
+        :param resource_name: e.g. 'GPIB0::1::INSTR'
+        :type resource_name: str
+        :param kwargs: passed to ResourceManager.open_resource (only used when it is really opened)
+        :return: the resource
+        :rtype: pyvisa.resources.Resource
+        """
+        with self._lock:
+            handle = self._get(('visa', resource_name))
+            if handle is None:
+                rsc = self.resource_manager().open_resource(resource_name, **kwargs)
+                handle = _Handle(('visa', resource_name), rsc, 'visa')
+                self._handles[handle.key] = handle
+                self.opened += 1
+                self.logger.debug('Opened VISA resource {}'.format(resource_name))
+            else:
+                self.reused += 1
+                self.logger.debug('Reusing open VISA resource {} ({} users)'.format(resource_name, handle.users))
+            handle.users += 1
+            return handle.rsc
+
+    def users(self, rsc):
+        """ Number of users of the port or resource rsc (0 if it is not in the registry)."""
+        with self._lock:
+            for handle in self._handles.values():
+                if handle.rsc is rsc:
+                    return handle.users
+        return 0
+
+    def release(self, rsc):
+        """
+        Releases the port or resource rsc. It is closed when nobody uses it any more (unless inside keep_open).
+        A port or resource that is not in the registry is closed.
+
+        :param rsc: the port or resource returned by open_serial or open_visa
+        """
+        with self._lock:
+            for handle in self._handles.values():
+                if handle.rsc is rsc:
+                    break
+            else:
+                rsc.close()
+                return
+            handle.users = max(0, handle.users - 1)
+            if handle.users == 0 and not self._keep_open:
+                self._close(handle)
+
+    def _close(self, handle):
+        del self._handles[handle.key]
+        try:
+            handle.rsc.close()
+        except Exception as e:
+            self.logger.warning('Error closing {}: {}'.format(handle.key[1], e))
+        self.logger.debug('Closed {}'.format(handle.key[1]))
+
+    @contextmanager
+    def keep_open(self):
+        """
+        Context manager: ports and resources released inside it stay open, so they can be reused by the
+        controllers created inside it. At the end, the ones nobody uses are closed.
+        """
+        with self._lock:
+            self._keep_open += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._keep_open -= 1
+                if not self._keep_open:
+                    for handle in [h for h in self._handles.values() if h.users == 0]:
+                        self._close(handle)
+
+    def close_all(self):
+        """ Closes all ports and resources, whether they are used or not."""
+        with self._lock:
+            for handle in list(self._handles.values()):
+                self._close(handle)
+
+
+port_manager = PortManager()
+
+
+class FramedReader:
+    """
+    Buffered reader for replies that end in a terminator, on a pyserial port (or anything with
+    read(size), in_waiting, timeout and reset_input_buffer()).
+
+    Bytes that arrive after a reply stay in the internal buffer and are used by the next read.
+    If the port has nothing waiting, one blocking read(1) is done (it returns at the first byte or after the
+    port timeout), after which everything that arrived is read in a single call.
+
+    :param rsc: the serial port
+    :type rsc: serial.Serial
+    :param terminator: end of a reply, or tuple of possible ends (e.g. (b'\\n', b'\\r'))
+    :type terminator: bytes or tuple
+    :param timeout: default timeout in seconds for a read; None uses the timeout of the port
+    :type timeout: float
+
+    :Example:
+
+    reader = FramedReader(serial.Serial('COM8', timeout=1), terminator=b'> ')
+    reader.reset()
+    reader.rsc.write(b'volt1?\\r')
+    reply = reader.read_until()     # b'volt1?\\r1.000\\r> '
+    """
+    def __init__(self, rsc, terminator=b'\n', timeout=None):
+        self.logger = logging.getLogger(__name__)
+        self.rsc = rsc
+        self.terminator = terminator
+        self.timeout = timeout
+        self.buffer = bytearray()
+
+    @staticmethod
+    def _terminators(terminator):
+        if isinstance(terminator, (bytes, bytearray)):
+            return (bytes(terminator),)
+        return tuple(bytes(t) for t in terminator)
+
+    def _find(self, terminators, start=0, last=False):
+        """ Index just after the first (or last) terminator in the buffer at or after start, or -1."""
+        ends = []
+        for term in terminators:
+            k = self.buffer.rfind(term, start) if last else self.buffer.find(term, start)
+            if k >= 0:
+                ends.append(k + len(term))
+        if not ends:
+            return -1
+        return max(ends) if last else min(ends)
+
+    def _fill(self, remaining):
+        """ Reads what the port has received, waiting at most remaining seconds for the first byte.
+
+        :return: number of bytes added to the buffer
+        :rtype: int
+        """
+        waiting = self.rsc.in_waiting
+        if waiting:
+            data = self.rsc.read(waiting)
+        else:
+            port_timeout = self.rsc.timeout
+            shorter = port_timeout is None or port_timeout > remaining
+            if shorter:
+                self.rsc.timeout = remaining
+            try:
+                data = self.rsc.read(1)
+            finally:
+                if shorter:
+                    self.rsc.timeout = port_timeout
+            if data and self.rsc.in_waiting:
+                data += self.rsc.read(self.rsc.in_waiting)
+        self.buffer += data
+        return len(data)
+
+    def _pull(self):
+        """ Moves what the port has received into the buffer, without waiting."""
+        waiting = self.rsc.in_waiting
+        if waiting:
+            self.buffer += self.rsc.read(waiting)
+
+    def _take(self, end):
+        data = bytes(self.buffer[:end])
+        del self.buffer[:end]
+        return data
+
+    @property
+    def in_waiting(self):
+        """ Number of bytes that can be read without waiting (internal buffer plus the port)."""
+        return len(self.buffer) + self.rsc.in_waiting
+
+    def reset(self):
+        """ Discards everything received so far (internal buffer and port input buffer)."""
+        self.buffer.clear()
+        self.rsc.reset_input_buffer()
+
+    def read_available(self):
+        """ Returns everything received so far, without waiting.
+
+        :rtype: bytes
+        """
+        self._pull()
+        return self._take(len(self.buffer))
+
+    def read_until(self, terminator=None, timeout=None, greedy=False):
+        """
+        Reads until the terminator is received and returns the data including the terminator.
+        If the timeout expires first, everything received so far is returned (like serial.Serial.read_until).
+
+        :param terminator: end of the reply, or tuple of possible ends; None uses self.terminator
+        :type terminator: bytes or tuple
+        :param timeout: maximum time in seconds; None uses self.timeout or else the timeout of the port
+        :type timeout: float
+        :param greedy: if True, also return the complete replies that were received together with the first one
+                       (everything up to the last terminator in the buffer)
+        :type greedy: bool
+        :return: the reply
+        :rtype: bytes
+        """
+        terminators = self._terminators(self.terminator if terminator is None else terminator)
+        longest = max(len(t) for t in terminators)
+        if timeout is None:
+            timeout = self.timeout if self.timeout is not None else (self.rsc.timeout or 0)
+        deadline = time.monotonic() + timeout
+        searched = 0
+        while True:
+            end = self._find(terminators, searched)
+            if end >= 0:
+                if greedy:
+                    self._pull()
+                    end = self._find(terminators, max(0, end - longest), last=True)
+                return self._take(end)
+            searched = max(0, len(self.buffer) - longest + 1)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            if not self._fill(remaining) and self.rsc.timeout == 0:
+                time.sleep(min(remaining, 0.001))    # non-blocking port: do not spin
+        self.logger.debug('Timeout after {} s waiting for {}, {} bytes received'.format(
+            timeout, terminators, len(self.buffer)))
+        return self._take(len(self.buffer))
+
+    def read_frames(self, count, terminator=None, timeout=None):
+        """
+        Reads count replies, each ending in the terminator, within one timeout.
+        The replies are returned without their terminator. If the timeout expires, fewer replies are returned
+        (a last incomplete reply is returned as well).
+
+        :param count: number of replies
+        :type count: int
+        :param terminator: end of each reply; None uses self.terminator
+        :type terminator: bytes or tuple
+        :param timeout: maximum time in seconds for all replies together
+        :type timeout: float
+        :return: the replies
+        :rtype: list of bytes
+        """
+        terminators = self._terminators(self.terminator if terminator is None else terminator)
+        if timeout is None:
+            timeout = self.timeout if self.timeout is not None else (self.rsc.timeout or 0)
+        deadline = time.monotonic() + timeout
+        frames = []
+        while len(frames) < count:
+            frame = self.read_until(terminators, timeout=max(0, deadline - time.monotonic()))
+            if not frame:
+                break
+            for term in terminators:
+                if frame.endswith(term):
+                    frames.append(frame[:-len(term)])
+                    break
+            else:
+                frames.append(frame)
+                break
+        return frames
@@ -0,0 +1,187 @@
+"""
+==============
+VISA Discovery
+==============
+
+Finds the VISA resource of an instrument by its identification (the reply to ``*IDN?``), with a cache on disk.
+
+Searching a device by opening every resource and asking ``*IDN?`` takes seconds, so the identifications found
+are stored in a yaml file together with the time they were found. The next time the cached resource is
+opened and checked with a single ``*IDN?`` query; only if that fails (or the entry is older than the ttl)
+all resources are probed again, in parallel.
+
+:Example:
+
+    osa = find_visa_resource(r'ANDO,AQ6317', prefix='GPIB')
+    ...
+    port_manager.release(osa)
+
+:copyright: by Hyperion Authors, see AUTHORS for more details.
+:license: BSD, see LICENSE for more details.
+"""
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import yaml
+from hyperion import logging, parent_path
+from hyperion.tools.port_tools import port_manager, port_lock
+
+
+class VisaDiscovery:
+    """
+    Cache of the identifications of VISA resources.
+
+    :param cache_file: yaml file for the cache; None uses cache/visa_resources.yml next to the logs folder
+    :type cache_file: str
+    :param ttl: time in seconds after which a cache entry is not trusted any more
+    :type ttl: float
+    :param probe_timeout: VISA timeout in ms for the ``*IDN?`` query while probing
+    :type probe_timeout: int
+    :param workers: number of resources probed at the same time
+    :type workers: int
+    """
+    def __init__(self, cache_file=None, ttl=7 * 24 * 3600, probe_timeout=500, workers=8):
+        self.logger = logging.getLogger(__name__)
+        if cache_file is None:
+            cache_file = os.path.join(parent_path, 'cache', 'visa_resources.yml')
+        self.cache_file = cache_file
+        self.ttl = ttl
+        self.probe_timeout = probe_timeout
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._cache = None
+
+    @property
+    def cache(self):
+        """ dict {resource name: {'idn': identification, 'time': time it was found}}, loaded from the cache file."""
+        if self._cache is None:
+            self._cache = {}
+            if os.path.isfile(self.cache_file):
+                try:
+                    with open(self.cache_file, 'r') as f:
+                        self._cache = yaml.safe_load(f) or {}
+                except (OSError, yaml.YAMLError) as e:
+                    self.logger.warning('Could not read VISA cache {}: {}'.format(self.cache_file, e))
+        return self._cache
+
+    def save(self):
+        """ Writes the cache to the cache file."""
+        try:
+            os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+            with open(self.cache_file, 'w') as f:
+                yaml.safe_dump(self.cache, f)
+        except OSError as e:
+            self.logger.warning('Could not write VISA cache {}: {}'.format(self.cache_file, e))
+
+    def clear(self):
+        """ Empties the cache (also on disk)."""
+        with self._lock:
+            self._cache = {}
+            self.save()
+
+    def _matches(self, pattern, idn):
+        return re.match(pattern, idn.strip()) is not None
+
+    def _idn(self, rsc):
+        """ Asks the identification of an open resource, or returns None if it does not reply."""
+        with port_lock(rsc.resource_name).hold():
+            timeout = rsc.timeout
+            rsc.timeout = self.probe_timeout
+            try:
+                return rsc.query('*IDN?').strip()
+            except Exception:
+                return None
+            finally:
+                rsc.timeout = timeout
+
+    def _probe(self, resource_name):
+        """ Opens the resource, asks its identification and releases it. Returns the identification or None."""
+        try:
+            rsc = port_manager.open_visa(resource_name)
+        except Exception as e:
+            self.logger.debug('Could not open {}: {}'.format(resource_name, e))
+            return None
+        try:
+            if port_manager.users(rsc) > 1:
+                # in use by a controller, do not disturb it
+                entry = self.cache.get(resource_name)
+                return entry['idn'] if entry else None
+            return self._idn(rsc)
+        finally:
+            port_manager.release(rsc)
+
+    def probe(self, prefix=''):
+        """
+        Asks the identification of all resources whose name starts with prefix, in parallel, and stores them
+        in the cache.
+
+        :param prefix: e.g. 'GPIB' to probe only GPIB resources
+        :type prefix: str
+        :return: dict {resource name: identification} of the resources that replied
+        :rtype: dict
+        """
+        names = [name for name in port_manager.resource_manager().list_resources() if name.startswith(prefix)]
+        self.logger.info('Probing {} VISA resources'.format(len(names)))
+        with ThreadPoolExecutor(max_workers=max(1, min(self.workers, len(names)))) as executor:
+            idns = dict(zip(names, executor.map(self._probe, names)))
+        found = {name: idn for name, idn in idns.items() if idn}
+        now = time.time()
+        with self._lock:
+            for name, idn in found.items():
+                self.cache[name] = {'idn': idn, 'time': now}
+            self.save()
+        return found
+
+    def find(self, pattern, prefix='', validate=True):
+        """
+        Returns the open resource whose identification matches the regular expression pattern.
+        A cached resource is validated with one ``*IDN?`` query (unless validate is False);
+        all resources are probed only if the cache does not give a valid resource.
+
+        :param pattern: regular expression matched with the start of the identification, e.g. 'ANDO,AQ6317'
+        :type pattern: str
+        :param prefix: only consider resources whose name starts with this, e.g. 'GPIB'
+        :type prefix: str
+        :param validate: check the cached resource with ``*IDN?`` before returning it
+        :type validate: bool
+        :return: the open resource (release it with port_manager.release), or None if it is not found
+        :rtype: pyvisa.resources.Resource
+        """
+        now = time.time()
+        with self._lock:
+            cached = [name for name, entry in self.cache.items()
+                      if name.startswith(prefix) and now - entry['time'] < self.ttl
+                      and self._matches(pattern, entry['idn'])]
+        for name in cached:
+            try:
+                rsc = port_manager.open_visa(name)
+            except Exception as e:
+                self.logger.debug('Could not open cached resource {}: {}'.format(name, e))
+                continue
+            if not validate or port_manager.users(rsc) > 1:     # (in use by a controller: it is valid)
+                return rsc
+            idn = self._idn(rsc)
+            if idn is not None and self._matches(pattern, idn):
+                self.logger.debug('Found {} at cached resource {}'.format(pattern, name))
+                return rsc
+            port_manager.release(rsc)
+            self.logger.info('Cached resource {} is not {} any more'.format(name, pattern))
+            with self._lock:
+                self.cache.pop(name, None)
+
+        for name, idn in self.probe(prefix).items():
+            if self._matches(pattern, idn):
+                self.logger.info('Found {} at {}'.format(pattern, name))
+                return port_manager.open_visa(name)
+        self.logger.error('No VISA resource found with identification {}'.format(pattern))
+        return None
+
+
+visa_discovery = VisaDiscovery()
+
+
+def find_visa_resource(pattern, prefix='', validate=True):
+    """ Shortcut to visa_discovery.find (see VisaDiscovery.find)."""
+    return visa_discovery.find(pattern, prefix, validate)
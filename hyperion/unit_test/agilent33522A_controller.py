@@ -12,6 +12,9 @@ a method to unit_test the new methods in the controller, if any.
 :copyright: by Hyperion Authors, see AUTHORS for more details.
 :license: BSD, see LICENSE for more details.
 """
+import threading
+import time
+import numpy as np
 from hyperion import logging
 from time import sleep
 from hyperion import ur
@@ -121,6 +124,128 @@ class UTestAgilent33522A():
 
         self.logger.info('Test Freq passed.')
 
+    def test_batch(self):
+        """ Test that the commands in a batch are executed, in order, and that the errors are reported"""
+        self.logger.debug('Starting unit_test on batch')
+        with self.dev.batch() as errors:
+            for ch in self.CHANNELS:
+                self.dev.set_frequency(ch, 100)
+                self.dev.set_frequency(ch, 250.5)
+                self.dev.set_waveform(ch, 'SQU')
+        assert errors == []
+        for ch in self.CHANNELS:
+            assert float(self.dev.get_frequency(ch)) == 250.5
+            assert self.dev.get_waveform(ch).strip() == 'SQU'
+        # a query inside the batch gets the value set before it
+        with self.dev.batch() as errors:
+            self.dev.set_voltage(1, 0.2)
+            assert float(self.dev.get_voltage(1)) == 0.2
+            self.dev.write('SOUR1:NOT:A:COMMAND 1')
+        assert len(errors) == 1
+        self.logger.info('Reported error: {}'.format(errors[0]))
+        # an exception inside the batch discards the commands that were not sent yet
+        freq = float(self.dev.get_frequency(1))
+        try:
+            with self.dev.batch():
+                self.dev.set_frequency(1, 1234)
+                raise RuntimeError('test exception')
+        except RuntimeError as e:
+            assert str(e) == 'test exception'
+        else:
+            raise AssertionError('The exception in the batch was not raised')
+        assert float(self.dev.get_frequency(1)) == freq
+        self.dev.set_frequency(1, 4321)     # not in a batch anymore
+        assert float(self.dev.get_frequency(1)) == 4321
+        self.logger.info('Test batch passed.')
+
+    def test_arb(self):
+        """ Test the upload of arbitrary waveforms (both data types), sequences and the split of long waveforms"""
+        self.logger.debug('Starting unit_test on arbitrary waveforms')
+        ch = 1
+        samples = np.sin(np.linspace(0, 2 * np.pi, 1000))
+        for dtype in ['int16', 'float32']:
+            errors = self.dev.upload_arb(ch, samples, 1e6, name='SINE', dtype=dtype)
+            assert errors == []
+            assert self.dev.get_waveform(ch).strip() == 'ARB'
+            assert float(self.dev.get_sample_rate(ch)) == 1e6
+            if self.dummy:
+                assert np.allclose(self.dev.rsc.arbs[ch]['SINE'], samples, atol=1 / 32767)
+            self.logger.info('Arbitrary waveform with {} passed.'.format(dtype))
+
+        assert self.dev.upload_arb(ch, np.linspace(-1, 1, 100), 1e6, name='RAMP', clear=False) == []
+        assert self.dev.upload_sequence(ch, 'PATTERN', [('SINE', 3), ('RAMP', 1)], 2e6) == []
+        if self.dummy:
+            assert len(self.dev.rsc.arbs[ch]['PATTERN']) == 3100
+        self.logger.info('Sequence passed.')
+
+        # a long waveform is split in segments, played as a sequence
+        max_points, chunk = self.dev.MAX_ARB_POINTS, self.dev.WRITE_CHUNK
+        self.dev.MAX_ARB_POINTS, self.dev.WRITE_CHUNK = 300, 256
+        try:
+            samples = np.random.uniform(-1, 1, 1000)
+            assert self.dev.upload_arb(ch, samples, 1e3, name='LONG') == []
+        finally:
+            self.dev.MAX_ARB_POINTS, self.dev.WRITE_CHUNK = max_points, chunk
+        if self.dummy:
+            assert np.allclose(self.dev.rsc.arbs[ch]['LONG'], samples, atol=1 / 32767)
+        self.logger.info('Test arbitrary waveforms passed.')
+
+    def test_batch_threads(self):
+        """ Test that a command from another thread waits until the batch is sent (or discarded) and is not
+        added to it"""
+        self.logger.debug('Starting unit_test on a batch with another thread')
+        self.dev.set_frequency(2, 100)
+        freq = float(self.dev.get_frequency(1))
+        in_batch = threading.Event()
+        done = []
+
+        def other():
+            in_batch.wait()
+            self.dev.set_frequency(2, 777)
+            done.append(True)
+        thread = threading.Thread(target=other)
+        thread.start()
+        try:
+            with self.dev.batch():
+                self.dev.set_frequency(1, 500)
+                in_batch.set()
+                sleep(0.2)
+                assert not done, 'The other thread wrote during the batch'
+                raise RuntimeError('discard the batch')
+        except RuntimeError:
+            pass
+        thread.join()
+        assert float(self.dev.get_frequency(1)) == freq      # the batch was discarded
+        assert float(self.dev.get_frequency(2)) == 777       # the command of the other thread was not
+        self.logger.info('Test batch with threads passed.')
+
+    def benchmark(self, channels=(1, 2)):
+        """ Time to configure the channels with one command at a time and in a batch (both with one check of the
+        error queue at the end)"""
+        def configure():
+            for ch in channels:
+                self.dev.set_waveform(ch, 'SIN')
+                self.dev.set_frequency(ch, 1e3)
+                self.dev.set_voltage_limits(ch, 1, -1)
+                self.dev.enable_voltage_limits(ch, True)
+                self.dev.set_voltage_high(ch, 0.5)
+                self.dev.set_voltage_low(ch, -0.5)
+                self.dev.enable_output(ch, True)
+
+        t = time.perf_counter()
+        configure()
+        assert self.dev.read_errors() == []
+        sequential = time.perf_counter() - t
+
+        t = time.perf_counter()
+        with self.dev.batch() as errors:
+            configure()
+        batched = time.perf_counter() - t
+        assert errors == []
+        self.logger.info('Configuring {} channels: one command at a time {:.3f} s, batched {:.3f} s'.format(
+            len(channels), sequential, batched))
+        assert batched < sequential
+
     def test_mode(self):
         """ Test the mode methods"""
         self.logger.debug('Starting unit_test on mode mode')
@@ -133,22 +258,22 @@ class UTestAgilent33522A():
 
 if __name__ == "__main__":
 
-    dummy_mode = [False]  # add false here to also unit_test the real device with connection
+    dummy_mode = [True]  # add False here to also unit_test the real device with connection
     id = '8967'
     for dummy in dummy_mode:
         print('Running dummy={} tests.'.format(dummy))
-        # run the tests
-        with UTestAgilent33522A(settings = {'instrument_id':'8967', 'dummy': False}) as t:
+        # run the tests. In dummy mode the device answers after 1 ms per message plus 0.1 ms per command
+        with UTestAgilent33522A(settings = {'instrument_id':'8967', 'dummy': dummy,
+                                            'latency': 0.001, 'command_time': 0.0001}) as t:
             t.test_enable_output()
             sleep(0.1)
             t.test_freq()
             sleep(0.1)
             t.test_all_amplitudes()
             sleep(0.1)
+            t.test_batch()
+            t.test_arb()
+            t.test_batch_threads()
+            t.benchmark()
 
         print('\n\n\n Done with dummy={} tests. \n\n\n NO PROBLEM, you are great!!!! \n\n\n '.format(dummy))
-
-
-
-
-
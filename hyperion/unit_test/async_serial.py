@@ -0,0 +1,164 @@
+"""
+=================
+Test Async Serial
+=================
+
+This class aims to unit_test the asyncio serial transport (hyperion.tools.async_serial) and to
+benchmark its latency against blocking pyserial queries.
+
+It does not need devices: it uses the pyserial loopback port ('loop://') and, on Linux/macOS,
+simulated devices on pseudo terminals (ptys) that reply to every command after a fixed delay,
+like a slow instrument.
+
+:copyright: by Hyperion Authors, see AUTHORS for more details.
+:license: BSD, see LICENSE for more details.
+
+"""
+import os
+import threading
+import time
+import serial
+from hyperion import logging
+from hyperion.tools.async_serial import SerialLoop
+
+
+class PtyDevice:
+    """ Simulated device on a pty: replies 'reply <command>' after delay seconds, and nothing to 'silent'."""
+    def __init__(self, delay=0.005):
+        import pty
+        self.delay = delay
+        self.master, self.slave = pty.openpty()
+        self.port = os.ttyname(self.slave)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        buffer = b''
+        while True:
+            try:
+                buffer += os.read(self.master, 1024)
+            except OSError:
+                return
+            while b'\r' in buffer:
+                command, buffer = buffer.split(b'\r', 1)
+                time.sleep(self.delay)
+                if command != b'silent':
+                    os.write(self.master, b'reply ' + command + b'\r\n')
+
+
+class UTestAsyncSerial():
+    """ Class to unit_test the async serial transport."""
+    def __init__(self, settings):
+        """ initialize
+
+        """
+        self.logger = logging.getLogger(__name__)
+        self.logger.info('Created UTestAsyncSerial class.')
+        self.use_pty = settings['pty'] and os.name == 'posix'
+        self.delay = settings['delay']
+        self.loop = SerialLoop()
+        self.devices = [PtyDevice(self.delay) for _ in range(settings['devices'])] if self.use_pty else []
+        self.ports = [self.loop.open(dev.port, terminator=b'\r\n', write_termination=b'\r', timeout=1)
+                      for dev in self.devices]
+
+    # the next two methods are needed so the context manager 'with' works.
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.finalize()
+
+    def finalize(self):
+        """ closes connection """
+        self.loop.close()
+
+    def test_loopback(self):
+        """ Test query and pipelining on the loopback port (it echoes the command, so it is also the reply)."""
+        port = self.loop.open('loop://', terminator=b'\n', write_termination=b'\n')
+        assert port.query('hello') == ['hello']
+        messages = ['command {}'.format(k) for k in range(100)]
+        replies = port.query_many(messages)
+        assert replies == [[msg] for msg in messages]
+        self.logger.info('Test loopback passed.')
+
+    def test_pipelining(self):
+        """ Test that pipelined replies are matched to the right command."""
+        if not self.use_pty:
+            self.logger.info('No ptys, skipping test pipelining.')
+            return
+        port = self.ports[0]
+        messages = ['cmd{}'.format(k) for k in range(20)]
+        replies = port.query_many(messages)
+        assert replies == [['reply ' + msg] for msg in messages]
+        self.logger.info('Test pipelining passed.')
+
+    def test_timeout(self):
+        """ A request without reply times out on its own timeout; the requests after it get the right reply."""
+        if not self.use_pty:
+            self.logger.info('No ptys, skipping test timeout.')
+            return
+        port = self.ports[0]
+        t = time.perf_counter()
+        try:
+            port.query('silent', timeout=0.05)
+            raise AssertionError('Query without reply did not time out')
+        except TimeoutError:
+            pass
+        elapsed = time.perf_counter() - t
+        assert elapsed < 0.05 + 0.05, 'Timeout took {:.3f} s'.format(elapsed)
+        # the 'silent' request never gets a reply: after late_reply it is dropped
+        time.sleep(port.dev.late_reply + 0.05)
+        assert port.query('next') == ['reply next']
+        # a timed out request takes its late reply, so it does not shift the replies of later requests
+        try:
+            port.query('slow', timeout=self.delay / 10)
+            raise AssertionError('Query did not time out')
+        except TimeoutError:
+            pass
+        assert port.query('after') == ['reply after']
+        self.logger.info('Test timeout passed.')
+
+    def benchmark(self, n=20):
+        """ Compares n queries to every device: blocking one after the other, async concurrent, and async pipelined."""
+        if not self.use_pty:
+            self.logger.info('No ptys, skipping benchmark.')
+            return
+        # blocking pyserial, one device after the other (as the controllers do now), on their own devices
+        rscs = [serial.Serial(PtyDevice(self.delay).port, timeout=1) for _ in self.devices]
+        t = time.perf_counter()
+        for k in range(n):
+            for rsc in rscs:
+                rsc.write('b{}\r'.format(k).encode())
+                rsc.read_until(b'\r\n')
+        blocking = (time.perf_counter() - t) / n
+        for rsc in rscs:
+            rsc.close()
+
+        # async: every device queried at the same time, one command at a time per device
+        t = time.perf_counter()
+        for k in range(n):
+            self.loop.gather(*(port.aquery('a{}'.format(k)) for port in self.ports))
+        concurrent = (time.perf_counter() - t) / n
+
+        # async: all commands pipelined on every device
+        t = time.perf_counter()
+        self.loop.gather(*(port.dev.query_many(['p{}'.format(k) for k in range(n)]) for port in self.ports))
+        pipelined = (time.perf_counter() - t) / n
+
+        self.logger.info('{} devices with {} ms reply delay, time per round of queries:'.format(
+            len(self.devices), self.delay * 1e3))
+        self.logger.info('blocking: {:.2f} ms, async concurrent: {:.2f} ms, async pipelined: {:.2f} ms'.format(
+            blocking * 1e3, concurrent * 1e3, pipelined * 1e3))
+        assert concurrent < blocking
+        self.logger.info('Benchmark done.')
+
+
+if __name__ == "__main__":
+
+    with UTestAsyncSerial(settings={'pty': True, 'devices': 4, 'delay': 0.005}) as t:
+        t.test_loopback()
+        t.test_pipelining()
+        t.test_timeout()
+        t.benchmark()
+
+    print('\n\n\n Done with async serial tests. \n\n\n NO PROBLEM, you are great!!!! \n\n\n ')
@@ -0,0 +1,161 @@
+"""
+=================================
+Test Generic Serial port locking
+=================================
+
+This class aims to unit_test the PortLock (hyperion.tools.port_tools) and its use in the
+GenericSerialController: commands from different threads on the same port should never overlap,
+the guard interval after a command (e.g. after initialize) should be respected, and threads
+waiting for the port should not use CPU while they wait. A port that is already open should not be
+changed by the settings of another user.
+
+It does not need a device: the controller talks to a pyserial loopback port ('loop://'),
+which echoes everything that is written to it.
+
+:copyright: by Hyperion Authors, see AUTHORS for more details.
+:license: BSD, see LICENSE for more details.
+
+"""
+import threading
+import time
+import serial
+from hyperion import logging
+from hyperion.tools.port_tools import PortLock, port_lock, port_manager
+from hyperion.controller.generic.generic_serial_contr import GenericSerialController
+
+
+class UTestPortLock():
+    """ Class to unit_test the port locking of the Generic Serial Controller."""
+    def __init__(self, settings):
+        """ initialize
+
+        """
+        self.logger = logging.getLogger(__name__)
+        self.logger.info('Created UTestPortLock class.')
+        self.threads = settings['threads']
+        self.commands = settings['commands']
+        self.devs = []
+        loopback = serial.serial_for_url('loop://', timeout=0.5)
+        for k in range(self.threads):
+            # all controllers share the same port, as if they were made by different instruments
+            dev = GenericSerialController({'port': settings['port'], 'name': 'loop {}'.format(k),
+                                           'read_timeout': 0.5})
+            dev.rsc = loopback
+            dev._is_initialized = True
+            self.devs.append(dev)
+
+    # the next two methods are needed so the context manager 'with' works.
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.finalize()
+
+    def finalize(self):
+        """ closes connection """
+        self.devs[0].rsc.close()
+        for dev in self.devs:
+            dev._is_initialized = False
+
+    def _run_threads(self, target):
+        """ Runs target(k) in self.threads threads and returns the wall time and the process time used."""
+        threads = [threading.Thread(target=target, args=(k,)) for k in range(self.threads)]
+        wall, cpu = time.perf_counter(), time.process_time()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return time.perf_counter() - wall, time.process_time() - cpu
+
+    def test_shared_lock(self):
+        """ Test that controllers on the same port share the lock, and different ports do not."""
+        assert self.devs[0]._port_lock is self.devs[-1]._port_lock
+        assert self.devs[0]._port_lock is port_lock(self.devs[0]._port)
+        assert port_lock('other port') is not self.devs[0]._port_lock
+        self.logger.info('Test shared lock passed.')
+
+    def test_queries_under_contention(self):
+        """ Every thread queries the loopback port; each one should get back exactly its own message."""
+        self.logger.debug('Starting unit_test on queries under contention')
+        errors = []
+
+        def worker(k):
+            for n in range(self.commands):
+                message = 'thread {} command {}'.format(k, n)
+                answer = self.devs[k].query(message)
+                if answer != [message]:
+                    errors.append((message, answer))
+
+        wall, cpu = self._run_threads(worker)
+        self.logger.info('{} queries in {:.3f} s wall time, {:.3f} s cpu time'.format(
+            self.threads * self.commands, wall, cpu))
+        assert not errors, 'Mixed up answers: {}'.format(errors[:5])
+        self.logger.info('Test queries under contention passed.')
+
+    def test_guard_interval(self):
+        """ Threads waiting for a guard interval should wait long enough, one at a time, without spinning."""
+        self.logger.debug('Starting unit_test on guard interval')
+        guard = 0.1
+        lock = PortLock('guard test')
+        intervals = []
+
+        def worker(k):
+            with lock.hold(guard=guard):
+                start = time.monotonic()
+                time.sleep(0.01)
+                intervals.append((start, time.monotonic()))
+
+        wall, cpu = self._run_threads(worker)
+        intervals.sort()
+        for (s0, e0), (s1, e1) in zip(intervals, intervals[1:]):
+            assert s1 >= e0 + guard * 0.99, 'Guard interval not respected: {:.4f} s'.format(s1 - e0)
+        self.logger.info('{} threads with a {} s guard: {:.3f} s wall time, {:.3f} s cpu time'.format(
+            self.threads, guard, wall, cpu))
+        # with busy waiting the waiting threads would use about (threads-1) times the wall time
+        assert cpu < 0.25 * wall, 'Waiting threads use too much cpu: {:.3f} s'.format(cpu)
+        self.logger.info('Test guard interval passed.')
+
+    def test_timeout(self):
+        """ Test that acquire gives up after the timeout while another thread holds the lock."""
+        lock = PortLock('timeout test')
+        result = []
+        with lock.hold():
+            t = threading.Thread(target=lambda: result.append(lock.acquire(timeout=0.05)))
+            t.start()
+            t.join()
+        assert result == [False]
+        assert not lock.locked
+        self.logger.info('Test timeout passed.')
+
+    def test_shared_port_settings(self):
+        """ Test that opening an open port with other settings does not change it: other line settings
+        are refused, other timeouts are ignored."""
+        url = 'loop://?logging=info'        # another url than the one of the controllers
+        rsc = port_manager.open_serial(url, baudrate=9600, timeout=0.5)
+        try:
+            try:
+                port_manager.open_serial(url, baudrate=115200)
+            except ValueError as e:
+                self.logger.info('Refused as expected: {}'.format(e))
+            else:
+                raise AssertionError('Opening the port with another baudrate should fail')
+            assert port_manager.users(rsc) == 1
+            assert port_manager.open_serial(url, baudrate=9600, timeout=5) is rsc
+            assert rsc.baudrate == 9600 and rsc.timeout == 0.5
+            port_manager.release(rsc)
+        finally:
+            port_manager.release(rsc)
+        assert not rsc.is_open
+        self.logger.info('Test shared port settings passed.')
+
+
+if __name__ == "__main__":
+
+    with UTestPortLock(settings={'port': 'loop://', 'threads': 8, 'commands': 20}) as t:
+        t.test_shared_lock()
+        t.test_queries_under_contention()
+        t.test_guard_interval()
+        t.test_timeout()
+        t.test_shared_port_settings()
+
+    print('\n\n\n Done with port lock tests. \n\n\n NO PROBLEM, you are great!!!! \n\n\n ')
@@ -0,0 +1,163 @@
+"""
+=========================
+Test Hydraharp instrument
+=========================
+
+This class aims to unit_test the automatic alignment of the input channels and the read out of the histograms of the
+instrument class: hydraharp_instrument.py, and that the offsets act the same in histogram and T2 mode of the dummy.
+
+In dummy mode it uses the simulated Hydraharp (HydraharpDummy), where the delay and the lifetime
+of every channel are known, so it runs without the device.
+
+:copyright: by Hyperion Authors, see AUTHORS for more details.
+:license: BSD, see LICENSE for more details.
+
+"""
+import numpy as np
+from hyperion import logging, ur
+from hyperion.instrument.correlator.hydraharp_instrument import HydraInstrument
+from hyperion.controller.picoquant.hydraharp import decode_t2_records
+
+
+class UTestHydraInstrument():
+    """ Class to unit_test the Hydraharp instrument."""
+    def __init__(self, settings):
+        """ initialize
+
+        """
+        self.logger = logging.getLogger(__name__)
+        self.logger.info('Created UTestHydraInstrument class.')
+        self.settings = settings
+
+    # the next two methods are needed so the context manager 'with' works.
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+    def _aligned_delay(self, lifetime, delay, method='edge'):
+        """ Aligns a (dummy) device with these lifetimes and delays per channel and returns the delay of
+        channel 2 with respect to channel 1 that remains after aligning, in ps."""
+        settings = dict(self.settings, lifetime=lifetime, delay=delay, seed=1)
+        with HydraInstrument(settings=settings) as hydra:
+            hydra.set_histogram(leng=65536, res=4*ur('ps'))
+            offsets = hydra.auto_align_offsets(integration_time=0.5*ur('s'), iterations=1, method=method)
+        return delay[1] - delay[0] + (offsets['chan2_offset'] - offsets.get('chan1_offset', 0*ur('ps'))).m_as('ps')
+
+    def test_align_delay(self):
+        """ Two channels with the same lifetime and a delay of 250 ps get aligned."""
+        self.logger.debug('Starting unit_test on aligning a delay')
+        remaining = self._aligned_delay([1000, 1000], [2000, 2250])
+        self.logger.info('Remaining delay: {:.1f} ps'.format(remaining))
+        assert abs(remaining) <= 8
+        self.logger.info('Test align delay passed.')
+
+    def test_align_different_lifetimes(self):
+        """ Two channels with the same delay but different lifetimes should stay aligned on their rising edges,
+        while the cross-correlation of the whole decays shifts them."""
+        self.logger.debug('Starting unit_test on aligning different lifetimes')
+        remaining = self._aligned_delay([2000, 500], [2000, 2000])
+        self.logger.info('Remaining delay with the rising edges: {:.1f} ps'.format(remaining))
+        assert abs(remaining) <= 8
+        remaining = self._aligned_delay([2000, 500], [2000, 2000], method='correlation')
+        self.logger.info('Remaining delay with the cross-correlation of the decays: {:.1f} ps'.format(remaining))
+        self.logger.info('Test align different lifetimes passed.')
+
+    def test_failed_readout(self):
+        """ If the device does not return the histograms, make_histogram raises an error and keeps the last histograms."""
+        self.logger.debug('Starting unit_test on a failed read out')
+        with HydraInstrument(settings=self.settings) as hydra:
+            hydra.set_histogram(leng=65536, res=4*ur('ps'))
+            hists = hydra.make_histogram(0.1*ur('s'))
+            hydra.controller.all_histograms = lambda clear=True: None      # as when the library reports an error
+            try:
+                hydra.make_histogram(0.1*ur('s'))
+            except RuntimeError as e:
+                self.logger.info('Raised as expected: {}'.format(e))
+            else:
+                raise AssertionError('make_histogram should raise if the histograms can not be read')
+            assert hydra.all_hist is hists
+        self.logger.info('Test failed read out passed.')
+
+    def test_continuous_with_error(self):
+        """ If the callback of make_continuous_histograms raises, the measurement is stopped anyway and the
+        measurement control is back to single shot."""
+        self.logger.debug('Starting unit_test on an error during continuous histograms')
+        with HydraInstrument(settings=self.settings) as hydra:
+            hydra.set_mode('Continuous')
+            hydra.set_histogram(leng=8192, res=4*ur('ps'))
+
+            def callback(k, hists):
+                if k == 1:
+                    raise ValueError('error in the callback')
+            try:
+                hydra.make_continuous_histograms(20*ur('ms'), 5, callback=callback)
+            except ValueError as e:
+                self.logger.info('Raised as expected: {}'.format(e))
+            else:
+                raise AssertionError('The error of the callback was not raised')
+            if self.settings['controller'].endswith('Dummy'):
+                assert not hydra.controller._running
+                assert hydra.controller._meas_control == 'SINGLESHOT_CTC'
+            assert len(hydra.make_continuous_histograms(20*ur('ms'), 3)) == 3
+        self.logger.info('Test continuous with error passed.')
+
+    def _mean_arrival(self, hydra, channel, input_offset, sync_offset):
+        """ Mean arrival time (ps) of the photons of channel after the sync, from a histogram and from T2 records,
+        with these offsets (set_mode sets the offsets of the configuration again, so they are set in every mode)."""
+        def set_offsets():
+            hydra.controller.input_offset(channel, input_offset)
+            hydra.controller.sync_offset(sync_offset)
+        set_offsets()
+        period = 1e12 / hydra.controller.sim['sync_rate']
+        hydra.set_histogram(leng=65536, res=1*ur('ps'))
+        hist = hydra.make_histogram(0.2*ur('s'), channel)[:int(period)]      # the histogram repeats every period
+        t = np.arange(len(hist)) + 0.5
+        from_hist = (t * hist).sum() / hist.sum()
+
+        hydra.set_mode('T2')
+        hydra.controller.sync_divider(16)
+        set_offsets()
+        hydra.controller.start_measurement(200)
+        records = []
+        while hydra.controller._running:
+            records.append(hydra.controller.read_fifo().copy())
+        records.append(hydra.controller.read_fifo().copy())
+        channels, times, _ = decode_t2_records(np.concatenate(records))
+        sync_times = times[channels < 0]
+        photons = times[channels == channel]
+        previous = np.searchsorted(sync_times, photons) - 1
+        after_sync = np.mod(photons[previous >= 0] - sync_times[previous[previous >= 0]], period)
+        hydra.set_mode('Histogram')
+        return from_hist, after_sync.mean()
+
+    def test_offsets_t2(self):
+        """ The input and sync offsets should move the photons of the dummy as much in T2 mode as in histogram mode."""
+        self.logger.debug('Starting unit_test on the offsets in T2 mode')
+        settings = dict(self.settings, count_rate=[100000, 1000000], seed=1)
+        with HydraInstrument(settings=settings) as hydra:
+            if not self.settings['controller'].endswith('Dummy'):
+                self.logger.info('The T2 offsets can only be compared with the dummy.')
+                return
+            from_hist, from_t2 = self._mean_arrival(hydra, 1, 300, 100)
+        self.logger.info('Mean arrival after the sync: {:.1f} ps in histogram mode, {:.1f} ps in T2 mode'.format(
+            from_hist, from_t2))
+        assert abs(from_hist - from_t2) < 20
+        self.logger.info('Test offsets in T2 mode passed.')
+
+
+if __name__ == "__main__":
+
+    dummy_mode = [True]  # the alignment can only be checked with the dummy, which has known delays
+    for dummy in dummy_mode:
+        print('Running dummy={} tests.'.format(dummy))
+        with UTestHydraInstrument(settings={'devidx': 0, 'mode': 'Histogram', 'clock': 'Internal',
+                                            'controller': 'hyperion.controller.picoquant.hydraharp/HydraharpDummy'}) as t:
+            t.test_align_delay()
+            t.test_align_different_lifetimes()
+            t.test_failed_readout()
+            t.test_continuous_with_error()
+            t.test_offsets_t2()
+
+        print('\n\n\n Done with dummy={} tests. \n\n\n NO PROBLEM, you are great!!!! \n\n\n '.format(dummy))
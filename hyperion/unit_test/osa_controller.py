@@ -0,0 +1,162 @@
+"""
+===================
+Test OSA controller
+===================
+
+This class aims to unit_test the waiting for the end of a sweep (with service request events and by polling
+the status byte) and the transfer of the wavelengths of the controller class: osa_controller.py
+
+In dummy mode it uses a simulated VISA resource, which counts the WDATA transfers and the reads of the status byte.
+
+:copyright: by Hyperion Authors, see AUTHORS for more details.
+:license: BSD, see LICENSE for more details.
+
+"""
+import time
+from hyperion import logging
+from hyperion.controller.osa.osa_controller import OsaController, OsaControllerDummy
+
+
+class UTestOsa():
+    """ Class to unit_test the OSA controller."""
+    def __init__(self, settings):
+        """ initialize
+
+        """
+        self.logger = logging.getLogger(__name__)
+        self.logger.info('Created UTestOsa class.')
+        self.logger.info('Testing in dummy={}'.format(settings['dummy']))
+        self.settings = settings
+        self.dummy = settings['dummy']
+        self.dev = self._open(settings)
+
+    def _open(self, settings):
+        if self.dummy:
+            dev = OsaControllerDummy(settings)
+        else:
+            dev = OsaController(settings)
+        dev.initialize()
+        return dev
+
+    # the next two methods are needed so the context manager 'with' works.
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.finalize()
+
+    def finalize(self):
+        """ closes connection """
+        self.dev.finalize()
+
+    def _timed_sweep(self, dev, timeout=2):
+        """ Performs a sweep and returns what wait_for_osa returned, the time it took and the reads of the
+        status byte while waiting (dummy only)."""
+        dev.perform_single_sweep()
+        reads = dev._osa.stb_reads if self.dummy else 0
+        t = time.time()
+        done = dev.wait_for_osa(timeout)
+        elapsed = time.time() - t
+        if self.dummy:
+            reads = dev._osa.stb_reads - reads
+        return done, elapsed, reads
+
+    def test_wait_srq(self):
+        """ With service request events, wait_for_osa returns at the end of the sweep, reading the status
+        byte only once, and returns False if the timeout expires first."""
+        self.logger.debug('Starting unit_test on waiting with service requests')
+        assert self.dev._srq
+        done, elapsed, reads = self._timed_sweep(self.dev)
+        self.logger.info('Sweep done after {:.3f} s, {} reads of the status byte'.format(elapsed, reads))
+        assert done
+        if self.dummy:
+            sweep_time = self.dev._osa.sweep_time
+            assert sweep_time <= elapsed < sweep_time + 0.05
+            assert reads == 1
+            self.dev._osa.sweep_time = 1
+            done, elapsed, _ = self._timed_sweep(self.dev, timeout=0.2)
+            self.dev._osa.sweep_time = sweep_time
+            assert not done
+            assert 0.19 < elapsed < 0.3
+            self.dev.wait_for_osa(2)
+        self.logger.info('Test wait with service requests passed.')
+
+    def test_srq_fallback(self):
+        """ If waiting for the service request fails, wait_for_osa polls the status byte instead."""
+        self.logger.debug('Starting unit_test on the fallback to polling')
+        if not self.dummy:
+            self.logger.info('The fallback can only be tested with the dummy.')
+            return
+        self.dev._osa.event_error = True
+        try:
+            done, elapsed, reads = self._timed_sweep(self.dev)
+        finally:
+            self.dev._osa.event_error = False
+        self.logger.info('Sweep done after {:.3f} s, {} reads of the status byte'.format(elapsed, reads))
+        assert done
+        assert not self.dev._srq
+        assert reads > 1
+        self.dev._enable_srq()
+        assert self.dev._srq
+        self.logger.info('Test fallback to polling passed.')
+
+    def test_wait_polling(self):
+        """ On an interface without service request events, wait_for_osa polls the status byte."""
+        self.logger.debug('Starting unit_test on waiting by polling')
+        if not self.dummy:
+            self.logger.info('The interface without events can only be simulated with the dummy.')
+            return
+        dev = self._open(dict(self.settings, srq=False))
+        try:
+            assert not dev._srq
+            done, elapsed, reads = self._timed_sweep(dev)
+            self.logger.info('Sweep done after {:.3f} s, {} reads of the status byte'.format(elapsed, reads))
+            assert done
+            assert dev._osa.sweep_time <= elapsed < dev._osa.sweep_time + dev.poll_interval[1]
+            assert reads > 1
+        finally:
+            dev.finalize()
+        self.logger.info('Test wait by polling passed.')
+
+    def test_wavelengths(self):
+        """ The wavelengths are only transferred again after start_wav, end_wav or sample_points changed,
+        or with refresh_wavelengths."""
+        self.logger.debug('Starting unit_test on the transfer of the wavelengths')
+
+        def transfers():
+            return self.dev._osa.transfers['WDATA'] if self.dummy else 0
+
+        def check(expected, refresh=False):
+            before = transfers()
+            wav, spec = self.dev.get_data(refresh_wavelengths=refresh)
+            assert len(wav) == len(spec) == self.dev._sample_points
+            assert abs(wav[0] - self.dev._start_wav) < 0.01 and abs(wav[-1] - self.dev._end_wav) < 0.01
+            if self.dummy:
+                assert transfers() - before == expected, 'Expected {} WDATA transfers'.format(expected)
+
+        check(1)
+        check(0)
+        self.dev.start_wav = 950
+        check(1)
+        self.dev.start_wav = 950
+        check(0)
+        self.dev.end_wav = 1100
+        check(1)
+        self.dev.sample_points = 301
+        check(1)
+        check(1, refresh=True)
+        self.logger.info('Test transfer of the wavelengths passed.')
+
+
+if __name__ == "__main__":
+
+    dummy_mode = [True]  # add False here to also unit_test the real device with connection
+    for dummy in dummy_mode:
+        print('Running dummy={} tests.'.format(dummy))
+        with UTestOsa(settings={'port': 'AUTO', 'dummy': dummy, 'sweep_time': 0.1}) as t:
+            t.test_wait_srq()
+            t.test_srq_fallback()
+            t.test_wait_polling()
+            t.test_wavelengths()
+
+        print('\n\n\n Done with dummy={} tests. \n\n\n NO PROBLEM, you are great!!!! \n\n\n '.format(dummy))
@@ -0,0 +1,134 @@
+"""
+========================
+Test TBS1202B controller
+========================
+
+This class aims to unit_test the binary waveform transfer of the controller class: simple_TBS1202B.py
+and to benchmark it against the ASCII transfer.
+
+In dummy mode it uses a simulated VISA resource, with a simulated transfer time per byte.
+
+:copyright: by Hyperion Authors, see AUTHORS for more details.
+:license: BSD, see LICENSE for more details.
+
+"""
+import time
+import numpy as np
+from hyperion import logging
+from hyperion.controller.tektronix.simple_TBS1202B import TBS1202B, TBS1202BDummy
+
+
+class UTestTBS1202B():
+    """ Class to unit_test the TBS1202B controller."""
+    def __init__(self, settings):
+        """ initialize
+
+        """
+        self.logger = logging.getLogger(__name__)
+        self.logger.info('Created UTestTBS1202B class.')
+        self.logger.info('Testing in dummy={}'.format(settings['dummy']))
+        self.dummy = settings['dummy']
+        if self.dummy:
+            self.dev = TBS1202BDummy(settings['instrument_id'], byte_time=settings['byte_time'])
+        else:
+            self.dev = TBS1202B(settings['instrument_id'])
+        self.dev.initiate()
+
+    # the next two methods are needed so the context manager 'with' works.
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.finalize()
+
+    def finalize(self):
+        """ closes connection """
+        self.dev.finalize()
+
+    def test_binary_formats(self):
+        """ All binary formats should give the same curve as the ASCII transfer."""
+        self.logger.debug('Starting unit_test on binary formats')
+        self.dev._set_source(1)     # acquire_curve uses the current source
+        x_ascii, y_ascii = self.dev.acquire_curve()
+        for encoding in ['RIB', 'RPB']:
+            for width in [1, 2]:
+                x, y = self.dev.acquire_curve_binary(channel=1, encoding=encoding, width=width)
+                assert isinstance(y, np.ndarray) and len(y) == len(y_ascii)
+                if self.dummy:      # a real oscilloscope takes a new curve in between
+                    assert np.allclose(y, y_ascii), 'Format {} width {} differs from ASCII'.format(encoding, width)
+                    assert np.allclose(x, x_ascii)
+                self.logger.info('Binary format {} width {} passed.'.format(encoding, width))
+
+    def test_cached_scaling(self):
+        """ The scaling parameters should only be asked once per channel and format."""
+        queries = []
+        query = self.dev.rsc.query
+        self.dev.rsc.query = lambda msg: queries.append(msg) or query(msg)
+        try:
+            self.dev.invalidate_scaling()
+            for k in range(5):
+                self.dev.acquire_curve_binary(channel=1)
+                self.dev.acquire_curve_binary(channel=2)
+        finally:
+            self.dev.rsc.query = query
+        wfmp = [q for q in queries if q.startswith('WFMP')]
+        assert len(wfmp) == 2, 'Asked the scaling {} times'.format(len(wfmp))
+        self.logger.info('Test cached scaling passed.')
+
+    def test_channels(self):
+        """ Repeated acquisition of two channels."""
+        done = []
+        t, data = self.dev.acquire_channels(channels=(1, 2), repeat=3, stop=1000, callback=lambda k, d: done.append(k))
+        assert data.shape == (3, 2, 1000) and len(t) == 1000
+        assert done == [0, 1, 2]
+        self.logger.info('Test channels passed.')
+
+    def test_single_sequence(self):
+        """ Single sequence acquisitions put back the stop after mode and run/stop state, also after an error."""
+        mode = (self.dev.rsc.query('ACQ:STOPA?').strip(), self.dev.rsc.query('ACQ:STATE?').strip())
+        t, data = self.dev.acquire_channels(channels=(1,), repeat=2, stop=500, single=True)
+        assert data.shape == (2, 1, 500)
+        assert (self.dev.rsc.query('ACQ:STOPA?').strip(), self.dev.rsc.query('ACQ:STATE?').strip()) == mode
+
+        def callback(k, d):
+            raise ValueError('error in the callback')
+        try:
+            self.dev.acquire_channels(channels=(1,), repeat=2, stop=500, single=True, callback=callback)
+        except ValueError as e:
+            self.logger.info('Raised as expected: {}'.format(e))
+        else:
+            raise AssertionError('The error of the callback was not raised')
+        assert (self.dev.rsc.query('ACQ:STOPA?').strip(), self.dev.rsc.query('ACQ:STATE?').strip()) == mode
+        self.logger.info('Test single sequence passed.')
+
+    def benchmark(self, repeat=10):
+        """ Time per curve for ASCII and binary transfer."""
+        t = time.perf_counter()
+        for k in range(repeat):
+            self.dev.acquire_curve()
+        ascii_time = (time.perf_counter() - t) / repeat
+        times = {}
+        for width in [1, 2]:
+            t = time.perf_counter()
+            for k in range(repeat):
+                self.dev.acquire_curve_binary(channel=1, width=width)
+            times[width] = (time.perf_counter() - t) / repeat
+        self.logger.info('Time per curve: ASCII {:.1f} ms, binary WID 1 {:.1f} ms, binary WID 2 {:.1f} ms'.format(
+            ascii_time * 1e3, times[1] * 1e3, times[2] * 1e3))
+        assert times[1] < ascii_time
+
+
+if __name__ == "__main__":
+
+    dummy_mode = [True]  # add False here to also unit_test the real device with connection
+    for dummy in dummy_mode:
+        print('Running dummy={} tests.'.format(dummy))
+        # byte_time 1e-6 s simulates a transfer of about 1 MB/s
+        with UTestTBS1202B(settings={'instrument_id': '0x0368', 'dummy': dummy, 'byte_time': 1e-6}) as t:
+            t.test_binary_formats()
+            t.test_cached_scaling()
+            t.test_channels()
+            t.test_single_sequence()
+            t.benchmark()
+
+        print('\n\n\n Done with dummy={} tests. \n\n\n NO PROBLEM, you are great!!!! \n\n\n '.format(dummy))
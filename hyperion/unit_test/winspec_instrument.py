@@ -0,0 +1,143 @@
+"""
+=======================
+Test Winspec instrument
+=======================
+
+This class aims to unit_test the spectrum and series acquisition and the dark and flat field correction of the
+instrument class: winspec_instr.py
+
+In dummy mode it uses the simulated Winspec (WinspecContrDummy), so it runs without Windows and a spectrometer.
+
+:copyright: by Hyperion Authors, see AUTHORS for more details.
+:license: BSD, see LICENSE for more details.
+
+"""
+import numpy as np
+from hyperion import logging, Q_
+from hyperion.instrument.spectrum.winspec_instr import WinspecInstr
+
+
+class UTestWinspecInstr():
+    """ Class to unit_test the Winspec instrument."""
+    def __init__(self, settings):
+        """ initialize
+
+        """
+        self.logger = logging.getLogger(__name__)
+        self.logger.info('Created UTestWinspecInstr class.')
+        self.logger.info('Testing in dummy={}'.format(settings['dummy']))
+        self.ws = WinspecInstr(settings)
+        self.ws.exposure_time = Q_('50 ms')
+
+    # the next two methods are needed so the context manager 'with' works.
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.finalize()
+
+    def finalize(self):
+        """ closes connection """
+        self.ws.finalize()
+
+    def test_spectrum_copy(self):
+        """ take_spectrum returns an array that the next frame does not overwrite, unless copy is False."""
+        self.logger.debug('Starting unit_test on spectrum copies')
+        first = self.ws.take_spectrum(as_list=False)
+        kept = first.copy()
+        second = self.ws.take_spectrum(as_list=False)
+        assert not np.shares_memory(first, second)
+        assert np.array_equal(first, kept)
+        fast = self.ws.take_spectrum(as_list=False, copy=False)
+        assert np.shares_memory(fast, self.ws.take_spectrum(as_list=False, copy=False))
+        self.logger.info('Test spectrum copy passed.')
+
+    def test_series_with_correction(self, n_frames=3):
+        """ A series with dark and flat correction should give complete, corrected frames:
+        not the incomplete (all zero) frames minus the dark."""
+        self.logger.debug('Starting unit_test on series with correction')
+        ws = self.ws
+        ws.correction = False
+        raw = ws.take_series(n_frames)
+        dark = ws.take_dark()
+        ws.correction = True
+        try:
+            corrected = ws.take_series(n_frames)
+            assert corrected.shape == raw.shape
+            expected = raw.mean() - dark.mean()
+            for k in range(n_frames):
+                assert abs(corrected[k].mean() - expected) < 0.05 * raw.mean(), \
+                    'Frame {} has mean {:.1f}, expected {:.1f}'.format(k, corrected[k].mean(), expected)
+            self.logger.info('Series with dark correction passed.')
+
+            ws.take_flat()
+            corrected = ws.take_series(n_frames)
+            for k in range(n_frames):
+                assert corrected[k].mean() > -0.5 * dark.mean(), 'Frame {} is (zeros - dark)'.format(k)
+                assert np.isfinite(corrected[k]).all()
+            self.logger.info('Series with dark and flat correction passed.')
+        finally:
+            ws.correction = False
+            ws.clear_corrections()
+        self.logger.info('Test series with correction passed.')
+
+    def test_series_with_error(self, n_frames=5):
+        """ If the callback of take_series raises, Winspec stops acquiring and the number of frames is set back."""
+        self.logger.debug('Starting unit_test on an error during a series')
+        ws = self.ws
+        previous_frames = ws.controller.exp_get('SEQUENTS')[0]
+
+        def callback(k, frame):
+            if k == 1:
+                raise ValueError('error in the callback')
+        try:
+            ws.take_series(n_frames, callback=callback)
+        except ValueError as e:
+            self.logger.info('Raised as expected: {}'.format(e))
+        else:
+            raise AssertionError('The error of the callback was not raised')
+        assert ws.controller.exp_get('SEQUENTS')[0] == previous_frames
+        ws.wait_till_finished(timeout=Q_('2 s'))
+        assert not ws.controller.exp_get('RUNNING_EXPERIMENT')[0]
+        assert len(ws.take_series(2)) == 2
+        self.logger.info('Test series with error passed.')
+
+    def test_series_with_auto_dark(self, n_frames=10):
+        """ A series that needs a dark first takes dark_frames single frames for it, not dark_frames series."""
+        self.logger.debug('Starting unit_test on a series with automatic dark')
+        ws = self.ws
+        frames = []
+        start = ws.controller.exp.Start
+
+        def counting_start(doc):
+            result = start(doc)
+            frames.append(ws.controller.exp_get('SEQUENTS')[0])
+            return result
+        ws.controller.exp.Start = counting_start
+        ws.clear_corrections()
+        ws.correction, ws.auto_dark = True, True
+        try:
+            series = ws.take_series(n_frames)
+        finally:
+            ws.controller.exp.Start = start
+            ws.correction = False
+            ws.clear_corrections()
+        assert len(series) == n_frames
+        self.logger.info('Frames per acquisition: {}'.format(frames))
+        assert frames == [1] * ws.dark_frames + [n_frames], 'Frames acquired: {}'.format(frames)
+        self.logger.info('Test series with auto dark passed.')
+
+
+if __name__ == "__main__":
+
+    dummy_mode = [True]  # add False here to also unit_test the real device with connection
+    for dummy in dummy_mode:
+        print('Running dummy={} tests.'.format(dummy))
+        with UTestWinspecInstr(settings={'port': 'None', 'dummy': dummy,
+                                         'controller': 'hyperion.controller.princeton.winspec_contr/WinspecContr'}) as t:
+            t.test_spectrum_copy()
+            t.test_series_with_correction()
+            t.test_series_with_error()
+            t.test_series_with_auto_dark()
+
+        print('\n\n\n Done with dummy={} tests. \n\n\n NO PROBLEM, you are great!!!! \n\n\n '.format(dummy))
@@ -74,6 +74,8 @@ class Hydraharp_aligning_GUI(BaseGui):
 
         self.initUI()
 
+        # the count rates are read by a thread in the instrument, the timer only shows the latest values
+        self.restart_monitor()
         self.timer = QTimer()
         self.timer.timeout.connect(self.ask_counts)
         self.timer.start(100)       #time in ms
@@ -125,13 +127,47 @@ class Hydraharp_aligning_GUI(BaseGui):
 
     def set_pausetime(self):
         self.logger.debug('Should set the pause time here')
-        self.pausetime = self.gui.doubleSpinBox_pause.value()*ur('ms')
-        self.logger.debug('Chosen time: {}'.format(self.pausetime))
+        pausetime = self.gui.doubleSpinBox_pause.value()*ur('ms')
+        self.logger.debug('Chosen time: {}'.format(pausetime))
+        if not self.restart_monitor(pausetime=pausetime):
+            self._show_value(self.gui.doubleSpinBox_pause, self.pausetime.m_as('ms'))
 
     def set_lengthaxis(self):
         self.logger.debug('Should set the length of the axis here')
-        self.lengthaxis = self.gui.doubleSpinBox_timeaxis.value()*ur('s')
-        self.logger.debug('Chosen length of axis: {}'.format(self.lengthaxis))
+        lengthaxis = self.gui.doubleSpinBox_timeaxis.value()*ur('s')
+        self.logger.debug('Chosen length of axis: {}'.format(lengthaxis))
+        if not self.restart_monitor(lengthaxis=lengthaxis):
+            self._show_value(self.gui.doubleSpinBox_timeaxis, self.lengthaxis.m_as('s'))
+
+    def _show_value(self, spinbox, value):
+        """ Puts back the value in the spinbox, without calling its valueChanged methods."""
+        spinbox.blockSignals(True)
+        spinbox.setValue(value)
+        spinbox.blockSignals(False)
+
+    def restart_monitor(self, pausetime=None, lengthaxis=None):
+        """| (Re)starts the count rate monitor of the instrument, which samples every pause time
+        | and keeps enough samples to fill the time axis.
+        | The new pause time and length of the axis are only used if the plotting is not running.
+
+        :param pausetime: new pause time (None keeps the current one)
+        :type pausetime: pint quantity
+        :param lengthaxis: new length of the time axis (None keeps the current one)
+        :type lengthaxis: pint quantity
+
+        :return: True if the monitor was restarted
+        :rtype: bool
+        """
+        if self.running:
+            self.logger.warning('Stop the plotting before changing the pause time or axis length.')
+            return False
+        if pausetime is not None:
+            self.pausetime = pausetime
+        if lengthaxis is not None:
+            self.lengthaxis = lengthaxis
+        samples = max(int(self.lengthaxis.m_as('s') / self.pausetime.m_as('s')), 2)
+        self.hydra_instrument.start_count_rate_monitor(self.pausetime, samples)
+        return True
 
     def set_channel(self):
         self.sync = self.checkBox_sync.isChecked()
@@ -152,68 +188,66 @@ class Hydraharp_aligning_GUI(BaseGui):
 
     #Actual methods doing something
     #-----------------------------------------------------------------------------------------
+    @staticmethod
+    def _channel_counts(data, channel):
+        """ Count rates of a count channel from samples of the count rate monitor (columns: time, sync, channel 0, ...).
+        A channel the device does not have gives zeros.
+
+        :param data: one sample, or array of samples
+        :type data: array
+        :param channel: count channel, 0 or 1
+        :type channel: int
+
+        :return: the count rate(s) of the channel
+        :rtype: float or array
+        """
+        data = np.asarray(data)
+        if data.shape[-1] > 2 + channel:
+            return data[..., 2 + channel]
+        return np.zeros(data.shape[:-1])
+
     def ask_counts(self):
-        """ | Connects to the device and read out the count rate of either the sync or on of the count channels.
+        """ | Reads the latest count rates of the sync and the count channels from the count rate monitor of the instrument.
         | Displays this on the labels on the gui, which are updated via the timer in the init.
         """
-        #self.logger.debug('Asking for counts')
-
-        self.something_selected = False
-
-        if self.sync:
-            self.sync_counts = self.hydra_instrument.sync_rate()
-            #self.logger.debug("{}".format(self.sync_counts))
-            self.gui.label_counts_sync.setText(str(self.sync_counts))
-            self.something_selected = True
-        else:
-            self.gui.label_counts_sync.setText('currently unavailable')
-
-        if self.chan1:
-            self.counts1 = self.hydra_instrument.count_rate(0)
-            #self.logger.debug("{}".format(self.counts1))
-            self.something_selected = True
-            self.gui.label_counts1.setText(str(self.counts1))
-        else:
-            self.gui.label_counts1.setText('currently unavailable')
-
-        if self.chan2:
-            self.counts2 = self.hydra_instrument.count_rate(1)
-            #self.logger.debug("{}".format(self.counts2))
-            self.gui.label_counts2.setText(str(self.counts2))
-            self.something_selected = True
-        else:
-            self.gui.label_counts2.setText('currently unavailable')
-
-        if self.something_selected == False:
+        self.something_selected = self.sync or self.chan1 or self.chan2
+        if not self.something_selected:
             self.logger.warning('Nothing is selected')
 
+        last = self.hydra_instrument.rate_buffer.last()
+        if last is None:
+            return
+        self.sync_counts = last[1] * ur('cps')
+        self.counts1 = float(self._channel_counts(last, 0)) * ur('cps')
+        self.counts2 = float(self._channel_counts(last, 1)) * ur('cps')
+
+        for selected, label, counts in ((self.sync, self.gui.label_counts_sync, self.sync_counts),
+                                        (self.chan1, self.gui.label_counts1, self.counts1),
+                                        (self.chan2, self.gui.label_counts2, self.counts2)):
+            if selected:
+                label.setText(str(counts))
+            else:
+                label.setText('currently unavailable')
 
     def start_plotting(self):
-        """| Prepares for plotting by making a time axis based on the axis length and pause time, and starts an empty counts array.
-        | Then opens 1 to 3 plot windows and a thread to plot them, depending on the selected channels.
+        """| Opens 1 to 3 plot windows, depending on the selected channels, and a thread to plot them.
         """
         self.logger.info('Should start counting here')
 
         self.logger.debug('Settings: {}, {}, {}'.format(self.exp_type, self.pausetime, self.lengthaxis))
 
-        self.time_axis = np.linspace(0, self.lengthaxis.m_as('s') * self.pausetime.m_as('s'), int(self.lengthaxis.m_as('s'))) * ur('s')
-        self.logger.debug("{}".format(self.time_axis))
-
         if self.something_selected:
             if self.sync:
                 self.draw0 = DrawCounts()
                 self.draw0.counts_plot.setTitle("<span style=\"color:yellow;font-size:30px\">Counts on sync channel </span>")
-                #self.draw0.counts_plot.plot(self.time_axis.m_as('s'), Counts, clear=True, pen=self.pen)
 
             if self.chan1:
                 self.draw1 = DrawCounts()
                 self.draw1.counts_plot.setTitle("<span style=\"color:orange;font-size:30px\">Counts on channel 1 </span>")
-                #self.draw1.counts_plot.plot(self.time_axis.m_as('s'), Counts, clear=True, pen=self.pen)
 
             if self.chan2:
                 self.draw2 = DrawCounts()
                 self.draw2.counts_plot.setTitle("<span style=\"color:red;font-size:30px\">Counts on channel 2 </span>")
-                #self.draw2.counts_plot.plot(self.time_axis.m_as('s'), Counts, clear=True, pen=self.pen)
 
             self.plotting_thread = WorkThread(self.update_plot)
             self.plotting_thread.start()
@@ -224,86 +258,39 @@ class Hydraharp_aligning_GUI(BaseGui):
 
     def update_plot(self):
         """| This method is called and threaded from start_plotting, depending on the selected channels it plots in 1 to 3 graphs.
-        | It either works for a Finite amount of time or works infinitely, to make aligning possible.
-        | It draws the plot with the time axis, which is the same for all channels,
-        | and the Counts, that are a numpy array that is constantly filled with the current Rate.
-        | Depending on the channel, the counts are plotted in three different self.draw windows.
+        | It either works for a Finite amount of time (until the time axis is full) or works infinitely, to make aligning possible.
+        | The counts are not asked here, but read from the ring buffer of the count rate monitor of the instrument,
+        | so every update only costs a view on that buffer, no matter how long the time axis is.
         | After the plotting is finished, the prepare_save method is started, so the name to be given to a potential file is set.
-
-        :param Counts: array of the size of the axis length
-        :type Counts: numpy array
         """
         self.running = True
-
-        self.Sync_counts_array = np.zeros(int(self.lengthaxis.m_as('s')))
-        self.Counts1_array = np.zeros(int(self.lengthaxis.m_as('s')))
-        self.Counts2_array = np.zeros(int(self.lengthaxis.m_as('s')))
-
-        if self.exp_type == 'Finite':
-
-            for ii in range(0, int(self.lengthaxis.m_as('s'))):
-                if self.running == False:
-                    break
-                else:
-                    if self.sync:
-                        curr_sync_Rate = self.sync_counts
-                        self.Sync_counts_array[ii] = curr_sync_Rate.m_as('cps')
-                        self.logger.debug('Counts: {}'.format(self.Sync_counts_array))
-
-                        self.draw0.counts_plot.plot(self.time_axis, self.Sync_counts_array, clear = True,pen=self.pen)
-
-                    if self.chan1:
-                        currRate1 = self.counts1
-                        self.Counts1_array[ii] = currRate1.m_as('cps')
-                        self.logger.debug('Counts: {}'.format(self.Counts1_array))
-
-                        self.draw1.counts_plot.plot(self.time_axis, self.Counts1_array, clear = True, pen=self.pen)
-
-                    if self.chan2:
-                        currRate2 = self.counts2
-                        self.Counts2_array[ii] = currRate2.m_as('cps')
-                        self.logger.debug('Counts: {}'.format(self.Counts2_array))
-
-                        self.draw2.counts_plot.plot(self.time_axis, self.Counts2_array, clear = True, pen=self.pen)
-
-                    time.sleep(self.pausetime.m_as('s'))
-
-        elif self.exp_type == 'Infinite':
-            ii=0
-            while self.running:
+        buffer = self.hydra_instrument.rate_buffer
+        start_count = buffer.count
+
+        while self.running:
+            new = buffer.count - start_count
+            data = buffer.view()
+            if self.exp_type == 'Finite':
+                data = data[len(data) - min(new, len(data)):]
+            if len(data):
+                times = data[:, 0] - data[0, 0]
                 if self.sync:
-                    curr_sync_Rate = self.sync_counts
-                    if ii < int(self.lengthaxis.m_as('s')):
-                        self.Sync_counts_array[ii] = curr_sync_Rate.m_as('cps')
-                    else:
-                        self.Sync_counts_array = np.roll(self.Sync_counts_array, -1)
-                        self.Sync_counts_array[-1] = curr_sync_Rate.m_as('cps')
-                        self.logger.debug('{}'.format(self.Sync_counts_array))
-
-                    self.draw0.counts_plot.plot(self.time_axis, self.Sync_counts_array, clear=True, pen=self.pen)
-
+                    self.draw0.counts_plot.plot(times, data[:, 1], clear=True, pen=self.pen)
                 if self.chan1:
-                    currRate1 = self.counts1
-                    if ii < int(self.lengthaxis.m_as('s')):
-                        self.Counts1_array[ii] = currRate1.m_as('cps')
-                    else:
-                        self.Counts1_array = np.roll(self.Counts1_array, -1)
-                        self.Counts1_array[-1] = currRate1.m_as('cps')
-                        self.logger.debug('{}'.format(self.Counts1_array))
-                    self.draw1.counts_plot.plot(self.time_axis, self.Counts1_array, clear=True, pen=self.pen)
-
+                    self.draw1.counts_plot.plot(times, self._channel_counts(data, 0), clear=True, pen=self.pen)
                 if self.chan2:
-                    currRate2 = self.counts2
-                    if ii < int(self.lengthaxis.m_as('s')):
-                        self.Counts2_array[ii] = currRate2.m_as('cps')
-                    else:
-                        self.Counts2_array = np.roll(self.Counts2_array, -1)
-                        self.Counts2_array[-1] = currRate2.m_as('cps')
-                        self.logger.debug('{}'.format(self.Counts2_array))
-                    self.draw2.counts_plot.plot(self.time_axis, self.Counts2_array, clear=True, pen=self.pen)
-
-                ii+=1
-                time.sleep(self.pausetime.m_as('s'))
+                    self.draw2.counts_plot.plot(times, self._channel_counts(data, 1), clear=True, pen=self.pen)
+            if self.exp_type == 'Finite' and new >= buffer.length:
+                break
+            time.sleep(self.pausetime.m_as('s'))
+
+        data = buffer.view(copy=True)
+        if self.exp_type == 'Finite':
+            data = data[len(data) - min(buffer.count - start_count, len(data)):]
+        self.time_axis = (data[:, 0] - data[0, 0]) * ur('s') if len(data) else np.array([]) * ur('s')
+        self.Sync_counts_array = data[:, 1]
+        self.Counts1_array = self._channel_counts(data, 0)
+        self.Counts2_array = self._channel_counts(data, 1)
 
         self.running = False
         self.prepare_save()
@@ -320,6 +307,13 @@ class Hydraharp_aligning_GUI(BaseGui):
         else:
             self.logger.warning('There is nothing to stop.')
 
+    def closeEvent(self, event):
+        """ Stops the timer, the plotting and the count rate monitor of the instrument when the window is closed."""
+        self.timer.stop()
+        self.running = False
+        self.hydra_instrument.stop_count_rate_monitor()
+        super().closeEvent(event)
+
     def prepare_save(self):
         """| Enables the save button and prepares for saving by constructing a filename based on the data taken,
         | and filling that name in the input.
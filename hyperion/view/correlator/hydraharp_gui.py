@@ -14,6 +14,7 @@ from PyQt5.QtWidgets import *
 from hyperion.instrument.correlator.hydraharp_instrument import HydraInstrument
 from hyperion.view.general_worker import WorkThread
 from hyperion.view.base_guis import BaseGui, BaseGraph, TimeAxisItem
+from hyperion.tools.array_tools import DecimationPyramid
 from hyperion import ur, root_dir
 import pyqtgraph as pg
 import pyqtgraph.exporters
@@ -59,13 +60,18 @@ class Hydraharp_GUI(BaseGui):
         self.channel = '0'
         self.time_passed = 0*ur('s')     #which also makes sure that the units are the same
 
+        self.hist_interval = 1*ur('s')  # how often the intermediate histogram is shown while measuring
         self.max_time = 24*ur('hour')
         self.max_length = 65536
 
         self.endtime = []
-        self.time_axis = []
+        self.time_step = 1      # time per bin of the histogram, in self.units
         self.units = 's'
 
+        self.histogram = np.array([])
+        self.pyramid = DecimationPyramid()  # min/max/sum levels of the histogram, so only visible pixels are drawn
+        self.curve = None
+
         self.hydra_instrument.configurate()
         self.initUI()
 
@@ -327,8 +333,10 @@ class Hydraharp_GUI(BaseGui):
         self.endtime_label.setText(str(round(self.endtime.to(self.units), 4)))
 
         #self.logger.debug('endtime: {}, units: {}, array length: {}'.format(self.endtime, self.units, self.array_length))
-        self.time_axis = np.linspace(0, float(self.endtime.m_as(self.units)), self.array_length)
-        #self.logger.debug('time axis: {}'.format(self.time_axis))
+        self.time_step = float(self.endtime.m_as(self.units)) / max(self.array_length - 1, 1)
+        if self.draw is not None:
+            self.draw.histogram_plot.setLabel('bottom', "<span style=\"color:black;font-size:20px\"> Time ({}) </span>".format(self.units))
+            self.redraw()
 
     #------------------------------------------------------------------------------------
     def take_histogram(self):
@@ -354,7 +362,8 @@ class Hydraharp_GUI(BaseGui):
         self.timer.start(100)
         self.timer_plot.start(100)
         self.show_time_passed()
-        self.histogram_thread = WorkThread(self.hydra_instrument.make_histogram, self.integration_time, self.channel)
+        self.histogram_thread = WorkThread(self.hydra_instrument.make_histogram, self.integration_time, self.channel,
+                                           hist_interval=self.hist_interval)
         self.histogram_thread.start()
 
         #make it possible to press the save_histogram_button.(should be True)
@@ -365,29 +374,41 @@ class Hydraharp_GUI(BaseGui):
         self.show_time_passed()
 
     def update_plot(self):
-        pen = pg.mkPen(color=(0, 0, 0))  # makes the plotted lines black
+        """| Called by the plot timer. Only if the instrument has a new histogram, the decimation pyramid is updated
+        | and the visible part is drawn again.
+        """
         if self.hydra_instrument.hist_ended:
             self.take_histogram_button.setEnabled(True)
             self.timer_plot.stop()
             self.timer.stop()
-            self.histogram = self.hydra_instrument.hist
-            self.calculate_axis()
-            self.draw.histogram_plot.plot(self.time_axis, self.histogram, clear=True, pen=pen)
-            self.draw.histogram_plot.setLabel('bottom',
-                                              "<span style=\"color:black;font-size:20px\"> Time ({}) </span>".format(
-                                                  self.units))
-
         else:
             self.take_histogram_button.setEnabled(False)
-            self.histogram = self.hydra_instrument.hist
 
-            self.calculate_axis()
-            self.logger.debug(
-            'length time axis: {}, length histogram: {}'.format(len(self.time_axis), len(self.histogram)))
+        histogram = self.hydra_instrument.hist
+        if histogram is not self.histogram and len(histogram) > 0:
+            self.histogram = histogram
+            self.pyramid.update(histogram)
+            self.redraw()
 
-            if len(self.histogram) > 0:
-                self.draw.histogram_plot.plot(self.time_axis, self.histogram, clear=True)
-                self.draw.histogram_plot.setLabel('bottom', "<span style=\"color:black;font-size:20px\"> Time ({}) </span>".format(self.units))
+    def redraw(self, *args):
+        """| Draws the visible range of the histogram with at most two points (min and max) per pixel,
+        | taken from the decimation pyramid. It is connected to the x range of the plot, so zooming and panning
+        | only re-slice the pyramid instead of plotting the whole histogram again.
+        """
+        if self.draw is None or len(self.pyramid) == 0:
+            return
+        plot_item = self.draw.histogram_plot.getPlotItem()
+        if self.curve is None:
+            self.curve = plot_item.plot(pen=pg.mkPen(color=(0, 0, 0)))    # makes the plotted lines black
+            plot_item.sigXRangeChanged.connect(self.redraw)
+        if plot_item.getViewBox().autoRangeEnabled()[0]:
+            start, stop = 0, len(self.pyramid)
+        else:
+            x_min, x_max = plot_item.getViewBox().viewRange()[0]
+            start, stop = x_min / self.time_step, x_max / self.time_step
+        pixels = max(int(plot_item.getViewBox().width()), 100)
+        x, y = self.pyramid.segment(start, stop, pixels)
+        self.curve.setData(x * self.time_step, y)
 
     def save_histogram(self):
         """| In this method the made histogram gets saved.
@@ -440,12 +461,11 @@ class Hydraharp_GUI(BaseGui):
         return fileName + ".png"
 
     def stop_histogram(self):
-        """| Here the self.hydra_instrument.stop is set to True, which means the while loop in the instrument breaks.
-        | Afterwards, the hydraharp itself is actually set to stop.
+        """| Here the instrument is asked to stop, which wakes up and breaks the waiting loop in the instrument
+        | and actually stops the hydraharp itself.
         | To avoid errors, it is important to quit the thread.
         """
         self.logger.info('Histogram should stop here')
-        self.hydra_instrument.stop = True
         self.hydra_instrument.stop_histogram()
 
         if self.histogram_thread.isRunning:
@@ -454,7 +474,6 @@ class Hydraharp_GUI(BaseGui):
 
         self.hydra_instrument.time_passed = 0*ur('s')
         self.show_time_passed()
-        self.hydra_instrument.stop = False
 
 class DrawHistogram(pg.PlotWidget):
     """This will make a graph for the histogram.
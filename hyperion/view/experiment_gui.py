@@ -15,6 +15,7 @@ from PyQt5.QtWidgets import *
 import traceback
 import yaml
 from hyperion.tools.loading import get_class
+from hyperion.tools.port_tools import port_manager
 import pyqtgraph as pg
 from pyqtgraph.Qt import QtCore, QtGui
 import pyqtgraph.console
@@ -379,17 +380,19 @@ class ExpGui(QMainWindow):
         if not 'Instruments' in self.experiment.properties:
             QMessageBox.warning(self, 'No instruments specified', "No config loaded or no instruments listed in config file.", QMessageBox.Ok)
             return
-        try:
-            self.logger.debug('Removing instruments:')
-            self.experiment.remove_all_instruments()
-        except:
-            self.logger.warning('Error while removing instruments')
-        try:
-            self.logger.debug('Loading instruments:')
-            self.experiment.load_instruments()  # this loads both regular and meta instruments
-        except:
-            self.logger.warning('Error while loading instruments')
-            QMessageBox.warning(self, 'Loading instruments failed', "Perhaps a device is not connected or it's still in use by another process?", QMessageBox.Ok)
+        # ports and VISA resources released by the old instruments are reused by the new ones
+        with port_manager.keep_open():
+            try:
+                self.logger.debug('Removing instruments:')
+                self.experiment.remove_all_instruments()
+            except:
+                self.logger.warning('Error while removing instruments')
+            try:
+                self.logger.debug('Loading instruments:')
+                self.experiment.load_instruments()  # this loads both regular and meta instruments
+            except:
+                self.logger.warning('Error while loading instruments')
+                QMessageBox.warning(self, 'Loading instruments failed', "Perhaps a device is not connected or it's still in use by another process?", QMessageBox.Ok)
             # self.logger.debug('Closing open instruments')
             # self.experiment.load_instruments()
         # for inst in self.experiment.instruments_instances: